@@ -0,0 +1,222 @@
+import six
+import time
+
+from collections import OrderedDict, defaultdict
+from holster.emitter import Priority
+
+from disco.api.http import Routes, HTTPMethod
+from disco.util.logging import LoggingClass
+from disco.util.metrics import MetricsRegistry
+
+# Default TTLs (in seconds) of the routes which are cached, keyed by their name
+#  within `Routes`.
+DEFAULT_TTLS = {
+    'USERS_GET': 300,
+    'GUILDS_GET': 60,
+    'CHANNELS_GET': 60,
+    'GUILDS_ROLES_LIST': 60,
+    'GUILDS_EMOJIS_LIST': 300,
+    'INVITES_GET': 60,
+}
+
+
+def _channel_paths(event):
+    paths = ['/channels/{}'.format(event.channel.id)]
+    if event.channel.guild_id:
+        paths.append('/guilds/{}/channels'.format(event.channel.guild_id))
+    return paths
+
+
+# Functions returning the paths whose cached responses are invalidated by each
+#  gateway event.
+EVENT_INVALIDATIONS = {
+    'GuildUpdate': lambda e: ['/guilds/{}'.format(e.guild.id)],
+    'GuildDelete': lambda e: ['/guilds/{}'.format(e.id)],
+    'GuildRoleCreate': lambda e: ['/guilds/{}/roles'.format(e.guild_id)],
+    'GuildRoleUpdate': lambda e: ['/guilds/{}/roles'.format(e.guild_id)],
+    'GuildRoleDelete': lambda e: ['/guilds/{}/roles'.format(e.guild_id)],
+    'GuildEmojisUpdate': lambda e: ['/guilds/{}/emojis'.format(e.guild_id)],
+    'GuildMemberUpdate': lambda e: ['/guilds/{}/members/{}'.format(e.member.guild_id, e.member.id)],
+    'GuildMemberRemove': lambda e: ['/guilds/{}/members/{}'.format(e.guild_id, e.user.id)],
+    'ChannelCreate': _channel_paths,
+    'ChannelUpdate': _channel_paths,
+    'ChannelDelete': _channel_paths,
+    'PresenceUpdate': lambda e: ['/users/{}'.format(e.presence.user.id)],
+}
+
+
+class ResponseCache(LoggingClass):
+    """
+    A cache of responses to GET requests for read-mostly routes, used by an
+    `HTTPClient`. Each cached route has its own TTL, and the cache holds at most
+    `max_size` responses, evicting the least recently used.
+
+    Cached responses are invalidated by successful mutating requests, which
+    invalidate the responses for their own path and each of its parents (e.g.
+    modifying a role invalidates the guild's role list), and by gateway events
+    once bound to an emitter with `bind`.
+
+    Parameters
+    ----------
+    ttls : dict(tuple(HTTPMethod, str), float)
+        The TTL (in seconds) of each cached route.
+    max_size : int
+        The maximum number of responses cached.
+    metrics : Optional[`MetricsRegistry`]
+        The registry hits and misses are recorded within.
+    """
+    def __init__(self, ttls, max_size=1000, metrics=None):
+        super(ResponseCache, self).__init__()
+        self.ttls = ttls
+        self.max_size = max_size
+
+        self.metrics = metrics or MetricsRegistry()
+        self._m_hits = self.metrics.counter(
+            'disco_http_cache_hits', 'Requests served from the response cache', labels=('route', ))
+        self._m_misses = self.metrics.counter(
+            'disco_http_cache_misses', 'Cacheable requests not within the response cache', labels=('route', ))
+
+        # Maps keys to (expires at, response), in least recently used order
+        self._entries = OrderedDict()
+        self._paths = defaultdict(set)
+
+        # Requests in flight, mapped to whether their response may be cached
+        #  (they are not if their path was invalidated in the meantime).
+        self._pending = {}
+
+    @classmethod
+    def from_names(cls, ttls, *args, **kwargs):
+        """
+        Creates a cache from TTLs keyed by route name (e.g. 'GUILDS_GET').
+        """
+        return cls({getattr(Routes, name): ttl for name, ttl in six.iteritems(ttls)}, *args, **kwargs)
+
+    def bind(self, events):
+        """
+        Invalidates cached responses as gateway events are received on the given
+        emitter, before any other handlers see the events.
+        """
+        for name, func in six.iteritems(EVENT_INVALIDATIONS):
+            events.on(name, lambda event, func=func: self._invalidate_event(func, event), priority=Priority.BEFORE)
+
+    def _invalidate_event(self, func, event):
+        # Called inline by the emitter, which would silently discard any exception
+        try:
+            self.invalidate(*func(event))
+        except Exception:
+            self.log.exception('Failed to invalidate cached responses for %s: ', event.__class__.__name__)
+
+    def hit_ratio(self, route):
+        """
+        Returns the ratio of requests to the given route which were cached.
+        """
+        hits = self._m_hits.get(route=route[1])
+        total = hits + self._m_misses.get(route=route[1])
+        return float(hits) / total if total else 0.0
+
+    def get_key(self, route, path, params):
+        """
+        Returns the key for a request, or None if it is not cacheable.
+        """
+        if route not in self.ttls:
+            return None
+
+        if isinstance(params, dict):
+            params = tuple(sorted(six.iteritems(params)))
+
+        key = (path, params or None)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, route, key):
+        """
+        Returns the cached response for a key, or None.
+        """
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.time():
+            # Mark this entry as recently used
+            del self._entries[key]
+            self._entries[key] = entry
+
+            self._m_hits.inc(route=route[1])
+            return entry[1]
+
+        if entry:
+            self._remove(key)
+
+        self._m_misses.inc(route=route[1])
+        return None
+
+    def begin(self, key):
+        """
+        Marks a request for a key as in flight.
+        """
+        self._pending[key] = True
+
+    def end(self, key):
+        """
+        Marks a request for a key as finished, returning whether its response
+        may be cached.
+        """
+        return self._pending.pop(key, False)
+
+    def store(self, route, key, response):
+        """
+        Caches a response.
+        """
+        if key in self._entries:
+            del self._entries[key]
+
+        self._entries[key] = (time.time() + self.ttls[route], response)
+        self._paths[key[0]].add(key)
+
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        del self._entries[key]
+
+        keys = self._paths[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._paths[key[0]]
+
+    def invalidate(self, *paths):
+        """
+        Invalidates the cached responses for the given paths (with any query
+        parameters).
+        """
+        paths = set(paths)
+        for path in paths:
+            for key in list(self._paths.get(path, ())):
+                self._remove(key)
+
+        for key in self._pending:
+            if key[0] in paths:
+                self._pending[key] = False
+
+    def on_request(self, route, path):
+        """
+        Invalidates the responses made stale by a successful request.
+        """
+        if route[0] == HTTPMethod.GET:
+            return
+
+        # Invalidate the path itself and each of its parents
+        parts = path.split('/')
+        self.invalidate(*('/'.join(parts[:i]) for i in range(2, len(parts) + 1)))
+
+        # Deleting something also removes everything beneath it
+        if route[0] == HTTPMethod.DELETE:
+            prefix = path + '/'
+            self.invalidate(*[p for p in self._paths if p.startswith(prefix)])
+
+    def clear(self):
+        for key in self._pending:
+            self._pending[key] = False
+
+        self._entries.clear()
+        self._paths.clear()
@@ -1,5 +1,5 @@
 import six
-import json
+import copy
 import warnings
 
 from contextlib import contextmanager
@@ -8,6 +8,11 @@ from six.moves.urllib.parse import quote
 
 from holster.enum import EnumAttr
 from disco.api.http import Routes, HTTPClient, to_bytes
+from disco.api.cache import ResponseCache, DEFAULT_TTLS
+from disco.api.multipart import MultipartEncoder
+from disco.api.pipeline import RequestPipeline
+from disco.api.ratelimit import GlobalBudget
+from disco.api.scheduler import RequestPriority
 from disco.util.logging import LoggingClass
 from disco.util.sanitize import S
 from disco.types.user import User
@@ -56,6 +61,9 @@ class APIClient(LoggingClass):
     client : Optional[:class:`disco.client.Client`]
         The Disco client this APIClient is a member of. This is used when constructing
         and fitting models from response data.
+    json_backend : Optional[str]
+        The JSON backend used for encoding requests and decoding responses. If not
+        provided this defaults to the backend configured on `client`.
 
     Attributes
     ----------
@@ -64,20 +72,101 @@ class APIClient(LoggingClass):
     http : :class:`disco.http.HTTPClient`
         The HTTPClient this APIClient uses for all requests.
     """
-    def __init__(self, token, client=None):
+    def __init__(self, token, client=None, json_backend=None):
         super(APIClient, self).__init__()
 
+        options = {}
+        if client:
+            config = client.config
+            json_backend = json_backend or config.json_backend
+
+            options['metrics'] = client.metrics
+            options['coalesce'] = config.http_coalesce
+            options['coalesce_routes'] = {
+                getattr(Routes, name): enabled for name, enabled in six.iteritems(config.http_coalesce_routes)
+            }
+            options['pool_size'] = config.http_pool_size
+            options['pool_block'] = config.http_pool_block
+            options['idle_timeout'] = config.http_idle_timeout
+            options['bucket_concurrency'] = config.http_bucket_concurrency
+
+            if config.http_global_budget:
+                options['budget'] = GlobalBudget(config.http_global_budget)
+
+            if config.http_cache_enabled:
+                options['cache'] = ResponseCache.from_names(
+                    dict(DEFAULT_TTLS, **config.http_cache_ttls),
+                    max_size=config.http_cache_size,
+                    metrics=client.metrics)
+                options['cache'].bind(client.events)
+
         self.client = client
-        self.http = HTTPClient(token, self._after_requests)
+        self.http = HTTPClient(token, self._after_requests, json_backend=json_backend, **options)
+
+        self.pipeline = RequestPipeline()
+        if client:
+            self.pipeline = RequestPipeline(config.http_pipeline_concurrency, config.http_pipeline_max_queued)
+            client.metrics.gauge(
+                'disco_http_pipeline_depth', 'Submitted API calls waiting to be run',
+                func=lambda: self.pipeline.depth)
 
         self._captures = local()
 
+    def with_client(self, client):
+        """
+        Returns a copy of this APIClient for another `disco.client.Client`, which
+        shares this clients `HTTPClient` (and thus its connection pool and rate
+        limiter). Used to run several shards within a single process.
+        """
+        api = copy.copy(self)
+        api.client = client
+        return api
+
     def _after_requests(self, response):
         if not hasattr(self._captures, 'responses'):
             return
 
         self._captures.responses.append(response)
 
+    def priority(self, priority, flow=None):
+        """
+        Context manager which sets the priority of all requests made within it by
+        the current greenlet, e.g. `with api.priority('bulk'):`. See
+        `disco.api.http.HTTPClient.priority`.
+        """
+        return self.http.priority(priority, flow)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Submits an API call to be run in the background by the `RequestPipeline`,
+        returning immediately with a `disco.api.pipeline.APIFuture` for its result.
+        The call keeps the priority of the current `priority` context, both while
+        queued (calls of a higher priority are run first) and once it is made.
+
+        `func` is either the name of a method of this client (e.g.
+        `api.submit('channels_typing', channel_id)`), or a route from
+        `disco.api.http.Routes`, which is requested with the given URL arguments
+        and keyword arguments (e.g. `api.submit(Routes.CHANNELS_GET, dict(channel=1),
+        model=Channel)`). The result of a route is its response, unless a `model`
+        is given, in which case the model is only created from the response once
+        the result is retrieved from the future.
+        """
+        priority = self.http.get_priority()
+        options = {
+            'context': (lambda: self.http.priority(*priority)) if priority else None,
+            'priority': priority[0] if priority else RequestPriority.INTERACTIVE,
+        }
+
+        if isinstance(func, six.string_types):
+            return self.pipeline.submit(getattr(self, func), args, kwargs, **options)
+
+        model = kwargs.pop('model', None)
+
+        def loader(response):
+            return model.create(self.client, response.json())
+
+        return self.pipeline.submit(self.http, (func, ) + args, kwargs, loader=loader if model else None, **options)
+
     @contextmanager
     def capture(self):
         """
@@ -137,6 +226,25 @@ class APIClient(LoggingClass):
         r = self.http(Routes.CHANNELS_MESSAGES_GET, dict(channel=channel, message=message))
         return Message.create(self.client, r.json())
 
+    def _multipart(self, payload, attachments):
+        """
+        Returns the keyword arguments for a request whose JSON payload is sent
+        along with the given attachments, as a streamed multipart body. Each
+        attachment is a (filename, source[, content type]) tuple, where the source
+        may be the contents of the file, a file object, a memoryview, or a path
+        wrapped in `FilePath`.
+        """
+        if len(attachments) > 1:
+            files = [('file{}'.format(idx), tuple(i)) for idx, i in enumerate(attachments)]
+        else:
+            files = [('file', tuple(attachments[0]))]
+
+        body = MultipartEncoder(
+            fields=[('payload_json', self.http.json_backend.dumps(payload))],
+            files=files,
+        )
+        return {'data': body, 'headers': {'Content-Type': body.content_type}}
+
     def channels_messages_create(
             self,
             channel,
@@ -168,20 +276,10 @@ class APIClient(LoggingClass):
             payload['embed'] = embed.to_dict()
 
         if attachments:
-            if len(attachments) > 1:
-                files = {
-                    'file{}'.format(idx): tuple(i) for idx, i in enumerate(attachments)
-                }
-            else:
-                files = {
-                    'file': tuple(attachments[0]),
-                }
-
             r = self.http(
                 Routes.CHANNELS_MESSAGES_CREATE,
                 dict(channel=channel),
-                data={'payload_json': json.dumps(payload)},
-                files=files,
+                **self._multipart(payload, attachments)
             )
         else:
             r = self.http(Routes.CHANNELS_MESSAGES_CREATE, dict(channel=channel), json=payload)
@@ -507,6 +605,14 @@ class APIClient(LoggingClass):
         r = self.http(Routes.USERS_ME_PATCH, json=payload)
         return User.create(self.client, r.json())
 
+    def users_me_guilds_list(self, before=None, after=None, limit=100):
+        r = self.http(Routes.USERS_ME_GUILDS_LIST, params=optional(
+            before=before,
+            after=after,
+            limit=limit,
+        ))
+        return Guild.create_map(self.client, r.json())
+
     def users_me_guilds_delete(self, guild):
         self.http(Routes.USERS_ME_GUILDS_DELETE, dict(guild=guild))
 
@@ -552,11 +658,16 @@ class APIClient(LoggingClass):
     def webhooks_token_delete(self, webhook, token):
         self.http(Routes.WEBHOOKS_TOKEN_DELETE, dict(webhook=webhook, token=token))
 
-    def webhooks_token_execute(self, webhook, token, data, wait=False):
+    def webhooks_token_execute(self, webhook, token, data, wait=False, attachments=None):
+        if attachments:
+            kwargs = self._multipart(optional(**data), attachments)
+        else:
+            kwargs = {'json': optional(**data)}
+
         obj = self.http(
             Routes.WEBHOOKS_TOKEN_EXECUTE,
             dict(webhook=webhook, token=token),
-            json=optional(**data), params={'wait': int(wait)})
+            params={'wait': int(wait)}, **kwargs)
 
         if wait:
             return Message.create(self.client, obj.json())
@@ -1,15 +1,32 @@
 import requests
 import random
+import socket
 import gevent
+import time
 import six
 import sys
 
+from functools import partial
+from contextlib import contextmanager
+from gevent.event import AsyncResult
+from gevent.local import local
 from holster.enum import Enum
 
 from disco import VERSION as disco_version
 from requests import __version__ as requests_version
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from disco.util.logging import LoggingClass
+from disco.util.metrics import MetricsRegistry
+from disco.api.multipart import MultipartEncoder
 from disco.api.ratelimit import RateLimiter
+from disco.api.scheduler import RequestScheduler, RequestPriority
+from disco.gateway.encoding.json import get_json_backend
+
+# URL arguments which are major parameters, each combination of which has its own
+#  rate limits within a bucket.
+MAJOR_PARAMETERS = ('guild', 'channel', 'webhook', 'token')
 
 # Enum of all HTTP methods used
 HTTPMethod = Enum(
@@ -141,6 +158,13 @@ class APIResponse(object):
         self.rate_limited_duration = 0
 
 
+class CoalescedRequestInterrupted(Exception):
+    """
+    Raised to requests waiting on a coalesced request which was interrupted
+    (e.g. its greenlet was killed), which then make their own request instead.
+    """
+
+
 class APIException(Exception):
     """
     Exception thrown when an HTTP-client level error occurs. Usually this will
@@ -184,15 +208,126 @@ class APIException(Exception):
         super(APIException, self).__init__(self.msg)
 
 
+class CountingConnectionMixin(object):
+    """
+    Calls `on_connect` (passed as a keyword argument) each time the connection
+    opens a new socket.
+    """
+    def __init__(self, *args, **kwargs):
+        self.on_connect = kwargs.pop('on_connect', None)
+        super(CountingConnectionMixin, self).__init__(*args, **kwargs)
+
+    def _new_conn(self):
+        sock = super(CountingConnectionMixin, self)._new_conn()
+        if self.on_connect:
+            self.on_connect()
+        return sock
+
+
+class CountingHTTPConnection(CountingConnectionMixin, HTTPConnection):
+    pass
+
+
+class CountingHTTPSConnection(CountingConnectionMixin, HTTPSConnection):
+    pass
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    A requests `HTTPAdapter` which enables TCP keep-alive on its connections, so
+    pooled connections which were silently dropped are detected, and which calls
+    `on_connect` each time a new connection is opened.
+    """
+    # Seconds idle before the first probe, seconds between probes, and the number
+    #  of unanswered probes after which the connection is dropped.
+    KEEPALIVE_IDLE = 60
+    KEEPALIVE_INTERVAL = 10
+    KEEPALIVE_COUNT = 3
+
+    def __init__(self, *args, **kwargs):
+        self.on_connect = kwargs.pop('on_connect', None)
+        super(KeepAliveAdapter, self).__init__(*args, **kwargs)
+
+    def get_socket_options(self):
+        options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+        # Otherwise the OS defaults apply, which on Linux wait two hours before
+        #  the first probe.
+        for name, value in (
+                ('TCP_KEEPIDLE', self.KEEPALIVE_IDLE),
+                ('TCP_KEEPINTVL', self.KEEPALIVE_INTERVAL),
+                ('TCP_KEEPCNT', self.KEEPALIVE_COUNT)):
+            if hasattr(socket, name):
+                options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+
+        return HTTPConnection.default_socket_options + options
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.get_socket_options()
+        super(KeepAliveAdapter, self).init_poolmanager(*args, **kwargs)
+
+        # Extra keyword arguments of pools are passed along to their connections
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': partial(CountingHTTPConnectionPool, on_connect=self._on_connect),
+            'https': partial(CountingHTTPSConnectionPool, on_connect=self._on_connect),
+        }
+
+    def _on_connect(self):
+        if self.on_connect:
+            self.on_connect()
+
+
 class HTTPClient(LoggingClass):
     """
     A simple HTTP client which wraps the requests library, adding support for
     Discords rate-limit headers, authorization, and request/response validation.
+
+    JSON request bodies (passed via the `json` keyword) and the `json()` method of
+    returned responses both use the configured JSON backend, rather than the one
+    bundled within requests.
+
+    If a `budget` (e.g. a `disco.api.ratelimit.GlobalBudget`) is given, every
+    request also acquires from it, keeping the client under the global rate limit
+    before Discord has to enforce it.
+
+    Identical GET requests (the same route, URL arguments and query parameters)
+    to the routes enabled within `coalesce_routes` (or to any route, if
+    `coalesce` is set) made while one is already in flight wait for and share
+    its response, instead of making their own request. Coalescing is disabled
+    by default, as the response objects are shared between callers.
+
+    If a `cache` (a `disco.api.cache.ResponseCache`) is given, responses to the
+    routes it caches are served from it while fresh, and successful mutating
+    requests invalidate the responses they make stale.
+
+    Connections to the API are kept alive within a pool of `pool_size`
+    connections. If `pool_block` is set, requests wait for a pooled connection
+    rather than opening (and then discarding) extra connections when the pool is
+    exhausted. If the client has been idle for longer than `idle_timeout` seconds,
+    its pooled connections (which the other end has likely closed) are discarded
+    before the next request.
+
+    At most `bucket_concurrency` requests to a single rate limit bucket are made
+    at once, with waiting requests admitted by priority (see
+    `disco.api.scheduler.RequestScheduler`). Requests default to
+    `RequestPriority.INTERACTIVE`, and a priority can be given either for a single
+    call (with the `priority` keyword) or for everything within a `priority`
+    context.
     """
     BASE_URL = 'https://discordapp.com/api/v7'
     MAX_RETRIES = 5
 
-    def __init__(self, token, after_request=None):
+    def __init__(self, token, after_request=None, json_backend=None, metrics=None, budget=None, coalesce=False,
+                 coalesce_routes=None, cache=None, pool_size=10, pool_block=False, idle_timeout=None,
+                 bucket_concurrency=5):
         super(HTTPClient, self).__init__()
 
         py_version = '{}.{}.{}'.format(
@@ -201,18 +336,149 @@ class HTTPClient(LoggingClass):
             sys.version_info.micro)
 
         self.limiter = RateLimiter()
+        self.budget = budget
+        self.coalesce = coalesce
+        self.coalesce_routes = coalesce_routes or {}
+        self._inflight = {}
+        self.cache = cache
+        self.scheduler = RequestScheduler(bucket_concurrency) if bucket_concurrency else None
+        self._context = local()
         self.headers = {
             'User-Agent': 'DiscordBot (https://github.com/b1naryth1ef/disco {}) Python/{} requests/{}'.format(
                 disco_version,
                 py_version,
                 requests_version),
+            # Return sub-second precision within the rate limit reset headers
+            'X-RateLimit-Precision': 'millisecond',
         }
 
         if token:
             self.headers['Authorization'] = 'Bot ' + token
 
         self.after_request = after_request
+        self.json_backend = get_json_backend(json_backend)
         self.session = requests.Session()
+        self.session.hooks['response'].append(self._bind_json_backend)
+
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.adapter = KeepAliveAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=pool_block, on_connect=self._on_connect)
+        self.session.mount('https://', self.adapter)
+
+        self._requests_in_flight = 0
+        self._last_request_at = None
+
+        self.metrics = metrics or MetricsRegistry()
+        self._m_rate_limited = self.metrics.counter(
+            'disco_http_rate_limited', 'Requests which were responded to with a 429', labels=('scope', ))
+        self._m_retry_after = self.metrics.histogram(
+            'disco_http_retry_after_seconds', 'Time Discord asked us to wait after a 429')
+        self.metrics.gauge(
+            'disco_http_global_budget_remaining', 'Requests which may be made before the global budget is exhausted',
+            func=lambda: (self.budget.remaining or 0) if self.budget else 0)
+        self.metrics.gauge(
+            'disco_http_requests_in_flight', 'Requests currently being made (and holding or waiting for a connection)',
+            func=lambda: self._requests_in_flight)
+        self._m_connections_opened = self.metrics.counter(
+            'disco_http_connections_opened', 'Connections opened to the API')
+        self.metrics.gauge(
+            'disco_http_scheduler_waiting', 'Requests waiting for their turn within a rate limit bucket',
+            func=lambda: self.scheduler.waiting if self.scheduler else 0)
+        self._m_coalesced = self.metrics.counter(
+            'disco_http_coalesced', 'Requests which shared the response of an identical in-flight request',
+            labels=('route', ))
+
+    def _on_connect(self):
+        self._m_connections_opened.inc()
+
+    def get_connections_opened(self):
+        """
+        Returns the total number of connections opened to the API.
+        """
+        return self._m_connections_opened.get()
+
+    def warm_up(self, count=None):
+        """
+        Opens connections to the API ahead of time, so the first requests do not
+        have to wait for TCP and TLS handshakes.
+
+        Parameters
+        ----------
+        count : Optional[int]
+            The number of connections to open, defaults to the pool size.
+        """
+        count = min(count or self.pool_size, self.pool_size)
+
+        # Each (streamed) response holds on to its connection until it is closed,
+        #  so every request opens its own. HEAD requests to the gateway route are
+        #  cheap, and are not subject to rate limits.
+        url = self.BASE_URL + Routes.GATEWAY_GET[1]
+        greenlets = [
+            gevent.spawn(self.session.request, 'HEAD', url, stream=True, timeout=10) for _ in range(count)
+        ]
+        gevent.joinall(greenlets)
+
+        failed = []
+        for greenlet in greenlets:
+            if greenlet.successful():
+                greenlet.value.close()
+            else:
+                failed.append(greenlet.exception)
+
+        if failed:
+            self.log.warning('Failed to warm up %s API connections: %s', len(failed), failed[0])
+
+        self._last_request_at = time.time()
+
+    def _check_idle(self):
+        now = time.time()
+        if self.idle_timeout and self._last_request_at and not self._requests_in_flight:
+            if now - self._last_request_at > self.idle_timeout:
+                self.log.debug('Idle for %.0fs, discarding pooled connections', now - self._last_request_at)
+                self.adapter.poolmanager.clear()
+        self._last_request_at = now
+
+    @contextmanager
+    def priority(self, priority, flow=None):
+        """
+        Context manager which sets the priority of all requests made within it
+        (by the current greenlet).
+
+        Parameters
+        ----------
+        priority : `disco.api.scheduler.RequestPriority`
+            The priority class (or its name, e.g. 'bulk').
+        flow : Optional[object]
+            The flow requests belong to, requests of equal priority are admitted
+            fairly between flows. Defaults to the greenlet making the request.
+        """
+        previous = getattr(self._context, 'priority', None)
+        self._context.priority = (RequestPriority.get(priority), flow)
+        try:
+            yield
+        finally:
+            self._context.priority = previous
+
+    def get_priority(self):
+        """
+        Returns the (priority, flow) set by the current `priority` context, or None.
+        """
+        return getattr(self._context, 'priority', None)
+
+    @contextmanager
+    def _slot(self, key):
+        if not self.scheduler:
+            yield 0
+            return
+
+        priority, flow = self.get_priority() or (RequestPriority.INTERACTIVE, None)
+        with self.scheduler.slot(key, priority, flow or gevent.getcurrent()) as waited:
+            yield waited
+
+    def _bind_json_backend(self, response, *args, **kwargs):
+        loads = self.json_backend.loads
+        response.json = lambda **_: loads(response.content)
 
     def __call__(self, route, args=None, **kwargs):
         return self.call(route, args, **kwargs)
@@ -234,7 +500,8 @@ class HTTPClient(LoggingClass):
             to create the requestable route. The HTTPClient uses this to track
             rate limits as well.
         kwargs : dict
-            Keyword arguments that will be passed along to the requests library
+            Keyword arguments that will be passed along to the requests library,
+            except for `priority` and `flow` (see `HTTPClient.priority`).
 
         Raises
         ------
@@ -247,6 +514,106 @@ class HTTPClient(LoggingClass):
         :class:`requests.Response`
             The response object for the request
         """
+        priority = kwargs.pop('priority', None)
+        if priority is not None:
+            with self.priority(priority, kwargs.pop('flow', None)):
+                return self.call(route, args, **kwargs)
+
+        if not self.cache:
+            return self._coalesced_call(route, args, **kwargs)
+
+        path = route[1].format(**(args or {}))
+        cache_key = None
+        if route[0] == HTTPMethod.GET:
+            cache_key = self.cache.get_key(route, path, kwargs.get('params'))
+
+        if cache_key is None:
+            response = self._coalesced_call(route, args, **kwargs)
+            self.cache.on_request(route, path)
+            return response
+
+        response = self.cache.get(route, cache_key)
+        if response is not None:
+            return response
+
+        # Responses to requests whose path is invalidated while they are in
+        #  flight may already be stale, so are not cached.
+        self.cache.begin(cache_key)
+        try:
+            response = self._coalesced_call(route, args, **kwargs)
+        finally:
+            fresh = self.cache.end(cache_key)
+
+        if fresh:
+            self.cache.store(route, cache_key, response)
+        return response
+
+    def _coalesced_call(self, route, args=None, **kwargs):
+        key = self._get_coalesce_key(route, args, kwargs)
+        if key is None:
+            return self._call(route, args, **kwargs)
+
+        if key in self._inflight:
+            try:
+                r = self._inflight[key].get()
+            except CoalescedRequestInterrupted:
+                # The request being waited on was killed, so make our own
+                return self._coalesced_call(route, args, **kwargs)
+            except APIException as e:
+                self._after_coalesced(route, e.response, e)
+                raise
+
+            self._after_coalesced(route, r)
+            return r
+
+        self._inflight[key] = result = AsyncResult()
+        try:
+            response = self._call(route, args, **kwargs)
+        except Exception as e:
+            result.set_exception(e)
+            raise
+        except BaseException:
+            # e.g. GreenletExit, which only concerns this caller
+            result.set_exception(CoalescedRequestInterrupted())
+            raise
+        finally:
+            del self._inflight[key]
+
+        result.set(response)
+        return response
+
+    def _after_coalesced(self, route, r, exception=None):
+        self._m_coalesced.inc(route=route[1])
+
+        # Requests which shared a response are reported too (e.g. to `APIClient.capture`)
+        if self.after_request and r is not None:
+            response = APIResponse()
+            response.response = r
+            response.exception = exception
+            self.after_request(response)
+
+    def _get_coalesce_key(self, route, args, kwargs):
+        # Only plain GET requests are coalesced
+        if route[0] != HTTPMethod.GET or not self.coalesce_routes.get(route, self.coalesce):
+            return None
+
+        if set(kwargs) - {'params', 'headers'}:
+            return None
+
+        try:
+            params = kwargs.get('params') or {}
+            key = (
+                route,
+                tuple(sorted(six.iteritems(args or {}))),
+                tuple(sorted(six.iteritems(params))) if isinstance(params, dict) else params,
+            )
+            hash(key)
+        except TypeError:
+            return None
+
+        return key
+
+    def _call(self, route, args=None, **kwargs):
         args = args or {}
         retry = kwargs.pop('retry_number', 0)
 
@@ -256,41 +623,62 @@ class HTTPClient(LoggingClass):
         else:
             kwargs['headers'] = self.headers
 
-        # Build the bucket URL
+        # Encode JSON bodies with our own backend
+        if 'json' in kwargs:
+            kwargs['data'] = self.json_backend.dumps(kwargs.pop('json'))
+            kwargs['headers'] = dict(kwargs['headers'], **{'Content-Type': 'application/json'})
+
+        # Rate limits are tracked per route (or the bucket Discord places it in),
+        #  and the major parameters of the request.
         args = {k: to_bytes(v) for k, v in six.iteritems(args)}
-        filtered = {k: (v if k in ('guild', 'channel') else '') for k, v in six.iteritems(args)}
-        bucket = (route[0].value, route[1].format(**filtered))
+        bucket = (route[0].value, route[1])
+        major = tuple(args[k] for k in MAJOR_PARAMETERS if k in args)
+
+        url = self.BASE_URL + route[1].format(**args)
 
-        response = APIResponse()
+        while True:
+            response = APIResponse()
 
-        # Possibly wait if we're rate limited
-        response.rate_limited_duration = self.limiter.check(bucket)
+            # Wait for our turn within the bucket, then for its rate limit
+            key = self.limiter.get_key(bucket, major)
+            with self._slot(key) as waited:
+                response.rate_limited_duration = waited
 
-        self.log.debug('KW: %s', kwargs)
+                # Possibly wait if we're rate limited
+                response.rate_limited_duration += self.limiter.check(bucket, major)
+                if self.budget:
+                    response.rate_limited_duration += self.budget.acquire()
 
-        # Make the actual request
-        url = self.BASE_URL + route[1].format(**args)
-        self.log.info('%s %s (%s)', route[0].value, url, kwargs.get('params'))
-        r = self.session.request(route[0].value, url, **kwargs)
+                self.log.debug('KW: %s', kwargs)
 
-        if self.after_request:
-            response.response = r
-            self.after_request(response)
+                # Make the actual request
+                self.log.info('%s %s (%s)', route[0].value, url, kwargs.get('params'))
+                self._check_idle()
 
-        # Update rate limiter
-        self.limiter.update(bucket, r)
+                # Streamed bodies are sent from the start again on each retry
+                if isinstance(kwargs.get('data'), MultipartEncoder):
+                    kwargs['data'].rewind()
 
-        # If we got a success status code, just return the data
-        if r.status_code < 400:
-            return r
-        elif r.status_code != 429 and 400 <= r.status_code < 500:
-            self.log.warning('Request failed with code %s: %s', r.status_code, r.content)
-            response.exception = APIException(r)
-            raise response.exception
-        else:
-            if r.status_code == 429:
-                self.log.warning(
-                    'Request responded w/ 429, retrying (but this should not happen, check your clock sync')
+                self._requests_in_flight += 1
+                try:
+                    r = self.session.request(route[0].value, url, **kwargs)
+                finally:
+                    self._requests_in_flight -= 1
+
+                if self.after_request:
+                    response.response = r
+                    self.after_request(response)
+
+                # Update rate limiter
+                self.limiter.update(bucket, r, major)
+
+            # If we got a success status code, just return the data
+            if r.status_code < 400:
+                return r
+            elif r.status_code != 429 and 400 <= r.status_code < 500:
+                self.log.warning('Request failed with code %s: %s', r.status_code, r.content)
+                response.exception = APIException(r)
+                raise response.exception
 
             # If we hit the max retries, throw an error
             retry += 1
@@ -298,14 +686,49 @@ class HTTPClient(LoggingClass):
                 self.log.error('Failing request, hit max retries')
                 raise APIException(r, retries=self.MAX_RETRIES)
 
-            backoff = self.random_backoff()
-            self.log.warning('Request to `{}` failed with code {}, retrying after {}s ({})'.format(
-                url, r.status_code, backoff, r.content,
-            ))
-            gevent.sleep(backoff)
+            if r.status_code == 429:
+                retry_after, scope = self.parse_rate_limit(r)
+                self._m_rate_limited.inc(scope=scope)
+                self._m_retry_after.observe(retry_after)
+                self.log.warning('Request to `{}` was rate limited ({} scope), retrying after {}s'.format(
+                    url, scope, retry_after,
+                ))
+
+                # Block the bucket (or every bucket for global rate limits), the
+                #  next check will wait until the limit is over.
+                self.limiter.rate_limited(bucket, retry_after, major, is_global=(scope == 'global'))
+            else:
+                backoff = self.random_backoff()
+                self.log.warning('Request to `{}` failed with code {}, retrying after {}s ({})'.format(
+                    url, r.status_code, backoff, r.content,
+                ))
+                gevent.sleep(backoff)
+
+    def parse_rate_limit(self, response):
+        """
+        Returns how long (in seconds) to wait before retrying a request which was
+        responded to with a 429, and the scope of the rate limit that was hit
+        (one of 'user', 'global' or 'shared').
+        """
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+
+        if not isinstance(data, dict):
+            data = {}
+
+        if 'retry_after' in data:
+            # The body is in milliseconds for this API version
+            retry_after = float(data['retry_after']) / 1000.0
+        else:
+            retry_after = float(response.headers.get('Retry-After', 1))
+
+        scope = response.headers.get('X-RateLimit-Scope', 'user')
+        if data.get('global') or 'X-RateLimit-Global' in response.headers:
+            scope = 'global'
 
-            # Otherwise just recurse and try again
-            return self(route, args, retry_number=retry, **kwargs)
+        return retry_after, scope
 
     @staticmethod
     def random_backoff():
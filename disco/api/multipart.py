@@ -0,0 +1,197 @@
+import os
+import six
+import uuid
+import mimetypes
+
+try:
+    from pathlib import PurePath
+except ImportError:
+    PurePath = None
+
+# The size of the chunks files are read in
+CHUNK_SIZE = 64 * 1024
+
+
+class FilePath(object):
+    """
+    Wraps the path of a file which should be uploaded, streaming it from disk
+    (rather than treating the string as the contents of the file).
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return '<FilePath {}>'.format(self.path)
+
+
+def _is_path(source):
+    return isinstance(source, FilePath) or (PurePath is not None and isinstance(source, PurePath))
+
+
+def _quote(value):
+    return value.replace('\\', '\\\\').replace('"', '%22').replace('\r', '').replace('\n', '')
+
+
+class MultipartPart(object):
+    def __init__(self, name, source, filename=None, content_type=None):
+        self.source = source
+        if isinstance(self.source, six.text_type):
+            self.source = self.source.encode('utf-8')
+        elif isinstance(self.source, bytearray):
+            self.source = memoryview(self.source)
+
+        disposition = 'form-data; name="{}"'.format(_quote(name))
+        if filename is not None:
+            disposition += '; filename="{}"'.format(_quote(filename))
+            content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        headers = 'Content-Disposition: {}\r\n'.format(disposition)
+        if content_type:
+            headers += 'Content-Type: {}\r\n'.format(content_type)
+        self.headers = (headers + '\r\n').encode('utf-8')
+
+        # Where to rewind file objects to when the body is sent again
+        self._start = None
+        if hasattr(self.source, 'read'):
+            try:
+                self._start = self.source.tell()
+            except (AttributeError, IOError, OSError, ValueError):
+                pass
+        self._consumed = False
+
+    def get_length(self):
+        """
+        Returns the length of the source, or None if it is unknown.
+        """
+        if isinstance(self.source, bytes):
+            return len(self.source)
+        elif isinstance(self.source, memoryview):
+            return self.source.nbytes
+        elif _is_path(self.source):
+            return os.path.getsize(str(self.source.path if isinstance(self.source, FilePath) else self.source))
+        elif self._start is not None:
+            try:
+                self.source.seek(0, os.SEEK_END)
+                end = self.source.tell()
+                self.source.seek(self._start)
+                return end - self._start
+            except (AttributeError, IOError, OSError, ValueError):
+                pass
+        return None
+
+    def rewind(self):
+        if not hasattr(self.source, 'read') or not self._consumed:
+            return
+
+        if self._start is None:
+            raise Exception('Can not send the contents of an unseekable file more than once')
+        self.source.seek(self._start)
+
+    def iter_chunks(self, chunk_size):
+        if isinstance(self.source, bytes):
+            yield self.source
+        elif isinstance(self.source, memoryview):
+            for offset in range(0, self.source.nbytes, chunk_size):
+                yield self.source[offset:offset + chunk_size].tobytes()
+        elif _is_path(self.source):
+            path = self.source.path if isinstance(self.source, FilePath) else self.source
+            with open(str(path), 'rb') as fobj:
+                for chunk in iter(lambda: fobj.read(chunk_size), b''):
+                    yield chunk
+        else:
+            self._consumed = True
+            for chunk in iter(lambda: self.source.read(chunk_size), b''):
+                if isinstance(chunk, six.text_type):
+                    chunk = chunk.encode('utf-8')
+                yield chunk
+
+
+class MultipartEncoder(object):
+    """
+    A multipart/form-data request body which is streamed, rather than built in
+    memory. Files may be given as paths (with `FilePath` or a `pathlib` path),
+    file objects or memoryviews, and are read in chunks as the body is sent.
+
+    The encoder can be passed as the `data` of a request, along with its
+    `content_type` as the Content-Type header. If the length of every part is
+    known it is sent with a Content-Length, otherwise the body is sent with
+    chunked transfer encoding.
+
+    Parameters
+    ----------
+    fields : list(tuple(str, str))
+        Plain form fields, as (name, value) pairs.
+    files : list(tuple(str, tuple))
+        Files, as (name, (filename, source[, content type])) pairs. Sources
+        which are bytes or strings are used as the contents of the file.
+    chunk_size : int
+        The size of the chunks files are read in.
+    """
+    def __init__(self, fields=(), files=(), chunk_size=CHUNK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(self.boundary)
+        self.chunk_size = chunk_size
+
+        self.parts = [MultipartPart(name, value) for name, value in fields]
+        for name, attachment in files:
+            filename, source = attachment[:2]
+            content_type = attachment[2] if len(attachment) > 2 else None
+            self.parts.append(MultipartPart(name, source, filename, content_type))
+
+        self._delimiter = '--{}\r\n'.format(self.boundary).encode('utf-8')
+        self._end = '--{}--\r\n'.format(self.boundary).encode('utf-8')
+
+        # Read by requests to decide whether to send a Content-Length
+        self.len = self.get_length() or 0
+
+        self._chunks = None
+        self._buffer = b''
+
+    def get_length(self):
+        """
+        Returns the length of the encoded body, or None if it is unknown.
+        """
+        total = len(self._end)
+        for part in self.parts:
+            length = part.get_length()
+            if length is None:
+                return None
+            total += len(self._delimiter) + len(part.headers) + length + 2
+        return total
+
+    def rewind(self):
+        """
+        Resets the body, so it can be sent again (e.g. when a request is retried).
+        """
+        for part in self.parts:
+            part.rewind()
+
+        self._chunks = None
+        self._buffer = b''
+
+    def __iter__(self):
+        for part in self.parts:
+            yield self._delimiter + part.headers
+            for chunk in part.iter_chunks(self.chunk_size):
+                yield chunk
+            yield b'\r\n'
+        yield self._end
+
+    def read(self, size=-1):
+        """
+        Reads up to `size` bytes of the encoded body, like a file object.
+        """
+        if self._chunks is None:
+            self._chunks = iter(self)
+
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
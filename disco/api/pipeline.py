@@ -0,0 +1,133 @@
+import gevent
+
+from itertools import count
+from gevent.event import AsyncResult
+from gevent.queue import PriorityQueue, Empty
+
+from disco.api.scheduler import RequestPriority
+from disco.util.logging import LoggingClass
+
+
+class APIFuture(AsyncResult):
+    """
+    The result of a request submitted to a `RequestPipeline`. If the request was
+    submitted with a `loader`, the raw value (e.g. a `requests.Response`) is only
+    turned into a model the first time the result is retrieved with `get`, so
+    results which are never looked at are never built. If the loader fails, its
+    exception is raised from every call to `get`.
+
+    Note that `value` bypasses the loader, and is always the raw value.
+    """
+    def __init__(self, loader=None):
+        super(APIFuture, self).__init__()
+        self.loader = loader
+        self._loaded = None
+
+    def get(self, block=True, timeout=None):
+        value = super(APIFuture, self).get(block, timeout)
+        if not self.loader:
+            return value
+
+        # Holds (whether the loader succeeded, its result or exception)
+        if self._loaded is None:
+            try:
+                self._loaded = (True, self.loader(value))
+            except Exception as e:
+                self._loaded = (False, e)
+
+        success, result = self._loaded
+        if not success:
+            raise result
+        return result
+
+
+class RequestPipeline(LoggingClass):
+    """
+    Runs submitted API calls in the background, on at most `concurrency`
+    greenlets at once, so the caller does not wait for their responses. Calls are
+    run in order of their priority (see `RequestPriority`), and then in the order
+    they were submitted, and still go through the rate limiting and scheduling of
+    the `HTTPClient`.
+
+    Parameters
+    ----------
+    concurrency : int
+        The maximum number of calls run at once.
+    max_queued : Optional[int]
+        If set, the maximum number of calls waiting to be run, submitting past
+        which blocks until there is space in the queue.
+    """
+    def __init__(self, concurrency=10, max_queued=None):
+        super(RequestPipeline, self).__init__()
+        self.concurrency = concurrency
+        self.queue = PriorityQueue(max_queued or None)
+        self.workers = set()
+
+        # Keeps calls of equal priority in the order they were submitted
+        self._sequence = count()
+
+    @property
+    def depth(self):
+        """
+        The number of calls waiting to be run.
+        """
+        return self.queue.qsize()
+
+    def submit(self, func, args=(), kwargs=None, loader=None, context=None, priority=RequestPriority.INTERACTIVE):
+        """
+        Queues a call to be run, returning an `APIFuture` for its result.
+
+        Parameters
+        ----------
+        func : callable
+            The function to call.
+        args : tuple
+            The positional arguments to call the function with.
+        kwargs : Optional[dict]
+            The keyword arguments to call the function with.
+        loader : Optional[callable]
+            If set, a function which is given the result of the call the first
+            time it is retrieved from the future, and whose return value is used
+            as the result instead.
+        context : Optional[callable]
+            If set, a function returning a context manager which the call is run
+            within.
+        priority : `RequestPriority`
+            The priority of the call (or its name, e.g. 'bulk'), queued calls of a
+            higher priority are run first.
+        """
+        future = APIFuture(loader)
+        self.queue.put((
+            RequestPriority.get(priority).value,
+            next(self._sequence),
+            (func, args, kwargs or {}, future, context),
+        ))
+
+        if len(self.workers) < self.concurrency:
+            self.workers.add(gevent.spawn(self._work))
+
+        return future
+
+    def _work(self):
+        try:
+            while True:
+                try:
+                    _, _, (func, args, kwargs, future, context) = self.queue.get_nowait()
+                except Empty:
+                    return
+
+                try:
+                    if context:
+                        with context():
+                            result = func(*args, **kwargs)
+                    else:
+                        result = func(*args, **kwargs)
+                except Exception as e:
+                    self.log.warning('Submitted call to %s failed: %s', getattr(func, '__name__', func), e)
+                    future.set_exception(e)
+                else:
+                    future.set(result)
+        finally:
+            # Removed before anything else can run, so a call submitted after the
+            #  queue was found empty always spawns a new worker.
+            self.workers.discard(gevent.getcurrent())
@@ -7,40 +7,46 @@ from disco.util.logging import LoggingClass
 
 class RouteState(LoggingClass):
     """
-    An object which stores ratelimit state for a given method/url route
-    combination (as specified in :class:`disco.api.http.Routes`).
+    An object which stores ratelimit state for a single rate limit bucket, which
+    may be shared by several method/url route combinations (as specified in
+    :class:`disco.api.http.Routes`).
 
     Parameters
     ----------
-    route : tuple(HTTPMethod, str)
-        The route which this RouteState is for.
-    response : :class:`requests.Response`
+    route : tuple
+        The key (as returned by :func:`RateLimiter.get_key`) this RouteState is for.
+    response : Optional[:class:`requests.Response`]
         The response object for the last request made to the route, should contain
         the standard rate limit headers.
 
     Attributes
     ---------
-    route : tuple(HTTPMethod, str)
-        The route which this RouteState is for.
+    route : tuple
+        The key (as returned by :func:`RateLimiter.get_key`) this RouteState is for.
+    bucket : Optional[str]
+        The rate limit bucket hash Discord returned for this route, if any.
     remaining : int
         The number of remaining requests to the route before the rate limit will
         be hit, triggering a 429 response.
-    reset_time : int
-        A unix epoch timestamp (in seconds) after which this rate limit is reset
+    reset_time : float
+        A unix epoch timestamp (in seconds, by our clock) after which this rate
+        limit is reset
     event : :class:`gevent.event.Event`
         An event that is used to block all requests while a route is in the
         cooldown stage.
     """
-    def __init__(self, route, response):
+    def __init__(self, route, response=None):
         self.route = route
+        self.bucket = None
         self.remaining = 0
         self.reset_time = 0
         self.event = None
 
-        self.update(response)
+        if response is not None:
+            self.update(response)
 
     def __repr__(self):
-        return '<RouteState {}>'.format(' '.join(self.route))
+        return '<RouteState {!r}>'.format(self.route)
 
     @property
     def chilled(self):
@@ -71,7 +77,14 @@ class RouteState(LoggingClass):
             return
 
         self.remaining = int(response.headers.get('X-RateLimit-Remaining'))
-        self.reset_time = int(response.headers.get('X-RateLimit-Reset'))
+        self.bucket = response.headers.get('X-RateLimit-Bucket', self.bucket)
+
+        # Prefer the relative reset time, which is unaffected by any skew between
+        #  our clock and Discord's.
+        if 'X-RateLimit-Reset-After' in response.headers:
+            self.reset_time = time.time() + float(response.headers.get('X-RateLimit-Reset-After'))
+        else:
+            self.reset_time = float(response.headers.get('X-RateLimit-Reset'))
 
     def wait(self, timeout=None):
         """
@@ -92,13 +105,11 @@ class RouteState(LoggingClass):
 
     def cooldown(self):
         """
-        Waits for the current route to be cooled-down (aka waiting until reset time).
+        Waits for the current route to be cooled-down (aka waiting until reset time),
+        for exactly the time Discord advised.
         """
-        if self.reset_time - time.time() < 0:
-            raise Exception('Cannot cooldown for negative time period; check clock sync')
-
         self.event = gevent.event.Event()
-        delay = (self.reset_time - time.time()) + .5
+        delay = max(self.reset_time - time.time(), 0)
         self.log.debug('Cooling down bucket %s for %s seconds', self, delay)
         gevent.sleep(delay)
         self.event.set()
@@ -106,20 +117,109 @@ class RouteState(LoggingClass):
         return delay
 
 
+class GlobalBudget(LoggingClass):
+    """
+    A token bucket of requests which may be made against Discord's global rate
+    limit, which is shared by everything using the same token. A single budget
+    should be shared by every `HTTPClient` of a token, either directly (within a
+    process) or through `disco.gateway.sharder.GlobalBudgetProxy` (from shard
+    processes).
+
+    Tokens are reserved ahead of time, so callers which have to wait are queued
+    in order of their reservations.
+
+    Parameters
+    ----------
+    rate : int
+        The number of requests which may be made every `per` seconds.
+    per : float
+        The period (in seconds) of the rate.
+    """
+    def __init__(self, rate=50, per=1.0):
+        super(GlobalBudget, self).__init__()
+        self.rate = rate
+        self.per = per
+
+        self._tokens = float(rate)
+        self._updated_at = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.rate, self._tokens + ((now - self._updated_at) * self.rate / self.per))
+        self._updated_at = now
+
+    @property
+    def remaining(self):
+        """
+        The number of requests which may currently be made without waiting.
+        """
+        self._refill()
+        return max(int(self._tokens), 0)
+
+    def reserve(self, count=1):
+        """
+        Reserves `count` requests from the budget, without waiting.
+
+        Returns
+        -------
+        tuple(float, int)
+            How long (in seconds) the caller must wait before making the requests,
+            and the remaining budget.
+        """
+        self._refill()
+        self._tokens -= count
+
+        delay = 0
+        if self._tokens < 0:
+            delay = -self._tokens * self.per / self.rate
+        return delay, max(int(self._tokens), 0)
+
+    def acquire(self, count=1):
+        """
+        Waits until `count` requests may be made.
+
+        Returns
+        -------
+        float
+            The number of seconds waited.
+        """
+        delay, _ = self.reserve(count)
+        if delay > 0:
+            self.log.debug('Global request budget exhausted, waiting %.3fs', delay)
+            gevent.sleep(delay)
+        return delay
+
+
 class RateLimiter(LoggingClass):
     """
     A in-memory store of ratelimit states for all routes we've ever called.
 
+    Discord groups routes into rate limit buckets, identified by the hash it
+    returns within the `X-RateLimit-Bucket` header, and each combination of a
+    bucket and the major parameters (guild, channel and webhook) of a request has
+    its own rate limit. Until a route's bucket is known, the route is treated as
+    its own bucket.
+
     Attributes
     ----------
-    states : dict(tuple(HTTPMethod, str), :class:`RouteState`)
-        Contains a :class:`RouteState` for each route the RateLimiter is currently
-        tracking.
+    states : dict(tuple, :class:`RouteState`)
+        Contains a :class:`RouteState` for each bucket/major parameters combination
+        the RateLimiter is currently tracking.
+    buckets : dict(tuple(HTTPMethod, str), str)
+        The bucket hash of each route, as returned by Discord.
     """
     def __init__(self):
         self.states = {}
+        self.buckets = {}
 
-    def check(self, route):
+    def get_key(self, route, major=()):
+        """
+        Returns the key the rate limit state for the given route and major
+        parameters is tracked under.
+        """
+        return (self.buckets.get(route, route), major)
+
+    def check(self, route, major=()):
         """
         Checks whether a given route can be called. This function will return
         immediately if no rate-limit cooldown is being imposed for the given
@@ -131,6 +231,8 @@ class RateLimiter(LoggingClass):
         ----------
         route : tuple(HTTPMethod, str)
             The route that will be checked.
+        major : tuple
+            The values of the major parameters for this request.
 
         Returns
         -------
@@ -138,20 +240,20 @@ class RateLimiter(LoggingClass):
             The number of seconds we had to wait for this rate limit, or zero
             if no time was waited.
         """
-        return self._check(None) + self._check(route)
+        return self._check(None) + self._check(self.get_key(route, major))
 
-    def _check(self, route):
-        if route in self.states:
+    def _check(self, key):
+        if key in self.states:
             # If the route is being cooled off, we need to wait until its ready
-            if self.states[route].chilled:
-                return self.states[route].wait()
+            if self.states[key].chilled:
+                return self.states[key].wait()
 
-            if self.states[route].next_will_ratelimit:
-                return gevent.spawn(self.states[route].cooldown).get()
+            if self.states[key].next_will_ratelimit:
+                return gevent.spawn(self.states[key].cooldown).get()
 
         return 0
 
-    def update(self, route, response):
+    def update(self, route, response, major=()):
         """
         Updates the given routes state with the rate-limit headers inside the
         response from a previous call to the route.
@@ -163,11 +265,46 @@ class RateLimiter(LoggingClass):
         response : :class:`requests.Response`
             The response object for the last request to the route, whose headers
             will be used to update the routes rate limit state.
+        major : tuple
+            The values of the major parameters for the request.
         """
         if 'X-RateLimit-Global' in response.headers:
-            route = None
+            key = None
+        else:
+            bucket = response.headers.get('X-RateLimit-Bucket')
+            if bucket and self.buckets.get(route) != bucket:
+                # The state we tracked for this route before knowing its bucket
+                #  is superseded by the bucket's own state.
+                self.states.pop(self.get_key(route, major), None)
+                self.buckets[route] = bucket
+
+            key = self.get_key(route, major)
 
-        if route in self.states:
-            self.states[route].update(response)
+        if key in self.states:
+            self.states[key].update(response)
         else:
-            self.states[route] = RouteState(route, response)
+            self.states[key] = RouteState(key, response)
+
+    def rate_limited(self, route, retry_after, major=(), is_global=False):
+        """
+        Blocks the given route (or all routes, for a global rate limit) after a
+        request to it was responded to with a 429.
+
+        Parameters
+        ---------
+        route : tuple(HTTPMethod, str)
+            The route the 429 was returned for.
+        retry_after : float
+            How long (in seconds) Discord asked us to wait for.
+        major : tuple
+            The values of the major parameters for the request.
+        is_global : bool
+            Whether the global rate limit was hit.
+        """
+        key = None if is_global else self.get_key(route, major)
+        if key not in self.states:
+            self.states[key] = RouteState(key)
+
+        state = self.states[key]
+        state.remaining = 0
+        state.reset_time = max(state.reset_time, time.time() + retry_after)
@@ -0,0 +1,155 @@
+import time
+
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from gevent.event import Event
+from holster.enum import Enum
+
+from disco.util.logging import LoggingClass
+
+# Priority classes of requests, lower values are sent first
+RequestPriority = Enum(
+    INTERACTIVE=0,
+    BACKGROUND=1,
+    BULK=2,
+)
+
+
+class BucketQueue(object):
+    """
+    The requests in flight, and waiting, for a single rate limit bucket. Waiting
+    requests are grouped by priority and then by flow.
+    """
+    def __init__(self):
+        self.active = 0
+        self.waiting = 0
+        self.flows = {}
+
+    def push(self, priority, flow, event):
+        flows = self.flows.setdefault(priority, OrderedDict())
+        flows.setdefault(flow, deque()).append(event)
+        self.waiting += 1
+
+    def pop(self):
+        # Strict priority between classes, round-robin between flows within one
+        priority = min(self.flows)
+        flows = self.flows[priority]
+
+        flow, events = next(iter(flows.items()))
+        event = events.popleft()
+
+        del flows[flow]
+        if events:
+            flows[flow] = events
+        if not flows:
+            del self.flows[priority]
+
+        self.waiting -= 1
+        return event
+
+    def remove(self, priority, flow, event):
+        flows = self.flows.get(priority, {})
+        events = flows.get(flow)
+        if not events or event not in events:
+            return False
+
+        events.remove(event)
+        if not events:
+            del flows[flow]
+        if not flows:
+            self.flows.pop(priority, None)
+
+        self.waiting -= 1
+        return True
+
+
+class RequestScheduler(LoggingClass):
+    """
+    Limits the number of concurrent requests to each rate limit bucket. When a
+    bucket is busy, waiting requests are admitted by priority class (see
+    `RequestPriority`), and requests of the same priority are admitted round-robin
+    between their flows, so one flow queuing many requests (e.g. a bulk delete)
+    can not starve the others.
+
+    Parameters
+    ----------
+    concurrency : int
+        The maximum number of requests in flight to a single bucket.
+    """
+    def __init__(self, concurrency=5):
+        super(RequestScheduler, self).__init__()
+        self.concurrency = concurrency
+        self.buckets = {}
+
+    @property
+    def waiting(self):
+        """
+        The number of requests currently waiting, across all buckets.
+        """
+        return sum(bucket.waiting for bucket in self.buckets.values())
+
+    def acquire(self, key, priority=RequestPriority.INTERACTIVE, flow=None):
+        """
+        Blocks until a request to the given bucket may be made.
+
+        Parameters
+        ----------
+        key : object
+            The rate limit bucket of the request.
+        priority : `RequestPriority`
+            The priority class of the request (or its name, e.g. 'bulk').
+        flow : object
+            The flow the request belongs to, requests of equal priority are
+            admitted fairly between flows.
+
+        Returns
+        -------
+        float
+            The number of seconds waited.
+        """
+        bucket = self.buckets.setdefault(key, BucketQueue())
+        if bucket.active < self.concurrency and not bucket.waiting:
+            bucket.active += 1
+            return 0
+
+        start = time.time()
+        event = Event()
+        priority = RequestPriority.get(priority).value
+        bucket.push(priority, flow, event)
+
+        try:
+            event.wait()
+        except BaseException:
+            # If we were given a slot before being interrupted, pass it on
+            if not bucket.remove(priority, flow, event):
+                self.release(key)
+            raise
+
+        return time.time() - start
+
+    def release(self, key):
+        """
+        Marks a request to the given bucket as finished, admitting the next
+        waiting request (if any).
+        """
+        bucket = self.buckets[key]
+        bucket.active -= 1
+
+        while bucket.waiting and bucket.active < self.concurrency:
+            bucket.active += 1
+            bucket.pop().set()
+
+        if not bucket.active and not bucket.waiting:
+            del self.buckets[key]
+
+    @contextmanager
+    def slot(self, key, priority=RequestPriority.INTERACTIVE, flow=None):
+        """
+        Context manager which acquires (and then releases) a request slot for the
+        given bucket, yielding the number of seconds waited.
+        """
+        waited = self.acquire(key, priority, flow)
+        try:
+            yield waited
+        finally:
+            self.release(key)
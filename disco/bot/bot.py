@@ -72,6 +72,11 @@ class BotConfig(Config):
         The host string for the HTTP Flask server (if enabled)
     http_port : int
         The port for the HTTP Flask server (if enabled)
+    http_metrics_enabled : bool
+        Whether the HTTP server should expose the clients metrics in the Prometheus
+        text format.
+    http_metrics_path : str
+        The path metrics are exposed on (if enabled).
     """
     levels = {}
     plugins = []
@@ -103,6 +108,8 @@ class BotConfig(Config):
     http_enabled = False
     http_host = '0.0.0.0'
     http_port = 7575
+    http_metrics_enabled = False
+    http_metrics_path = '/metrics'
 
 
 class Bot(LoggingClass):
@@ -156,6 +163,10 @@ class Bot(LoggingClass):
             else:
                 self.log.info('Starting HTTP server bound to %s:%s', self.config.http_host, self.config.http_port)
                 self.http = Flask('disco')
+
+                if self.config.http_metrics_enabled:
+                    self.http.add_url_rule(self.config.http_metrics_path, 'metrics', self.http_metrics)
+
                 self.http_server = WSGIServer((self.config.http_host, self.config.http_port), self.http)
                 self.http_server_greenlet = gevent.spawn(self.http_server.serve_forever)
 
@@ -189,6 +200,12 @@ class Bot(LoggingClass):
         for k, v in list(six.iteritems(self.config.levels)):
             self.config.levels[int(k) if k.isdigit() else k] = CommandLevels.get(v)
 
+    def http_metrics(self):
+        """
+        Flask view which renders the clients metrics in the Prometheus text format.
+        """
+        return self.client.metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
     @classmethod
     def from_cli(cls, *plugins):
         """
@@ -288,13 +305,16 @@ class Bot(LoggingClass):
         content = msg.content
 
         if require_mention:
-            mention_direct = msg.is_mentioned(self.client.state.me)
+            # Use the state of the client which received the message, as with a
+            #  `ShardCluster` the bot is shared between several clients.
+            me = msg.client.state.me
+            mention_direct = msg.is_mentioned(me)
             mention_everyone = msg.mention_everyone
 
             mention_roles = []
             if msg.guild:
                 mention_roles = list(filter(lambda r: msg.is_mentioned(r),
-                                            msg.guild.get_member(self.client.state.me).roles))
+                                            msg.guild.get_member(me).roles))
 
             if not any((
                 mention_rules.get('user', True) and mention_direct,
@@ -306,13 +326,13 @@ class Bot(LoggingClass):
 
             if mention_direct:
                 if msg.guild:
-                    member = msg.guild.get_member(self.client.state.me)
+                    member = msg.guild.get_member(me)
                     if member:
                         # Filter both the normal and nick mentions
                         content = content.replace(member.user.mention, '', 1)
                         content = content.replace(member.user.mention_nickname, '', 1)
                 else:
-                    content = content.replace(self.client.state.me.mention, '', 1)
+                    content = content.replace(me.mention, '', 1)
             elif mention_everyone:
                 content = content.replace('@everyone', '', 1)
             else:
@@ -396,7 +416,7 @@ class Bot(LoggingClass):
         return False
 
     def on_message_create(self, event):
-        if event.message.author.id == self.client.state.me.id:
+        if event.message.author.id == event.client.state.me.id:
             return
 
         result = self.handle_message(event.message)
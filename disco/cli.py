@@ -20,6 +20,8 @@ parser.add_argument('--run-bot', help='run a disco bot on this client', action='
 parser.add_argument('--plugin', help='load plugins into the bot', nargs='*', default=[])
 parser.add_argument('--config', help='Configuration file', default=None)
 parser.add_argument('--shard-auto', help='Automatically run all shards', action='store_true', default=False)
+parser.add_argument('--shards-per-process', help='Shards run by each process when auto sharding', default=None)
+parser.add_argument('--shard-processes', help='Processes to split shards between when auto sharding', default=None)
 
 # Configuration overrides
 parser.add_argument('--token', help='Bot Authentication Token', default=None)
@@ -30,6 +32,7 @@ parser.add_argument('--log-level', help='log level', default=None)
 parser.add_argument('--manhole', action='store_true', help='Enable the manhole', default=None)
 parser.add_argument('--manhole-bind', help='host:port for the manhole to bind too', default=None)
 parser.add_argument('--encoder', help='encoder for gateway data', default=None)
+parser.add_argument('--json-backend', help='JSON implementation for gateway and HTTP data', default=None)
 
 
 # Mapping of argument names to configuration overrides
@@ -42,6 +45,9 @@ CONFIG_OVERRIDE_MAPPING = {
     'manhole': 'manhole_enable',
     'manhole_bind': 'manhole_bind',
     'encoder': 'encoder',
+    'json_backend': 'json_backend',
+    'shards_per_process': 'shards_per_process',
+    'shard_processes': 'shard_processes',
 }
 
 
@@ -6,10 +6,13 @@ from holster.emitter import Emitter
 from disco.state import State, StateConfig
 from disco.api.client import APIClient
 from disco.gateway.client import GatewayClient
+from disco.gateway.dispatch import DispatchScheduler
+from disco.gateway.session import FileSessionStore
 from disco.gateway.packets import OPCode
 from disco.types.user import Status, Game
 from disco.util.config import Config
 from disco.util.logging import LoggingClass
+from disco.util.metrics import MetricsRegistry
 from disco.util.backdoor import DiscoBackdoorServer
 
 
@@ -38,6 +41,107 @@ class ClientConfig(Config):
     encoder : str
         The type of encoding to use for encoding/decoding data from websockets,
         should be either 'json' or 'etf'.
+    json_backend : Optional[str]
+        The JSON implementation used for gateway (and voice gateway) payloads and
+        REST requests/responses, one of the keys of
+        `disco.gateway.encoding.JSON_BACKENDS` (e.g. 'orjson' or 'msgspec'). If
+        not set, ujson is used when installed.
+    decode_offload_threshold : Optional[int]
+        If set, gateway messages of at least this many (compressed) bytes are
+        inflated and decoded on the gevent threadpool instead of the hub, so large
+        READY/GUILD_CREATE payloads do not stall heartbeats or other greenlets.
+    dispatch_workers : Optional[int]
+        If set, event handlers are run by a `disco.gateway.dispatch.DispatchScheduler`
+        with this many workers, instead of a new greenlet being spawned for every
+        handler. Events for the same guild are handled in order.
+    dispatch_queue_size : int
+        The maximum number of events queued within the dispatch scheduler.
+    dispatch_overflow : str
+        What the dispatch scheduler does when its queue is full, one of 'block'
+        (stop reading from the gateway), 'drop_low_priority' or 'shed'.
+    dispatch_low_priority_events : list(str)
+        Events which may be dropped under the 'drop_low_priority' overflow policy.
+    session_store_path : Optional[str]
+        If set, the gateway session is persisted to a file within this directory
+        (on shutdown and periodically), and a restarted client will attempt to
+        RESUME it instead of sending a fresh IDENTIFY. As a resumed session only
+        replays missed events, the `State` is seeded from the API instead of a
+        READY and GUILD_CREATEs (see `State.seed`).
+    session_max_age : int
+        The maximum age (in seconds) of a persisted session which will be resumed.
+    session_save_interval : int
+        How often (in seconds) the persisted session is updated.
+    shards_per_process : int
+        When automatically sharding, the number of shards run by each process
+        (see `disco.gateway.cluster.ShardCluster`).
+    shard_processes : Optional[int]
+        When automatically sharding, if set the shards are split evenly between
+        this many processes, overriding `shards_per_process`.
+    ipc_codec : str
+        The codec used for messages between shard processes, either 'marshal' or
+        'msgpack' (which requires the msgpack library). Anything the codec can not
+        serialize falls back to pickle.
+    supervisor_enabled : bool
+        When automatically sharding, whether shard processes are monitored and
+        restarted when unhealthy (see `disco.gateway.sharder.ShardSupervisor`).
+        Disabled by default.
+    supervisor_interval : int
+        How often (in seconds) shard processes are health checked.
+    supervisor_max_latency : Optional[float]
+        The heartbeat latency (in seconds) above which a shard is unhealthy.
+    supervisor_max_idle : Optional[float]
+        How long (in seconds) a shard may go without receiving anything from the
+        gateway before it is unhealthy.
+    supervisor_max_memory : Optional[int]
+        The memory usage (in megabytes) above which a shard process is unhealthy.
+    supervisor_failures : int
+        The number of consecutive failed health checks before a shard process is
+        restarted.
+    http_global_budget : Optional[int]
+        The number of REST requests per second this token may make, before Discord
+        enforces its global rate limit. Requests wait for the budget, which is
+        shared by every shard when automatically sharding (see
+        `disco.api.ratelimit.GlobalBudget`). When automatically sharding, every
+        request then reserves from the parent process over IPC, so this is
+        disabled by default and requests are only limited by Discord's responses.
+    http_coalesce : bool
+        Whether identical concurrent GET requests to any route share a single
+        request (and its response object), see `disco.api.http.HTTPClient`.
+        Disabled by default.
+    http_coalesce_routes : dict(str, bool)
+        Enables (or disables) coalescing for individual routes, keyed by the name
+        of the route within `disco.api.http.Routes` (e.g. 'GUILDS_GET').
+    http_cache_enabled : bool
+        Whether responses to read-mostly routes (e.g. `APIClient.guilds_get`) are
+        cached, see `disco.api.cache.ResponseCache`. Cached responses are
+        invalidated by gateway events and by our own mutating requests.
+    http_cache_ttls : dict(str, float)
+        TTLs (in seconds) of cached routes, keyed by the name of the route within
+        `disco.api.http.Routes`. Merged with `disco.api.cache.DEFAULT_TTLS`.
+    http_cache_size : int
+        The maximum number of cached responses.
+    http_pool_size : int
+        The number of connections to the API kept alive within the connection pool.
+    http_pool_block : bool
+        Whether requests wait for a pooled connection when all are in use, rather
+        than opening an extra connection which is closed afterwards.
+    http_idle_timeout : Optional[float]
+        If set, pooled connections are discarded (rather than reused) after the
+        HTTP client has been idle for this many seconds.
+    http_warm_connections : int
+        The number of API connections opened when the client is run, before any
+        requests are made.
+    http_bucket_concurrency : Optional[int]
+        The maximum number of concurrent requests to a single rate limit bucket.
+        Requests waiting for a bucket are admitted by priority (see
+        `disco.api.scheduler.RequestScheduler`). If not set, requests are not
+        scheduled.
+    http_pipeline_concurrency : int
+        The maximum number of API calls submitted with `APIClient.submit` which
+        are run at once.
+    http_pipeline_max_queued : Optional[int]
+        If set, the maximum number of submitted API calls waiting to be run, past
+        which `APIClient.submit` blocks.
     """
 
     token = ''
@@ -50,6 +154,44 @@ class ClientConfig(Config):
     manhole_bind = ('127.0.0.1', 8484)
 
     encoder = 'json'
+    json_backend = None
+    decode_offload_threshold = None
+
+    dispatch_workers = None
+    dispatch_queue_size = 10000
+    dispatch_overflow = 'block'
+    dispatch_low_priority_events = ['PresenceUpdate', 'TypingStart']
+
+    session_store_path = None
+    session_max_age = 60
+    session_save_interval = 15
+
+    shards_per_process = 1
+    shard_processes = None
+    ipc_codec = 'marshal'
+
+    supervisor_enabled = False
+    supervisor_interval = 30
+    supervisor_max_latency = 15
+    supervisor_max_idle = 180
+    supervisor_max_memory = None
+    supervisor_failures = 3
+
+    http_global_budget = None
+    http_coalesce = False
+    http_coalesce_routes = {}
+
+    http_cache_enabled = False
+    http_cache_ttls = {}
+    http_cache_size = 1000
+
+    http_pool_size = 10
+    http_pool_block = False
+    http_idle_timeout = 60
+    http_warm_connections = 0
+    http_bucket_concurrency = 5
+    http_pipeline_concurrency = 10
+    http_pipeline_max_queued = None
 
 
 class Client(LoggingClass):
@@ -63,6 +205,12 @@ class Client(LoggingClass):
     ----------
     config : `ClientConfig`
         Configuration for this client instance.
+    api : Optional[`APIClient`]
+        An existing API client to share the HTTP client (and rate limiter) of.
+    events : Optional[`Emitter`]
+        An existing emitter to emit Gateway events on, shared with other clients.
+    metrics : Optional[`MetricsRegistry`]
+        An existing metrics registry to record metrics within.
 
     Attributes
     ----------
@@ -70,12 +218,19 @@ class Client(LoggingClass):
         The runtime configuration for this client.
     events : `Emitter`
         An emitter which emits Gateway events.
+    shared_events : bool
+        Whether `events` is shared with other clients, in which case listeners
+        should check `event.client`.
     packets : `Emitter`
         An emitter which emits Gateway packets.
     state : `State`
         The state tracking object.
     api : `APIClient`
         The API client.
+    dispatcher : Optional[`DispatchScheduler`]
+        The scheduler used for event handlers, if enabled.
+    metrics : `MetricsRegistry`
+        Throughput and latency metrics for this client.
     gw : `GatewayClient`
         The gateway client.
     manhole_locals : dict
@@ -84,15 +239,44 @@ class Client(LoggingClass):
     manhole : Optional[`BackdoorServer`]
         Gevent backdoor server (if the manhole is enabled).
     """
-    def __init__(self, config):
+    def __init__(self, config, api=None, events=None, metrics=None):
         super(Client, self).__init__()
         self.config = config
 
-        self.events = Emitter()
+        self.shared_events = events is not None
+        self.events = events if self.shared_events else Emitter()
         self.packets = Emitter()
+        self.metrics = metrics or MetricsRegistry()
 
-        self.api = APIClient(self.config.token, self)
-        self.gw = GatewayClient(self, self.config.max_reconnects, self.config.encoder)
+        if api:
+            self.api = api.with_client(self)
+        else:
+            self.api = APIClient(self.config.token, self)
+
+        self.dispatcher = None
+        if self.config.dispatch_workers:
+            self.dispatcher = DispatchScheduler(
+                self.events,
+                self.config.dispatch_workers,
+                self.config.dispatch_queue_size,
+                self.config.dispatch_overflow,
+                self.config.dispatch_low_priority_events)
+
+        session_store = None
+        if self.config.session_store_path:
+            session_store = FileSessionStore(self.config.session_store_path)
+
+        self.gw = GatewayClient(
+            self,
+            self.config.max_reconnects,
+            self.config.encoder,
+            json_backend=self.config.json_backend,
+            decode_offload_threshold=self.config.decode_offload_threshold,
+            dispatcher=self.dispatcher,
+            metrics=self.metrics,
+            session_store=session_store,
+            session_max_age=self.config.session_max_age,
+            session_save_interval=self.config.session_save_interval)
         self.state = State(self, StateConfig(self.config.get('state', {})))
 
         if self.config.manhole_enable:
@@ -145,10 +329,20 @@ class Client(LoggingClass):
         """
         Run the client (e.g. the `GatewayClient`) in a new greenlet.
         """
+        self.warm_up()
         return gevent.spawn(self.gw.run)
 
     def run_forever(self):
         """
         Run the client (e.g. the `GatewayClient`) in the current greenlet.
         """
+        self.warm_up()
         return self.gw.run()
+
+    def warm_up(self):
+        """
+        Opens `ClientConfig.http_warm_connections` API connections in the
+        background.
+        """
+        if self.config.http_warm_connections:
+            gevent.spawn(self.api.http.warm_up, self.config.http_warm_connections)
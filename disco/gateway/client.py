@@ -1,30 +1,48 @@
 import gevent
+import time
 import zlib
 import six
 import ssl
 
-from websocket import ABNF
+from holster.emitter import Priority
 
 from disco.gateway.packets import OPCode, RECV, SEND
 from disco.gateway.events import GatewayEvent
-from disco.gateway.encoding import ENCODERS
+from disco.gateway.encoding import get_encoder
+from disco.gateway.compression import ZlibStreamInflator
 from disco.util.websocket import Websocket
 from disco.util.logging import LoggingClass
-from disco.util.limiter import SimpleLimiter
+from disco.util.limiter import SlidingWindowLimiter, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from disco.util.metrics import MetricsRegistry, timer
 
 TEN_MEGABYTES = 10490000
-ZLIB_SUFFIX = b'\x00\x00\xff\xff'
+
+# Priority of outgoing payloads within the send limiter, anything not listed here
+#  is sent with PRIORITY_NORMAL.
+SEND_PRIORITIES = {
+    OPCode.HEARTBEAT: PRIORITY_HIGH,
+    OPCode.IDENTIFY: PRIORITY_HIGH,
+    OPCode.RESUME: PRIORITY_HIGH,
+    OPCode.STATUS_UPDATE: PRIORITY_LOW,
+    OPCode.REQUEST_GUILD_MEMBERS: PRIORITY_LOW,
+}
 
 
 class GatewayClient(LoggingClass):
     GATEWAY_VERSION = 6
 
-    def __init__(self, client, max_reconnects=5, encoder='json', zlib_stream_enabled=True, ipc=None):
+    def __init__(self, client, max_reconnects=5, encoder='json', zlib_stream_enabled=True, ipc=None,
+                 json_backend=None, decode_offload_threshold=None, dispatcher=None, metrics=None,
+                 session_store=None, session_max_age=60, session_save_interval=15, identify_scheduler=None):
         super(GatewayClient, self).__init__()
         self.client = client
         self.max_reconnects = max_reconnects
-        self.encoder = ENCODERS[encoder]
+        self.encoder = get_encoder(encoder, json_backend)
         self.zlib_stream_enabled = zlib_stream_enabled
+        self.decode_offload_threshold = decode_offload_threshold
+        self.dispatcher = dispatcher
+        self.metrics = metrics or MetricsRegistry()
+        self._setup_metrics()
 
         self.events = client.events
         self.packets = client.packets
@@ -34,11 +52,17 @@ class GatewayClient(LoggingClass):
             self.shards = ipc.get_shards()
             self.ipc = ipc
 
-        # Its actually 60, 120 but lets give ourselves a buffer
-        self.limiter = SimpleLimiter(60, 130)
+        # Its actually 120 per 60 seconds but lets give ourselves a buffer, with a
+        #  few of those reserved for heartbeats/identifies/resumes.
+        self.limiter = SlidingWindowLimiter(115, 60, reserved=5)
 
         # Create emitter and bind to gateway payloads
-        self.packets.on((RECV, OPCode.DISPATCH), self.handle_dispatch)
+        # With a dispatch scheduler, dispatches are handled inline (in gateway order)
+        #  and the scheduler applies backpressure to the websocket reader.
+        self.packets.on(
+            (RECV, OPCode.DISPATCH),
+            self.handle_dispatch,
+            priority=Priority.BEFORE if dispatcher else Priority.NONE)
         self.packets.on((RECV, OPCode.HEARTBEAT), self.handle_heartbeat)
         self.packets.on((RECV, OPCode.HEARTBEAT_ACK), self.handle_heartbeat_acknowledge)
         self.packets.on((RECV, OPCode.RECONNECT), self.handle_reconnect)
@@ -52,8 +76,7 @@ class GatewayClient(LoggingClass):
         # Websocket connection
         self.ws = None
         self.ws_event = gevent.event.Event()
-        self._zlib = None
-        self._buffer = None
+        self._inflator = ZlibStreamInflator() if zlib_stream_enabled else None
 
         # State
         self.seq = 0
@@ -62,6 +85,20 @@ class GatewayClient(LoggingClass):
         self.shutting_down = False
         self.replaying = False
         self.replayed_events = 0
+        self.last_message_at = None
+
+        # Optional `GatewayRecorder` which receives all raw messages
+        self.recorder = None
+
+        # Optional `SessionStore` used to resume sessions across process restarts
+        self.session_store = session_store
+        self.session_max_age = session_max_age
+        self.session_save_interval = session_save_interval
+        self._session_save_task = None
+
+        # Optional `IdentifyScheduler` (or proxy to one), which is waited on before
+        #  connecting to IDENTIFY (but not to RESUME)
+        self.identify_scheduler = identify_scheduler
 
         # Cached gateway URL
         self._cached_gateway_url = None
@@ -69,9 +106,49 @@ class GatewayClient(LoggingClass):
         # Heartbeat
         self._heartbeat_task = None
         self._heartbeat_acknowledged = True
+        self._heartbeat_sent_at = None
+        self.latency = None
+
+        # Why we closed the websocket ourselves, used to label reconnects
+        self._close_reason = None
+
+    def _setup_metrics(self):
+        # Shards within a cluster share a registry, so every metric is labelled
+        #  with the shard it belongs to.
+        self._shard = str(self.client.config.shard_id)
+        shard = ('shard', )
+
+        m = self.metrics
+        self._m_frames = m.counter('disco_gateway_frames_received', 'Websocket messages received', labels=shard)
+        self._m_bytes = m.counter(
+            'disco_gateway_bytes_received', 'Websocket bytes received (before inflation)', labels=shard)
+        self._m_inflate = m.histogram(
+            'disco_gateway_inflate_seconds', 'Time spent inflating zlib-stream frames', labels=shard)
+        self._m_decode = m.histogram(
+            'disco_gateway_decode_seconds', 'Time spent decoding gateway payloads', labels=shard)
+        self._m_event_create = m.histogram(
+            'disco_gateway_event_create_seconds', 'Time spent constructing event models', labels=('shard', 'event'))
+        self._m_heartbeat = m.histogram(
+            'disco_gateway_heartbeat_latency_seconds', 'Round-trip time between HEARTBEAT and HEARTBEAT_ACK',
+            labels=shard)
+        self._m_resumes = m.counter('disco_gateway_resumes', 'Successfully resumed sessions', labels=shard)
+        self._m_replayed = m.counter('disco_gateway_replayed_events', 'Events replayed while resuming', labels=shard)
+        self._m_reconnects = m.counter(
+            'disco_gateway_reconnects', 'Websocket reconnects', labels=('shard', 'reason'))
+        m.gauge(
+            'disco_gateway_send_wait_seconds', 'Time a normal priority send would currently wait for', labels=shard,
+        ).set_function(lambda: self.limiter.wait_time(), shard=self._shard)
+
+        if self.dispatcher:
+            m.gauge(
+                'disco_gateway_dispatch_queue_depth', 'Events waiting within the dispatch scheduler', labels=shard,
+            ).set_function(lambda: self.dispatcher.depth, shard=self._shard)
+            m.gauge(
+                'disco_gateway_dispatch_dropped', 'Events dropped by the dispatch scheduler', labels=shard,
+            ).set_function(lambda: self.dispatcher.dropped, shard=self._shard)
 
     def send(self, op, data):
-        self.limiter.check()
+        self.limiter.check(SEND_PRIORITIES.get(op, PRIORITY_NORMAL))
         return self._send(op, data)
 
     def _send(self, op, data):
@@ -87,35 +164,57 @@ class GatewayClient(LoggingClass):
             if not self._heartbeat_acknowledged:
                 self.log.warning('Received HEARTBEAT without HEARTBEAT_ACK, forcing a fresh reconnect')
                 self._heartbeat_acknowledged = True
+                self._close_reason = 'heartbeat_timeout'
                 self.ws.close(status=4000)
                 return
 
-            self._send(OPCode.HEARTBEAT, self.seq)
+            self.send(OPCode.HEARTBEAT, self.seq)
+            self._heartbeat_sent_at = timer()
             self._heartbeat_acknowledged = False
             gevent.sleep(interval / 1000)
 
     def handle_dispatch(self, packet):
-        obj = GatewayEvent.from_dispatch(self.client, packet)
-        self.log.debug('GatewayClient.handle_dispatch %s', obj.__class__.__name__)
-        self.client.events.emit(obj.__class__.__name__, obj)
+        # With a dispatcher this is called inline by the emitter, which would
+        #  silently discard any exception, so errors are always logged here.
+        try:
+            with self._m_event_create.time(shard=self._shard, event=packet['t']):
+                obj = GatewayEvent.from_dispatch(self.client, packet)
+            self.log.debug('GatewayClient.handle_dispatch %s', obj.__class__.__name__)
+            if self.dispatcher:
+                self.dispatcher.emit(obj.__class__.__name__, obj)
+            else:
+                self.client.events.emit(obj.__class__.__name__, obj)
+        except Exception:
+            self.log.exception('Failed to handle dispatch %s: ', packet.get('t'))
+            return
+
         if self.replaying:
             self.replayed_events += 1
+            self._m_replayed.inc(shard=self._shard)
 
     def handle_heartbeat(self, _):
-        self._send(OPCode.HEARTBEAT, self.seq)
+        self.send(OPCode.HEARTBEAT, self.seq)
 
     def handle_heartbeat_acknowledge(self, _):
         self.log.debug('Received HEARTBEAT_ACK')
         self._heartbeat_acknowledged = True
 
+        if self._heartbeat_sent_at is not None:
+            self.latency = timer() - self._heartbeat_sent_at
+            self._heartbeat_sent_at = None
+            self._m_heartbeat.observe(self.latency, shard=self._shard)
+
     def handle_reconnect(self, _):
         self.log.warning('Received RECONNECT request, forcing a fresh reconnect')
+        self._close_reason = 'reconnect_request'
         self.session_id = None
         self.ws.close()
 
     def handle_invalid_session(self, _):
         self.log.warning('Received INVALID_SESSION, forcing a fresh reconnect')
+        self._close_reason = 'invalid_session'
         self.session_id = None
+        self.clear_session()
         self.ws.close()
 
     def handle_hello(self, packet):
@@ -123,21 +222,98 @@ class GatewayClient(LoggingClass):
         self._heartbeat_task = gevent.spawn(self.heartbeat_task, packet['d']['heartbeat_interval'])
 
     def on_ready(self, ready):
+        if ready.client is not self.client:
+            return
+
         self.log.info('Received READY')
         self.session_id = ready.session_id
         self.reconnects = 0
+        self.save_session()
+
+    def on_resumed(self, resumed):
+        if resumed.client is not self.client:
+            return
 
-    def on_resumed(self, _):
         self.log.info('RESUME completed, replayed %s events', self.replayed_events)
+        self._m_resumes.inc(shard=self._shard)
         self.reconnects = 0
         self.replaying = False
 
+    def _get_shard(self):
+        return int(self.client.config.shard_id), int(self.client.config.shard_count)
+
+    def restore_session(self):
+        """
+        Loads the session from the session store (if there is one), so the next
+        connection attempts to RESUME it. Sessions older than `session_max_age`
+        seconds are ignored, and if the gateway rejects the session a normal
+        IDENTIFY is sent instead.
+
+        Returns
+        -------
+        bool
+            Whether a session was restored.
+        """
+        if not self.session_store or self.session_id:
+            return False
+
+        try:
+            session = self.session_store.load(*self._get_shard())
+        except Exception:
+            self.log.exception('Failed to load stored gateway session: ')
+            return False
+
+        if not session:
+            return False
+
+        age = time.time() - session.get('saved_at', 0)
+        if age > self.session_max_age:
+            self.log.info('Ignoring stored gateway session %s, it is %.0fs old', session['session_id'], age)
+            return False
+
+        self.log.info('Restored gateway session %s (seq %s, %.0fs old)', session['session_id'], session['seq'], age)
+        self.session_id = session['session_id']
+        self.seq = session['seq'] or 0
+        return True
+
+    def save_session(self):
+        """
+        Writes the current session to the session store (if there is one).
+        """
+        if not self.session_store or not self.session_id:
+            return
+
+        try:
+            self.session_store.save(*(self._get_shard() + (self.session_id, self.seq)))
+        except Exception:
+            self.log.exception('Failed to save gateway session: ')
+
+    def clear_session(self):
+        if not self.session_store:
+            return
+
+        try:
+            self.session_store.clear(*self._get_shard())
+        except Exception:
+            self.log.exception('Failed to clear stored gateway session: ')
+
+    def session_save_task(self):
+        while True:
+            gevent.sleep(self.session_save_interval)
+            self.save_session()
+
     def connect_and_run(self, gateway_url=None):
-        if not gateway_url:
-            if not self._cached_gateway_url:
-                self._cached_gateway_url = self.client.api.gateway_get()['url']
+        # An explicitly passed URL (e.g. a local test gateway) is reused for reconnects
+        if gateway_url:
+            self._cached_gateway_url = gateway_url
+        elif not self._cached_gateway_url:
+            self._cached_gateway_url = self.client.api.gateway_get()['url']
 
-            gateway_url = self._cached_gateway_url
+        gateway_url = self._cached_gateway_url
+
+        if self.identify_scheduler and not (self.seq and self.session_id):
+            self.log.info('Waiting for our turn to IDENTIFY')
+            self.identify_scheduler.acquire(int(self.client.config.shard_id))
 
         gateway_url += '?v={}&encoding={}'.format(self.GATEWAY_VERSION, self.encoder.TYPE)
 
@@ -154,51 +330,73 @@ class GatewayClient(LoggingClass):
         self.ws.run_forever(sslopt={'cert_reqs': ssl.CERT_NONE})
 
     def on_message(self, msg):
-        if self.zlib_stream_enabled:
-            if not self._buffer:
-                self._buffer = bytearray()
+        self.last_message_at = time.time()
+
+        if self.recorder:
+            self.recorder.record(msg)
+
+        # Inflating and decoding huge payloads (READY, large GUILD_CREATEs) can
+        #  block the hub for long enough to miss heartbeats, so they are run on
+        #  the threadpool. This greenlet waits for the result before the next
+        #  message is read, which keeps packets ordered.
+        size = len(msg) + (self._inflator.pending if self.zlib_stream_enabled else 0)
+        if self.decode_offload_threshold is not None and size >= self.decode_offload_threshold:
+            data = gevent.get_hub().threadpool.apply(self.decode_message, (msg, ))
+        else:
+            data = self.decode_message(msg)
+
+        if data is None:
+            return
 
-            self._buffer.extend(msg)
+        # Update sequence
+        if data['s'] and data['s'] > self.seq:
+            self.seq = data['s']
 
-            if len(msg) < 4:
-                return
+        # Emit packet
+        self.packets.emit((RECV, OPCode[data['op']]), data)
 
-            if msg[-4:] != ZLIB_SUFFIX:
-                return
+    def decode_message(self, msg):
+        """
+        Inflates (if required) and decodes a raw websocket message, returning the
+        decoded packet or None if the message was incomplete or invalid.
+        """
+        self._m_frames.inc(shard=self._shard)
+        self._m_bytes.inc(len(msg), shard=self._shard)
+
+        if self.zlib_stream_enabled:
+            # Encoders accept raw bytes, so the inflated payload is passed along
+            #  without an intermediate utf-8 decode.
+            with self._m_inflate.time(shard=self._shard):
+                msg = self._inflator.feed(msg)
 
-            msg = self._zlib.decompress(self._buffer if six.PY3 else str(self._buffer))
-            # If this encoder is text based, we want to decode the data as utf8
-            if self.encoder.OPCODE == ABNF.OPCODE_TEXT:
-                msg = msg.decode('utf-8')
-            self._buffer = None
+            if msg is None:
+                return None
         else:
             # Detect zlib and decompress
             is_erlpack = ((six.PY2 and ord(msg[0]) == 131) or (six.PY3 and msg[0] == 131))
             if msg[0] != '{' and not is_erlpack:
-                msg = zlib.decompress(msg, 15, TEN_MEGABYTES).decode('utf-8')
+                msg = zlib.decompress(msg, 15, TEN_MEGABYTES)
 
         try:
-            data = self.encoder.decode(msg)
+            with self._m_decode.time(shard=self._shard):
+                return self.encoder.decode(msg)
         except Exception:
             self.log.exception('Failed to parse gateway message: ')
-            return
-
-        # Update sequence
-        if data['s'] and data['s'] > self.seq:
-            self.seq = data['s']
-
-        # Emit packet
-        self.packets.emit((RECV, OPCode[data['op']]), data)
+            return None
 
     def on_error(self, error):
         if isinstance(error, KeyboardInterrupt):
             self.shutting_down = True
+            self.save_session()
             self.ws_event.set()
         raise Exception('WS received error: {}'.format(error))
 
     def on_open(self):
         if self.zlib_stream_enabled:
-            self._zlib = zlib.decompressobj()
+            self._inflator.reset()
+
+        if self.recorder:
+            self.recorder.record_connect()
 
         if self.seq and self.session_id:
             self.log.info('WS Opened: attempting resume w/ SID: %s SEQ: %s', self.session_id, self.seq)
@@ -228,22 +426,27 @@ class GatewayClient(LoggingClass):
 
     def on_close(self, code, reason):
         # Make sure we cleanup any old data
-        self._buffer = None
+        if self.zlib_stream_enabled:
+            self._inflator.reset()
 
         # Kill heartbeater, a reconnect/resume will trigger a HELLO which will
         #  respawn it
         if self._heartbeat_task:
             self._heartbeat_task.kill()
+        self._heartbeat_sent_at = None
 
         # If we're quitting, just break out of here
         if self.shutting_down:
             self.log.info('WS Closed: shutting down')
+            self.save_session()
             return
 
         self.replaying = False
 
         # Track reconnect attempts
         self.reconnects += 1
+        self._m_reconnects.inc(shard=self._shard, reason=self._close_reason or 'close_{}'.format(code))
+        self._close_reason = None
         self.log.info('WS Closed: [%s] %s (%s)', code, reason, self.reconnects)
 
         if self.max_reconnects and self.reconnects > self.max_reconnects:
@@ -252,6 +455,7 @@ class GatewayClient(LoggingClass):
         # Don't resume for these error codes
         if code and 4000 <= code <= 4010:
             self.session_id = None
+            self.clear_session()
 
         wait_time = self.reconnects * 5
         self.log.info('Will attempt to %s after %s seconds', 'resume' if self.session_id else 'reconnect', wait_time)
@@ -261,8 +465,28 @@ class GatewayClient(LoggingClass):
         self.connect_and_run()
 
     def run(self):
+        # A restored session is resumed without a READY (or GUILD_CREATEs), so
+        #  the state has to be seeded from the API instead.
+        if self.restore_session() and getattr(self.client, 'state', None):
+            try:
+                self.client.state.seed()
+            except Exception:
+                self.log.exception('Failed to seed state for the restored session, identifying instead: ')
+                self.session_id = None
+                self.seq = 0
+
+        if self.session_store and self.session_save_interval:
+            self._session_save_task = gevent.spawn(self.session_save_task)
+
         gevent.spawn(self.connect_and_run)
-        self.ws_event.wait()
+        try:
+            self.ws_event.wait()
+        finally:
+            # The websocket is intentionally not closed here, as a clean close
+            #  invalidates the session on Discords side.
+            if self._session_save_task:
+                self._session_save_task.kill()
+            self.save_session()
 
     def request_guild_members(self, guild_id_or_ids, query=None, limit=0):
         """
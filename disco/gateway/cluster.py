@@ -0,0 +1,85 @@
+import gevent
+
+from collections import OrderedDict
+
+from holster.emitter import Emitter
+
+from disco.client import Client
+from disco.gateway.identify import IdentifyScheduler
+from disco.util.logging import LoggingClass
+from disco.util.metrics import MetricsRegistry
+
+
+class ShardCluster(LoggingClass):
+    """
+    Runs several shards within a single process. Each shard has its own `Client`
+    (and thus its own `GatewayClient` and `State`), but all of them share a single
+    HTTP client and rate limiter, a single metrics registry, and a single events
+    emitter, so one `Bot` (and one copy of each plugin) can serve every shard.
+
+    Listeners on the shared emitter receive events for every shard, and should use
+    `event.client` (or properties like `event.guild`) rather than a fixed client
+    to reach the right shard's state.
+
+    Parameters
+    ----------
+    config : `disco.client.ClientConfig`
+        The configuration shared by all shards, `shard_id` is set per shard.
+    shard_ids : list(int)
+        The shards to run within this cluster.
+    identify_scheduler : Optional[`IdentifyScheduler`]
+        Scheduler used to space out IDENTIFYs, by default the shards within this
+        cluster are identified one at a time.
+
+    Attributes
+    ----------
+    clients : OrderedDict(int, `disco.client.Client`)
+        Mapping of shard IDs to their clients.
+    events : `Emitter`
+        The emitter shared by all clients.
+    """
+    def __init__(self, config, shard_ids, identify_scheduler=None):
+        super(ShardCluster, self).__init__()
+        self.config = config
+        self.events = Emitter()
+        self.metrics = MetricsRegistry()
+        self.identify_scheduler = identify_scheduler or IdentifyScheduler()
+        self.clients = OrderedDict()
+
+        api = None
+        for shard_id in shard_ids:
+            shard_config = config.__class__(config.to_dict())
+            shard_config.shard_id = shard_id
+
+            # Only the first shard gets a manhole
+            if self.clients:
+                shard_config.manhole_enable = False
+
+            client = Client(shard_config, api=api, events=self.events, metrics=self.metrics)
+            client.gw.identify_scheduler = self.identify_scheduler
+            self.clients[shard_id] = client
+            api = api or client.api
+
+    @property
+    def client(self):
+        """
+        The client for the first shard within this cluster.
+        """
+        return next(iter(self.clients.values()))
+
+    @property
+    def api(self):
+        return self.client.api
+
+    def run(self):
+        """
+        Run all shards within this cluster in a new greenlet.
+        """
+        return gevent.spawn(self.run_forever)
+
+    def run_forever(self):
+        """
+        Run all shards within this cluster in the current greenlet.
+        """
+        self.log.info('Running shards %s', ', '.join(map(str, self.clients.keys())))
+        gevent.joinall([client.run() for client in self.clients.values()], raise_error=True)
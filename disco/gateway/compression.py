@@ -0,0 +1,62 @@
+import zlib
+
+ZLIB_SUFFIX = b'\x00\x00\xff\xff'
+
+
+class ZlibStreamInflator(object):
+    """
+    Incrementally inflates a Discord `zlib-stream` gateway connection. Frames are
+    passed into the shared decompressor as they arrive (rather than being buffered
+    until the end of a message), and the inflated output is returned as a single
+    bytes object once a message terminated by `ZLIB_SUFFIX` has been received.
+
+    The common case of a message fitting into a single frame involves no copies
+    beyond the decompression itself. Messages spanning multiple frames are joined
+    once, and the chunk buffer is cleared after every message so a large READY
+    payload is not kept alive for the lifetime of the connection.
+
+    Attributes
+    ----------
+    pending : int
+        The number of compressed bytes received for the current (incomplete)
+        message.
+    """
+    def __init__(self):
+        self._zlib = zlib.decompressobj()
+        self._chunks = []
+        self.pending = 0
+
+    def reset(self):
+        """
+        Resets the decompression context, this must be called whenever a new
+        websocket connection is opened.
+        """
+        self._zlib = zlib.decompressobj()
+        del self._chunks[:]
+        self.pending = 0
+
+    def feed(self, frame):
+        """
+        Feeds a single websocket frame into the inflator.
+
+        Returns
+        -------
+        Optional[bytes]
+            The inflated message if `frame` completed one, otherwise None.
+        """
+        chunk = self._zlib.decompress(frame)
+
+        if len(frame) < 4 or frame[-4:] != ZLIB_SUFFIX:
+            self.pending += len(frame)
+            if chunk:
+                self._chunks.append(chunk)
+            return None
+
+        self.pending = 0
+        if not self._chunks:
+            return chunk
+
+        self._chunks.append(chunk)
+        data = b''.join(self._chunks)
+        del self._chunks[:]
+        return data
@@ -0,0 +1,142 @@
+import gevent
+
+from collections import deque
+from gevent.lock import Semaphore
+from gevent.queue import Queue
+from holster.enum import Enum
+from holster.emitter import Priority
+
+from disco.util.logging import LoggingClass
+
+DispatchOverflow = Enum(
+    # Block the gateway reader until there is space in the queue
+    BLOCK='block',
+    # Drop low priority events (see `DispatchScheduler.low_priority_events`), and
+    #  block for everything else
+    DROP_LOW_PRIORITY='drop_low_priority',
+    # Drop any event which does not fit in the queue
+    SHED='shed',
+)
+
+
+class DispatchScheduler(LoggingClass):
+    """
+    Schedules the handlers for gateway events onto a bounded set of worker
+    greenlets, rather than spawning a new greenlet for every handler of every
+    event. Events are queued per guild, and the handlers of events for the same
+    guild are always started in the order the events were received. The next
+    event of a guild does not wait for the handlers of the previous one to
+    finish, so a slow handler (or one waiting for a later event, e.g. with
+    `Plugin.wait_for_event`) does not stall its guild.
+
+    `Priority.BEFORE` and `Priority.SEQUENTIAL` listeners (e.g. `State`) keep their
+    normal semantics and are called inline when the event is emitted, only the
+    default (`Priority.NONE`) listeners are scheduled.
+
+    Parameters
+    ----------
+    emitter : `holster.emitter.Emitter`
+        The emitter whose listeners will be scheduled.
+    workers : int
+        The maximum number of events being handled at once, each worker waits
+        for the handlers of the event it started.
+    max_queue_size : int
+        The maximum number of events waiting to be handled before the overflow
+        policy is applied.
+    overflow : `DispatchOverflow`
+        What to do with new events when the queue is full.
+    low_priority_events : list(str)
+        Event names which are dropped when the queue is full, when using the
+        `DispatchOverflow.DROP_LOW_PRIORITY` policy.
+
+    Attributes
+    ----------
+    dropped : int
+        The number of events which have been dropped due to the overflow policy.
+    """
+    def __init__(self, emitter, workers=64, max_queue_size=10000, overflow=DispatchOverflow.BLOCK,
+                 low_priority_events=None):
+        super(DispatchScheduler, self).__init__()
+        self.emitter = emitter
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.overflow = DispatchOverflow.get(overflow)
+        self.low_priority_events = set(low_priority_events or [])
+        self.dropped = 0
+
+        self._queues = {}
+        self._ready = Queue()
+        self._slots = Semaphore(max_queue_size)
+        self._workers = [gevent.spawn(self._worker) for _ in range(workers)]
+
+    @property
+    def depth(self):
+        """
+        The number of events currently waiting to be (or being) handled.
+        """
+        return self.max_queue_size - self._slots.counter
+
+    @staticmethod
+    def get_event_key(event):
+        """
+        Returns the ordering key for the event, which is its guild ID (or None for
+        events which do not belong to a guild).
+        """
+        try:
+            return getattr(event, 'guild_id', None) or None
+        except Exception:
+            return None
+
+    def emit(self, name, event):
+        for listener in self.emitter.event_handlers[Priority.BEFORE].get(name, []):
+            try:
+                listener(event)
+            except Exception:
+                self.log.exception('Error in BEFORE listener for %s: ', name)
+
+        for listener in self.emitter.event_handlers[Priority.SEQUENTIAL].get(name, []):
+            listener(event)
+
+        listeners = self.emitter.event_handlers[Priority.NONE].get(name)
+        if not listeners:
+            return
+
+        if not self._slots.acquire(blocking=False):
+            if self.overflow is DispatchOverflow.SHED or (
+                    self.overflow is DispatchOverflow.DROP_LOW_PRIORITY and name in self.low_priority_events):
+                self.dropped += 1
+                return
+
+            self._slots.acquire()
+
+        key = self.get_event_key(event)
+        item = (name, list(listeners), event)
+        if key in self._queues:
+            self._queues[key].append(item)
+        else:
+            self._queues[key] = deque([item])
+            self._ready.put(key)
+
+    def _worker(self):
+        while True:
+            key = self._ready.get()
+            queue = self._queues[key]
+            name, listeners, event = queue.popleft()
+            greenlets = [gevent.spawn(listener, event) for listener in listeners]
+
+            # The guild's next event may start as soon as this one has, requeued
+            #  behind any other ready guilds so a busy guild can not starve them.
+            if queue:
+                self._ready.put(key)
+            else:
+                del self._queues[key]
+
+            try:
+                gevent.joinall(greenlets)
+            except Exception:
+                self.log.exception('Error handling %s: ', name)
+            finally:
+                self._slots.release()
+
+    def stop(self):
+        gevent.killall(self._workers)
@@ -1,4 +1,4 @@
-from .json import JSONEncoder
+from .json import JSONEncoder, JSON_BACKENDS, get_json_backend
 
 ENCODERS = {
     'json': JSONEncoder,
@@ -9,3 +9,16 @@ try:
     ENCODERS['etf'] = ETFEncoder
 except ImportError:
     pass
+
+
+def get_encoder(name, json_backend=None):
+    """
+    Returns an encoder instance for the given encoding type, using `json_backend`
+    (see `JSON_BACKENDS`) for text based encoders.
+    """
+    if name == 'json':
+        return JSONEncoder(json_backend)
+    return ENCODERS[name]()
+
+
+__all__ = ['ENCODERS', 'JSON_BACKENDS', 'JSONEncoder', 'get_encoder', 'get_json_backend']
@@ -1,20 +1,118 @@
 from __future__ import absolute_import, print_function
 
-try:
-    import ujson as json
-except ImportError:
-    import json
+import six
+import sys
+
+from collections import namedtuple
 
 from disco.gateway.encoding.base import BaseEncoder
 
 
+class JSONBackend(namedtuple('JSONBackend', ['name', 'loads', 'dumps'])):
+    """
+    A JSON implementation which can be used for encoding/decoding gateway and
+    HTTP payloads.
+
+    Attributes
+    ----------
+    name : str
+        The name of this backend within `JSON_BACKENDS`.
+    loads : function
+        Decodes a str or bytes object, raising `ValueError` for invalid data.
+    dumps : function
+        Encodes an object, returning either str or bytes.
+    """
+
+
+def _load_json():
+    import json
+
+    # The standard library only learned to decode bytes in Python 3.6
+    if six.PY2 or sys.version_info >= (3, 6):
+        return json.loads, json.dumps
+
+    def loads(obj):
+        if isinstance(obj, six.binary_type):
+            obj = obj.decode('utf-8')
+        return json.loads(obj)
+
+    return loads, json.dumps
+
+
+def _load_ujson():
+    import ujson
+    return ujson.loads, ujson.dumps
+
+
+def _load_orjson():
+    import orjson
+    return orjson.loads, orjson.dumps
+
+
+def _load_msgspec():
+    import msgspec
+
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder()
+
+    def loads(obj):
+        try:
+            return decoder.decode(obj)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e))
+
+    return loads, encoder.encode
+
+
+# Mapping of backend names to functions which import and return (loads, dumps)
+JSON_BACKENDS = {
+    'json': _load_json,
+    'ujson': _load_ujson,
+    'orjson': _load_orjson,
+    'msgspec': _load_msgspec,
+}
+
+# Backends which are attempted (in order) when no backend is explicitly selected
+DEFAULT_JSON_BACKENDS = ('ujson', 'json')
+
+_backends = {}
+
+
+def get_json_backend(name=None):
+    """
+    Returns the `JSONBackend` for the given name, or the first importable backend
+    within `DEFAULT_JSON_BACKENDS` if no name is provided.
+
+    Raises
+    ------
+    ImportError
+        If the requested backend's library is not installed.
+    """
+    if name is None:
+        for default in DEFAULT_JSON_BACKENDS:
+            try:
+                return get_json_backend(default)
+            except ImportError:
+                continue
+
+    if name not in JSON_BACKENDS:
+        raise Exception('Unsupported JSON backend: {}'.format(name))
+
+    if name not in _backends:
+        loads, dumps = JSON_BACKENDS[name]()
+        _backends[name] = JSONBackend(name, loads, dumps)
+
+    return _backends[name]
+
+
 class JSONEncoder(BaseEncoder):
     TYPE = 'json'
 
-    @staticmethod
-    def encode(obj):
-        return json.dumps(obj)
+    def __init__(self, backend=None):
+        self.backend = get_json_backend(backend)
 
-    @staticmethod
-    def decode(obj):
-        return json.loads(obj)
+    def encode(self, obj):
+        return self.backend.dumps(obj)
+
+    def decode(self, obj):
+        return self.backend.loads(obj)
@@ -0,0 +1,534 @@
+"""
+A local stand-in for the Discord gateway, which can be used by tests and benchmarks
+to drive `GatewayClient` (and `AutoSharder`) instances without a real Discord
+connection. The server speaks enough of the gateway protocol to bootstrap a
+shard (HELLO, IDENTIFY/RESUME, READY, GUILD_CREATE and heartbeats) and can then
+generate synthetic DISPATCH traffic at a configurable rate.
+
+    server = FakeGatewayServer(FakeGatewayConfig({'dispatch_rate': 10000}))
+    server.start()
+    gevent.spawn(client.gw.connect_and_run, server.url)
+"""
+import six
+import time
+import zlib
+import base64
+import gevent
+import struct
+import hashlib
+
+from gevent.lock import RLock
+from gevent.server import StreamServer
+from six.moves.urllib.parse import urlparse, parse_qs
+
+from disco.gateway.packets import OPCode
+from disco.gateway.encoding import get_encoder, get_json_backend
+from disco.util.config import Config
+from disco.util.logging import LoggingClass
+from disco.util.snowflake import from_timestamp_ms
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+WS_OPCODE_CONTINUATION = 0x0
+WS_OPCODE_TEXT = 0x1
+WS_OPCODE_BINARY = 0x2
+WS_OPCODE_CLOSE = 0x8
+WS_OPCODE_PING = 0x9
+WS_OPCODE_PONG = 0xA
+
+
+class FakeGatewayConfig(Config):
+    """
+    Configuration for a `FakeGatewayServer`.
+
+    Attributes
+    ----------
+    heartbeat_interval : int
+        The heartbeat interval (in milliseconds) sent within HELLO.
+    ack_heartbeats : bool
+        Whether heartbeats are acknowledged, disabling this can be used to test
+        zombied connection detection.
+    guild_count : int
+        The number of guilds sent to each shard after READY.
+    channels_per_guild : int
+        The number of text channels within each guild.
+    members_per_guild : int
+        The number of members within each guild.
+    dispatch_rate : int
+        The number of synthetic MESSAGE_CREATE events sent (per connection) every
+        second once all guilds have been sent, or zero to disable.
+    dispatch_interval : float
+        The granularity (in seconds) at which synthetic events are batched.
+    """
+    heartbeat_interval = 41250
+    ack_heartbeats = True
+
+    guild_count = 1
+    channels_per_guild = 5
+    members_per_guild = 100
+
+    dispatch_rate = 0
+    dispatch_interval = 0.01
+
+
+def _unmask(mask, data):
+    data = bytearray(data)
+    for idx in range(len(data)):
+        data[idx] ^= mask[idx % 4]
+    return bytes(data)
+
+
+class FakeGatewayConnection(LoggingClass):
+    """
+    A single websocket connection to a `FakeGatewayServer`.
+
+    Attributes
+    ----------
+    shard : tuple(int, int)
+        The (shard_id, shard_count) sent by the client within IDENTIFY.
+    session_id : str
+        The ID of the session this connection has identified or resumed.
+    seq : int
+        The sequence number of the last dispatch sent.
+    dispatched : int
+        The number of dispatch events sent over this connection.
+    """
+    def __init__(self, server, sock):
+        super(FakeGatewayConnection, self).__init__()
+        self.server = server
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+
+        self.encoder = None
+        self.compressor = None
+        self.shard = (0, 1)
+        self.session_id = None
+        self.seq = 0
+        self.dispatched = 0
+        self.closed = False
+
+        self._lock = RLock()
+        self._dispatcher = None
+
+    def run(self):
+        try:
+            if not self.handshake():
+                return
+
+            self.send(OPCode.HELLO, {
+                'heartbeat_interval': self.server.config.heartbeat_interval,
+                '_trace': ['disco-fake-gateway'],
+            })
+
+            while not self.closed:
+                opcode, data = self.read_message()
+                if opcode is None or opcode == WS_OPCODE_CLOSE:
+                    break
+                elif opcode == WS_OPCODE_PING:
+                    self.write_frame(WS_OPCODE_PONG, data)
+                elif opcode in (WS_OPCODE_TEXT, WS_OPCODE_BINARY):
+                    self.handle(self.encoder.decode(data))
+        except Exception:
+            if not self.closed:
+                self.log.exception('Error in fake gateway connection: ')
+        finally:
+            self.close()
+
+    def handshake(self):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            line = self.rfile.readline()
+            if not line:
+                return False
+            request += line
+
+        lines = request.decode('utf-8').split('\r\n')
+        headers = dict(
+            (k.strip().lower(), v.strip()) for k, v in (line.split(':', 1) for line in lines[1:] if ':' in line)
+        )
+
+        query = parse_qs(urlparse(lines[0].split(' ')[1]).query)
+        self.encoder = get_encoder(query.get('encoding', ['json'])[0])
+        if query.get('compress', [None])[0] == 'zlib-stream':
+            self.compressor = zlib.compressobj()
+
+        accept = base64.b64encode(hashlib.sha1(headers['sec-websocket-key'].encode('utf-8') + WEBSOCKET_GUID).digest())
+        self.sock.sendall(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        return True
+
+    def read_frame(self):
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None, None, None
+
+        b1, b2 = struct.unpack('>BB', header)
+        length = b2 & 0x7F
+        if length == 126:
+            length, = struct.unpack('>H', self.rfile.read(2))
+        elif length == 127:
+            length, = struct.unpack('>Q', self.rfile.read(8))
+
+        mask = bytearray(self.rfile.read(4)) if b2 & 0x80 else None
+        data = self.rfile.read(length)
+        if mask:
+            data = _unmask(mask, data)
+
+        return bool(b1 & 0x80), b1 & 0x0F, data
+
+    def read_message(self):
+        fin, opcode, data = self.read_frame()
+        while fin is False:
+            fin, _, more = self.read_frame()
+            if fin is None:
+                return None, None
+            data += more
+        return opcode, data
+
+    def write_frame(self, opcode, data):
+        length = len(data)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < (1 << 16):
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+
+        self.sock.sendall(header + data)
+
+    def send_raw(self, data):
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+
+        with self._lock:
+            if self.closed:
+                return
+
+            if self.compressor:
+                data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+                self.write_frame(WS_OPCODE_BINARY, data)
+            else:
+                self.write_frame(WS_OPCODE_BINARY if self.encoder.TYPE == 'etf' else WS_OPCODE_TEXT, data)
+
+    def send(self, op, data=None, t=None):
+        with self._lock:
+            packet = {'op': op.value, 'd': data, 's': None, 't': t}
+
+            if op == OPCode.DISPATCH:
+                self.seq += 1
+                self.dispatched += 1
+                self.server.sessions[self.session_id] = self.seq
+                packet['s'] = self.seq
+
+            self.send_raw(self.encoder.encode(packet))
+
+    def dispatch(self, t, data):
+        self.send(OPCode.DISPATCH, data, t)
+
+    def dispatch_encoded(self, t, raw):
+        """
+        Dispatches an event whose data has already been JSON encoded, which avoids
+        re-encoding identical payloads when generating large amounts of traffic.
+        """
+        if self.encoder.TYPE != 'json':
+            return self.dispatch(t, self.encoder.decode(raw))
+
+        with self._lock:
+            self.seq += 1
+            self.dispatched += 1
+            self.server.sessions[self.session_id] = self.seq
+            self.send_raw('{{"op":0,"s":{},"t":"{}","d":{}}}'.format(self.seq, t, raw))
+
+    def close(self, code=1000, reason=''):
+        with self._lock:
+            if self.closed:
+                return
+
+            self.closed = True
+
+            try:
+                self.write_frame(WS_OPCODE_CLOSE, struct.pack('>H', code) + reason.encode('utf-8'))
+            except Exception:
+                pass
+
+        if self._dispatcher and self._dispatcher is not gevent.getcurrent():
+            self._dispatcher.kill(block=False)
+
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+        if self in self.server.connections:
+            self.server.connections.remove(self)
+
+    def handle(self, packet):
+        op = OPCode[packet['op']]
+
+        if op == OPCode.HEARTBEAT:
+            self.server.heartbeats += 1
+            if self.server.config.ack_heartbeats:
+                self.send(OPCode.HEARTBEAT_ACK)
+        elif op == OPCode.IDENTIFY:
+            self.server.identifies += 1
+            self.shard = tuple(packet['d'].get('shard') or (0, 1))
+            self.session_id = self.server.new_session_id()
+            self.server.sessions[self.session_id] = 0
+            self.on_identify()
+        elif op == OPCode.RESUME:
+            session_id = packet['d']['session_id']
+            if session_id not in self.server.sessions:
+                self.send(OPCode.INVALID_SESSION, False)
+                return
+
+            self.server.resumes += 1
+            self.session_id = session_id
+            self.seq = self.server.sessions[session_id]
+            self.dispatch('RESUMED', {'_trace': ['disco-fake-gateway']})
+            self.start_dispatcher()
+
+    def on_identify(self):
+        generator = self.server.generator
+        guild_ids = generator.guild_ids(*self.shard)
+
+        self.dispatch('READY', {
+            'v': 6,
+            'session_id': self.session_id,
+            'user': generator.bot_user,
+            'guilds': [{'id': str(gid), 'unavailable': True} for gid in guild_ids],
+            'private_channels': [],
+            '_trace': ['disco-fake-gateway'],
+        })
+
+        for gid in guild_ids:
+            self.dispatch('GUILD_CREATE', generator.guild(gid))
+
+        self.start_dispatcher()
+
+    def start_dispatcher(self):
+        if self.server.config.dispatch_rate and not self._dispatcher:
+            self._dispatcher = gevent.spawn(self.dispatch_loop)
+
+    def dispatch_loop(self):
+        rate = self.server.config.dispatch_rate
+        interval = self.server.config.dispatch_interval
+        messages = self.server.generator.encoded_messages(self.server.generator.guild_ids(*self.shard))
+
+        credit, last, idx = 0, time.time(), 0
+        try:
+            while not self.closed:
+                now = time.time()
+                credit += rate * (now - last)
+                last = now
+
+                while credit >= 1 and not self.closed:
+                    self.dispatch_encoded('MESSAGE_CREATE', messages[idx % len(messages)])
+                    idx += 1
+                    credit -= 1
+
+                gevent.sleep(max(interval - (time.time() - now), 0))
+        except Exception:
+            if not self.closed:
+                self.log.exception('Error in fake gateway dispatcher: ')
+                self.close(1011)
+
+
+class FakeGatewayGenerator(object):
+    """
+    Generates synthetic (but valid) gateway payloads for a `FakeGatewayServer`.
+    Guild IDs are generated such that every guild belongs to the shard it is
+    sent to.
+    """
+    EPOCH_MS = 1500000000000
+
+    def __init__(self, config):
+        self.config = config
+        self.bot_user = self.user(0, bot=True)
+
+    def snowflake(self, idx):
+        return from_timestamp_ms(self.EPOCH_MS + idx)
+
+    def guild_ids(self, shard_id, shard_count):
+        return [
+            self.snowflake((i * shard_count) + shard_id) for i in range(self.config.guild_count)
+        ]
+
+    def user(self, idx, bot=False):
+        return {
+            'id': str(self.snowflake(idx) + 1),
+            'username': 'fake-user-{}'.format(idx),
+            'discriminator': '{:04}'.format(idx % 10000),
+            'avatar': None,
+            'bot': bot,
+        }
+
+    def channel_ids(self, gid):
+        return [gid + 1000 + i for i in range(self.config.channels_per_guild)]
+
+    def guild(self, gid):
+        return {
+            'id': str(gid),
+            'name': 'Fake Guild {}'.format(gid),
+            'owner_id': self.bot_user['id'],
+            'region': 'us-east',
+            'unavailable': False,
+            'large': self.config.members_per_guild > 250,
+            'member_count': self.config.members_per_guild,
+            'features': [],
+            'emojis': [],
+            'roles': [{
+                'id': str(gid),
+                'name': '@everyone',
+                'color': 0,
+                'hoist': False,
+                'position': 0,
+                'permissions': 104324161,
+                'managed': False,
+                'mentionable': False,
+            }],
+            'channels': [{
+                'id': str(cid),
+                'guild_id': str(gid),
+                'name': 'channel-{}'.format(idx),
+                'type': 0,
+                'position': idx,
+                'topic': None,
+                'permission_overwrites': [],
+            } for idx, cid in enumerate(self.channel_ids(gid))],
+            'members': [{
+                'user': self.user(idx + 1),
+                'nick': None,
+                'roles': [],
+                'joined_at': '2017-07-14T02:40:00.000000+00:00',
+                'deaf': False,
+                'mute': False,
+            } for idx in range(self.config.members_per_guild)],
+            'presences': [],
+            'voice_states': [],
+        }
+
+    def message(self, gid, cid, idx):
+        return {
+            'id': str(cid + idx),
+            'guild_id': str(gid),
+            'channel_id': str(cid),
+            'author': self.user((idx % max(self.config.members_per_guild, 1)) + 1),
+            'content': 'fake message {}'.format(idx),
+            'timestamp': '2017-07-14T02:40:00.000000+00:00',
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': [],
+            'pinned': False,
+            'type': 0,
+        }
+
+    def encoded_messages(self, guild_ids):
+        dumps = get_json_backend().dumps
+        messages = []
+        for gid in guild_ids:
+            for idx, cid in enumerate(self.channel_ids(gid)):
+                raw = dumps(self.message(gid, cid, idx))
+                messages.append(raw.decode('utf-8') if isinstance(raw, bytes) else raw)
+        return messages
+
+
+class FakeGatewayServer(LoggingClass):
+    """
+    A local websocket server which emulates the Discord gateway.
+
+    Parameters
+    ----------
+    config : Optional[`FakeGatewayConfig`]
+        The configuration for this server.
+    host : str
+        The host to bind to.
+    port : int
+        The port to bind to, zero will bind to a random free port.
+
+    Attributes
+    ----------
+    connections : list(`FakeGatewayConnection`)
+        All currently open connections.
+    sessions : dict(str, int)
+        Mapping of all known session IDs to their last sequence number.
+    identifies : int
+        The number of IDENTIFY payloads received.
+    resumes : int
+        The number of successful RESUME payloads received.
+    heartbeats : int
+        The number of HEARTBEAT payloads received.
+    """
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        super(FakeGatewayServer, self).__init__()
+        self.config = config or FakeGatewayConfig()
+        self.generator = FakeGatewayGenerator(self.config)
+        self.server = StreamServer((host, port), self.handle)
+
+        self.connections = []
+        self.sessions = {}
+        self.identifies = 0
+        self.resumes = 0
+        self.heartbeats = 0
+        self._session_counter = 0
+
+    @property
+    def url(self):
+        return 'ws://{}:{}/'.format(*self.server.address[:2])
+
+    @property
+    def dispatched(self):
+        return sum(conn.dispatched for conn in self.connections)
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        for conn in list(self.connections):
+            conn.close(1001)
+        self.server.stop()
+
+    def new_session_id(self):
+        self._session_counter += 1
+        return 'fake-session-{}'.format(self._session_counter)
+
+    def handle(self, sock, address):
+        conn = FakeGatewayConnection(self, sock)
+        self.connections.append(conn)
+        conn.run()
+
+    def dispatch_all(self, t, data):
+        """
+        Dispatches an event to every identified connection.
+        """
+        for conn in list(self.connections):
+            if conn.session_id:
+                conn.dispatch(t, data)
+
+    def disconnect_all(self, code=1000, reason=''):
+        """
+        Closes every connection with the given close code. Codes between 4000 and
+        4010 will cause `GatewayClient` to drop its session rather than resuming.
+        """
+        for conn in list(self.connections):
+            conn.close(code, reason)
+
+    def reconnect_all(self):
+        """
+        Sends a RECONNECT request to every connection.
+        """
+        for conn in list(self.connections):
+            conn.send(OPCode.RECONNECT)
+
+    def invalidate_sessions(self):
+        """
+        Forgets all known sessions, causing any future RESUME attempts to fail.
+        """
+        self.sessions.clear()
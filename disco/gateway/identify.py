@@ -0,0 +1,100 @@
+import time
+import gevent
+
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+
+from disco.util.logging import LoggingClass
+
+# The minimum time between IDENTIFYs within a single rate limit bucket
+IDENTIFY_INTERVAL = 5.0
+
+
+class IdentifyScheduler(LoggingClass):
+    """
+    Coordinates when shards may IDENTIFY with the gateway. Shards are grouped
+    into `max_concurrency` buckets (by `shard_id % max_concurrency`), each bucket
+    may IDENTIFY once every `interval` seconds, and buckets proceed in parallel.
+    The daily `session_start_limit` is also respected, waiting for it to reset
+    once all remaining session starts have been used.
+
+    Shards which are resuming a session do not need to acquire from the scheduler.
+
+    Parameters
+    ----------
+    max_concurrency : int
+        The number of shards which may IDENTIFY at once, as given by the
+        `session_start_limit` of `APIClient.gateway_bot_get`.
+    interval : float
+        The minimum number of seconds between IDENTIFYs within a bucket.
+    session_start_limit : Optional[dict]
+        The `session_start_limit` returned by `APIClient.gateway_bot_get`.
+    """
+    def __init__(self, max_concurrency=1, interval=IDENTIFY_INTERVAL, session_start_limit=None):
+        super(IdentifyScheduler, self).__init__()
+        self.max_concurrency = max(int(max_concurrency or 1), 1)
+        self.interval = interval
+
+        self.total = None
+        self.remaining = None
+        self.reset_at = None
+        if session_start_limit:
+            self.total = session_start_limit.get('total')
+            self.remaining = session_start_limit.get('remaining')
+            self.reset_at = time.time() + (session_start_limit.get('reset_after', 0) / 1000.0)
+
+        self._buckets = {}
+
+    @classmethod
+    def from_gateway_bot(cls, data, interval=IDENTIFY_INTERVAL):
+        """
+        Creates a scheduler from the response of `APIClient.gateway_bot_get`.
+        """
+        limit = data.get('session_start_limit') or {}
+        return cls(limit.get('max_concurrency', 1), interval, limit)
+
+    def get_bucket(self, shard_id):
+        return int(shard_id) % self.max_concurrency
+
+    def _wait_for_session_start(self):
+        if self.remaining is None:
+            return
+
+        if self.remaining <= 0:
+            delay = self.reset_at - time.time()
+            if delay > 0:
+                self.log.warning('Session start limit exhausted, waiting %.0fs for it to reset', delay)
+                gevent.sleep(delay)
+            self.remaining = self.total
+            self.reset_at = time.time() + 86400
+
+        self.remaining -= 1
+
+    def acquire(self, shard_id):
+        """
+        Blocks until the given shard may IDENTIFY.
+        """
+        key = self.get_bucket(shard_id)
+        if key not in self._buckets:
+            self._buckets[key] = [Semaphore(), 0]
+
+        bucket = self._buckets[key]
+        with bucket[0]:
+            delay = bucket[1] + self.interval - time.time()
+            if delay > 0:
+                gevent.sleep(delay)
+
+            self._wait_for_session_start()
+            bucket[1] = time.time()
+
+        self.log.debug('Shard %s may IDENTIFY (bucket %s)', shard_id, key)
+
+    def acquire_async(self, shard_id):
+        """
+        Like `acquire`, but returns an AsyncResult which is set once the given
+        shard may IDENTIFY. Used when acquiring over IPC, so waiting shards do not
+        block the IPC read loop.
+        """
+        result = AsyncResult()
+        gevent.spawn(self.acquire, shard_id).link(lambda g: result.set(g.successful()))
+        return result
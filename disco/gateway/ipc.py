@@ -1,33 +1,215 @@
-import random
 import gevent
-import string
-import weakref
+import pickle
+import struct
+import marshal
+import itertools
 
+from gevent import Timeout
+from gevent.event import AsyncResult, Event
 from holster.enum import Enum
 
 from disco.util.logging import LoggingClass
 from disco.util.serializer import dump_function, load_function
 
-
-def get_random_str(size):
-    return ''.join([random.choice(string.printable) for _ in range(size)])
+try:
+    from gipc import GIPCClosed
+except ImportError:
+    class GIPCClosed(Exception):
+        pass
 
 
 IPCMessageType = Enum(
-    'CALL_FUNC',
-    'GET_ATTR',
-    'EXECUTE',
-    'RESPONSE',
+    CALL_FUNC=1,
+    GET_ATTR=2,
+    EXECUTE=3,
+    RESPONSE=4,
+    # A frame containing several other frames
+    BATCH=5,
 )
 
+# Header for each IPC frame, (codec, message type, nonce)
+FRAME_HEADER = struct.Struct('>BBI')
+
+# Length prefix for each frame within a BATCH frame
+BATCH_LENGTH = struct.Struct('>I')
+
+CODEC_MARSHAL = 1
+CODEC_PICKLE = 2
+CODEC_MSGPACK = 3
+CODEC_NONE = 4
+
+
+def _load_msgpack():
+    import msgpack
+    return (
+        # Maps with integer keys (e.g. of shard IDs) are sent too
+        lambda obj: msgpack.unpackb(obj, raw=False, use_list=False, strict_map_key=False),
+        lambda obj: msgpack.packb(obj, use_bin_type=True),
+    )
+
+
+class IPCCodec(object):
+    """
+    Encodes and decodes the frames sent between `GIPCProxy` instances. Each frame
+    carries its message type and nonce within a small fixed header, and only the
+    payload itself is serialized. Payloads are serialized with the preferred codec
+    (marshal or msgpack), falling back to marshal and then pickle for objects it
+    can not handle.
+
+    Parameters
+    ----------
+    codec : str
+        The preferred codec, either 'marshal' or 'msgpack' (which requires the
+        msgpack library).
+    """
+    def __init__(self, codec='marshal'):
+        self.codec = codec or 'marshal'
+
+        self._codecs = {
+            CODEC_MARSHAL: (marshal.loads, marshal.dumps),
+            CODEC_PICKLE: (pickle.loads, lambda obj: pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)),
+        }
+
+        if self.codec == 'msgpack':
+            self._codecs[CODEC_MSGPACK] = _load_msgpack()
+            self._preferred = CODEC_MSGPACK
+        elif self.codec == 'marshal':
+            self._preferred = CODEC_MARSHAL
+        else:
+            raise Exception('Unsupported IPC codec: {}'.format(self.codec))
+
+    def _dumps_payload(self, data):
+        if data is None:
+            return CODEC_NONE, b''
+
+        # Marshal is always attempted before pickle, as it can serialize the code
+        #  objects sent to execute functions remotely, which pickle can not.
+        for codec in (self._preferred, CODEC_MARSHAL):
+            try:
+                return codec, self._codecs[codec][1](data)
+            except (TypeError, ValueError):
+                continue
+
+        return CODEC_PICKLE, self._codecs[CODEC_PICKLE][1](data)
+
+    def dumps(self, message):
+        """
+        Encodes a (message type, nonce, data) tuple into a frame. The data of
+        `IPCMessageType.BATCH` messages is a list of messages.
+        """
+        mtype, nonce, data = message
+
+        if mtype == IPCMessageType.BATCH:
+            parts = []
+            for inner in data:
+                frame = self.dumps(inner)
+                parts.append(BATCH_LENGTH.pack(len(frame)))
+                parts.append(frame)
+            return FRAME_HEADER.pack(CODEC_NONE, mtype, 0) + b''.join(parts)
+
+        codec, payload = self._dumps_payload(data)
+        return FRAME_HEADER.pack(codec, mtype, nonce) + payload
+
+    def loads(self, frame):
+        """
+        Decodes a frame into a (message type, nonce, data) tuple.
+        """
+        codec, mtype, nonce = FRAME_HEADER.unpack_from(frame)
+
+        if mtype == IPCMessageType.BATCH.value:
+            messages = []
+            offset = FRAME_HEADER.size
+            while offset < len(frame):
+                size, = BATCH_LENGTH.unpack_from(frame, offset)
+                offset += BATCH_LENGTH.size
+                messages.append(self.loads(frame[offset:offset + size]))
+                offset += size
+            return mtype, 0, messages
+
+        if codec == CODEC_NONE:
+            return mtype, nonce, None
+
+        # The other end may prefer msgpack even if we do not
+        if codec == CODEC_MSGPACK and codec not in self._codecs:
+            self._codecs[CODEC_MSGPACK] = _load_msgpack()
+
+        return mtype, nonce, self._codecs[codec][0](frame[FRAME_HEADER.size:])
+
+
+class IPCError(Exception):
+    """
+    Set as the error of requests whose response can never arrive, e.g. because
+    the pipe was closed.
+    """
+
+
+class IPCResult(AsyncResult):
+    """
+    The result of a request sent by a `GIPCProxy`. If waiting for it times out
+    (or it is cancelled), the request is dropped by the proxy, and a response
+    arriving later is ignored.
+    """
+    def __init__(self, proxy, nonce):
+        super(IPCResult, self).__init__()
+        self.proxy = proxy
+        self.nonce = nonce
+
+    def get(self, block=True, timeout=None):
+        try:
+            return super(IPCResult, self).get(block, timeout)
+        except Timeout:
+            self.cancel()
+            raise
+
+    def wait(self, timeout=None):
+        value = super(IPCResult, self).wait(timeout)
+        if not self.ready():
+            self.cancel()
+        return value
+
+    def cancel(self):
+        """
+        Stops waiting for the response.
+        """
+        self.proxy.results.pop(self.nonce, None)
+
 
 class GIPCProxy(LoggingClass):
+    """
+    Proxies function calls, attribute lookups and function execution over a gipc
+    pipe, to another process's `GIPCProxy`. The pipe should be created with the
+    `dumps` and `loads` of an `IPCCodec` as its encoder and decoder.
+
+    Outgoing messages are buffered until the sending greenlet yields, and then
+    written together by a single writer greenlet as one `IPCMessageType.BATCH`
+    frame, so fanning out many requests at once only costs a single write.
+
+    Requests are held until they are responded to, they time out (see
+    `IPCResult`), or the pipe is closed (which fails them with an `IPCError`).
+    """
     def __init__(self, obj, pipe):
         super(GIPCProxy, self).__init__()
         self.obj = obj
         self.pipe = pipe
-        self.results = weakref.WeakValueDictionary()
-        gevent.spawn(self.read_loop)
+        # Requests are held until they are responded to, as callers may only
+        #  link to their results (rather than holding on to them).
+        self.results = {}
+        self.closed = False
+
+        self._nonces = itertools.count(1)
+        self._outgoing = []
+        self._has_outgoing = Event()
+        self._loops = [gevent.spawn(self.read_loop), gevent.spawn(self.write_loop)]
+
+    def close(self):
+        """
+        Stops reading from and writing to the pipe, failing every request still
+        waiting for a response. The pipe itself is left open.
+        """
+        self.closed = True
+        gevent.killall(self._loops)
+        self._outgoing = []
+        self.fail_pending(IPCError('Proxy closed'))
 
     def resolve(self, parts):
         base = self.obj
@@ -36,56 +218,111 @@ class GIPCProxy(LoggingClass):
 
         return base
 
-    def send(self, typ, data):
-        self.pipe.put((typ.value, data))
+    def send(self, typ, nonce, data):
+        self._outgoing.append((typ.value, nonce, data))
+        self._has_outgoing.set()
+
+    def flush(self):
+        """
+        Writes all buffered messages to the pipe.
+        """
+        outgoing, self._outgoing = self._outgoing, []
+        if not outgoing:
+            return
+
+        if len(outgoing) == 1:
+            self.pipe.put(outgoing[0])
+        else:
+            self.pipe.put((IPCMessageType.BATCH.value, 0, outgoing))
 
-    def handle(self, mtype, data):
-        if mtype == IPCMessageType.CALL_FUNC:
-            nonce, func, args, kwargs = data
+    def handle(self, mtype, nonce, data):
+        if mtype == IPCMessageType.BATCH:
+            for message in data:
+                try:
+                    self.handle(*message)
+                except Exception:
+                    self.log.exception('Error in GIPCProxy:')
+        elif mtype == IPCMessageType.CALL_FUNC:
+            func, args, kwargs = data
             res = self.resolve(func)(*args, **kwargs)
-            self.send(IPCMessageType.RESPONSE, (nonce, res))
+
+            # Functions may return an AsyncResult to respond once it is ready,
+            #  without blocking the read loop in the meantime.
+            if isinstance(res, AsyncResult):
+                res.rawlink(lambda r: self.send(IPCMessageType.RESPONSE, nonce, r.value))
+            else:
+                self.send(IPCMessageType.RESPONSE, nonce, res)
         elif mtype == IPCMessageType.GET_ATTR:
-            nonce, path = data
-            self.send(IPCMessageType.RESPONSE, (nonce, self.resolve(path)))
+            self.send(IPCMessageType.RESPONSE, nonce, self.resolve(data))
         elif mtype == IPCMessageType.EXECUTE:
-            nonce, raw = data
-            func = load_function(raw)
+            func = load_function(data)
             try:
                 result = func(self.obj)
             except Exception:
                 self.log.exception('Failed to EXECUTE: ')
                 result = None
 
-            self.send(IPCMessageType.RESPONSE, (nonce, result))
+            self.send(IPCMessageType.RESPONSE, nonce, result)
         elif mtype == IPCMessageType.RESPONSE:
-            nonce, res = data
-            if nonce in self.results:
-                self.results[nonce].set(res)
+            result = self.results.pop(nonce, None)
+            if result is not None:
+                result.set(data)
+
+    def write_loop(self):
+        # Writes happen within a greenlet (rather than an event loop callback) as
+        #  writing a frame larger than the pipe's buffer blocks.
+        while True:
+            self._has_outgoing.wait()
+            self._has_outgoing.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                self.log.exception('Error writing to GIPCProxy pipe:')
+
+    def fail_pending(self, error):
+        """
+        Fails every request still waiting for a response.
+        """
+        results, self.results = self.results, {}
+        for result in results.values():
+            result.set_exception(error)
 
     def read_loop(self):
         while True:
-            mtype, data = self.pipe.get()
+            try:
+                mtype, nonce, data = self.pipe.get()
+            except (EOFError, IOError, OSError, GIPCClosed) as e:
+                self.log.warning('GIPCProxy pipe closed: %r', e)
+                self.fail_pending(IPCError('Pipe closed: {!r}'.format(e)))
+                return
+            except Exception:
+                # The frame was read, but could not be decoded
+                self.log.exception('Failed to decode GIPCProxy message:')
+                continue
 
             try:
-                self.handle(mtype, data)
+                self.handle(mtype, nonce, data)
             except Exception:
                 self.log.exception('Error in GIPCProxy:')
 
-    def execute(self, func):
-        nonce = get_random_str(32)
-        raw = dump_function(func)
-        self.results[nonce] = result = gevent.event.AsyncResult()
-        self.pipe.put((IPCMessageType.EXECUTE.value, (nonce, raw)))
+    def _request(self, typ, data):
+        # Nonces only need to be unique among our in-flight requests
+        nonce = next(self._nonces) & 0xFFFFFFFF
+        result = IPCResult(self, nonce)
+        if self.closed:
+            result.set_exception(IPCError('Proxy closed'))
+            return result
+
+        self.results[nonce] = result
+        self.send(typ, nonce, data)
         return result
 
+    def execute(self, func):
+        return self._request(IPCMessageType.EXECUTE, dump_function(func))
+
     def get(self, path):
-        nonce = get_random_str(32)
-        self.results[nonce] = result = gevent.event.AsyncResult()
-        self.pipe.put((IPCMessageType.GET_ATTR.value, (nonce, path)))
-        return result
+        return self._request(IPCMessageType.GET_ATTR, path)
 
     def call(self, path, *args, **kwargs):
-        nonce = get_random_str(32)
-        self.results[nonce] = result = gevent.event.AsyncResult()
-        self.pipe.put((IPCMessageType.CALL_FUNC.value, (nonce, path, args, kwargs)))
-        return result
+        return self._request(IPCMessageType.CALL_FUNC, (path, args, kwargs))
@@ -0,0 +1,267 @@
+import six
+import gzip
+import json
+import time
+import gevent
+import struct
+
+from collections import defaultdict
+
+from holster.emitter import Priority
+
+from disco.gateway.packets import OPCode, RECV
+from disco.util.logging import LoggingClass
+
+RECORDING_MAGIC = b'DGWR'
+RECORDING_VERSION = 1
+
+# Header for each recorded frame, (timestamp, flags, length)
+FRAME_HEADER = struct.Struct('>dBI')
+
+FRAME_TEXT = 1 << 0
+FRAME_CONNECT = 1 << 1
+
+
+def _open(path, mode, compress):
+    if compress:
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class GatewayRecorder(LoggingClass):
+    """
+    Records the raw websocket messages received by a `GatewayClient` (before
+    inflation and decoding) to a file, so they can later be played back with a
+    `GatewayReplayer`.
+
+    Parameters
+    ----------
+    path : str
+        The path of the recording file.
+    compress : bool
+        Whether the recording file should be gzip compressed.
+
+    Attributes
+    ----------
+    frames : int
+        The number of frames recorded so far.
+    """
+    def __init__(self, path, compress=False):
+        super(GatewayRecorder, self).__init__()
+        self.path = path
+        self.compress = compress
+        self.frames = 0
+        self._file = None
+        self._gw = None
+
+    def attach(self, gw):
+        """
+        Starts recording all messages received by the given `GatewayClient`.
+        """
+        self._file = _open(self.path, 'wb', self.compress)
+
+        meta = json.dumps({
+            'version': RECORDING_VERSION,
+            'encoder': gw.encoder.TYPE,
+            'zlib_stream': gw.zlib_stream_enabled,
+            'shard': [gw.client.config.shard_id, gw.client.config.shard_count],
+        }).encode('utf-8')
+        self._file.write(RECORDING_MAGIC + struct.pack('>I', len(meta)) + meta)
+
+        self._gw = gw
+        gw.recorder = self
+        return self
+
+    def detach(self):
+        """
+        Stops recording and closes the recording file.
+        """
+        if self._gw:
+            self._gw.recorder = None
+            self._gw = None
+
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def record_connect(self):
+        """
+        Marks the start of a new websocket connection (and thus a new zlib stream).
+        """
+        self._write(FRAME_CONNECT, b'')
+
+    def record(self, msg):
+        if isinstance(msg, six.text_type):
+            self._write(FRAME_TEXT, msg.encode('utf-8'))
+        else:
+            self._write(0, msg)
+
+    def _write(self, flags, data):
+        if not self._file:
+            return
+
+        self._file.write(FRAME_HEADER.pack(time.time(), flags, len(data)))
+        self._file.write(data)
+        self.frames += 1
+
+
+class ReplayStats(object):
+    """
+    Throughput and latency statistics for a single replay.
+
+    Attributes
+    ----------
+    frames : int
+        The number of websocket frames replayed.
+    bytes : int
+        The number of (raw) bytes replayed.
+    events : int
+        The number of dispatch events replayed.
+    duration : float
+        The total time (in seconds) spent replaying.
+    latencies : dict(str, list(float))
+        Mapping of event names to the time (in seconds) each event took to be
+        inflated, decoded, dispatched and handled.
+    """
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.events = 0
+        self.duration = 0
+        self.latencies = defaultdict(list)
+
+    @property
+    def events_per_second(self):
+        if not self.duration:
+            return 0
+        return self.events / self.duration
+
+    def summary(self):
+        """
+        Returns a dictionary of the count, mean and max latency (in milliseconds)
+        for each replayed event type.
+        """
+        return {
+            name: {
+                'count': len(values),
+                'mean': (sum(values) / len(values)) * 1000,
+                'max': max(values) * 1000,
+            } for name, values in six.iteritems(self.latencies)
+        }
+
+
+class _NullWebsocket(object):
+    def send(self, *args, **kwargs):
+        pass
+
+    def close(self, *args, **kwargs):
+        pass
+
+
+class GatewayReplayer(LoggingClass):
+    """
+    Plays back a recording made by `GatewayRecorder` through a clients
+    `GatewayClient`, and thus its `State` and any attached `Bot`, without a
+    network connection. Anything the client attempts to send to the gateway is
+    discarded.
+
+    Parameters
+    ----------
+    path : str
+        The path of the recording file.
+    compress : bool
+        Whether the recording file is gzip compressed.
+    """
+    def __init__(self, path, compress=False):
+        super(GatewayReplayer, self).__init__()
+        self.path = path
+        self.compress = compress
+        self.meta = None
+
+    def frames(self):
+        """
+        Generator of (timestamp, flags, data) for every frame within the recording.
+        """
+        with _open(self.path, 'rb', self.compress) as f:
+            if f.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+                raise Exception('{} is not a gateway recording'.format(self.path))
+
+            size, = struct.unpack('>I', f.read(4))
+            self.meta = json.loads(f.read(size).decode('utf-8'))
+
+            while True:
+                header = f.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    return
+
+                ts, flags, size = FRAME_HEADER.unpack(header)
+                yield ts, flags, f.read(size)
+
+    def replay(self, client, realtime=False):
+        """
+        Replays the recording through the given client.
+
+        Parameters
+        ----------
+        client : `disco.client.Client`
+            The client to replay into. Its gateway must be configured with the same
+            encoder and zlib-stream setting the recording was made with.
+        realtime : bool
+            If true, frames are replayed at the pace they were recorded at, otherwise
+            they are replayed as fast as possible.
+
+        Returns
+        -------
+        `ReplayStats`
+            Statistics for the replay.
+        """
+        gw = client.gw
+        gw.ws = _NullWebsocket()
+
+        stats = ReplayStats()
+        dispatched = []
+
+        listener = gw.packets.on(
+            (RECV, OPCode.DISPATCH),
+            lambda packet: dispatched.append(packet['t']),
+            priority=Priority.BEFORE)
+
+        first_ts, start = None, time.time()
+
+        try:
+            for ts, flags, data in self.frames():
+                if flags & FRAME_CONNECT:
+                    if gw.zlib_stream_enabled:
+                        gw._inflator.reset()
+                    continue
+
+                if realtime:
+                    if first_ts is None:
+                        first_ts = ts
+                    gevent.sleep(max((ts - first_ts) - (time.time() - start), 0))
+
+                if flags & FRAME_TEXT:
+                    data = data.decode('utf-8')
+
+                frame_start = time.time()
+                gw.on_message(data)
+
+                # Allow the spawned dispatch and handler greenlets to complete
+                gevent.idle()
+
+                stats.frames += 1
+                stats.bytes += len(data)
+
+                if dispatched:
+                    elapsed = time.time() - frame_start
+                    for name in dispatched:
+                        stats.latencies[name].append(elapsed)
+                    stats.events += len(dispatched)
+                    del dispatched[:]
+        finally:
+            listener.remove()
+            stats.duration = time.time() - start
+
+        self.log.info('Replayed %s events in %.2fs (%.2f events/sec)',
+                      stats.events, stats.duration, stats.events_per_second)
+        return stats
@@ -0,0 +1,209 @@
+import six
+import time
+
+from datetime import datetime
+from collections import OrderedDict
+
+import gevent
+
+from gevent.event import AsyncResult
+from holster.enum import EnumAttr
+
+from disco.types.base import Model, AutoDictField, UNSET
+from disco.types.guild import Guild, GuildMember
+from disco.types.channel import Channel
+from disco.types.permissions import PermissionValue
+from disco.util.logging import LoggingClass
+from disco.util.snowflake import calculate_shard
+
+
+def _dump_value(value, field=None):
+    if isinstance(value, Model):
+        return dump_model(value)
+    elif isinstance(value, EnumAttr):
+        return value.value
+    elif isinstance(value, PermissionValue):
+        return value.value
+    elif isinstance(value, datetime):
+        return value.isoformat()
+    elif isinstance(value, dict):
+        if isinstance(field, AutoDictField):
+            return [_dump_value(v) for v in six.itervalues(value)]
+        return {k: _dump_value(v) for k, v in six.iteritems(value)}
+    elif isinstance(value, (list, tuple)):
+        return [_dump_value(v) for v in value]
+    return value
+
+
+def dump_model(model, ignore=None):
+    """
+    Serializes a model into plain data (in the same shape as the Discord API
+    returns it), which can be loaded again with `Model.create`. Unlike
+    `Model.to_dict`, the result only contains builtin types.
+    """
+    obj = {}
+    for name, field in six.iteritems(model.__class__._fields):
+        if ignore and name in ignore:
+            continue
+
+        value = getattr(model, name)
+        if value is UNSET or value is None:
+            continue
+
+        obj[field.src_name] = _dump_value(value, field)
+    return obj
+
+
+# Lookups supported by the proxy, mapped to (model, fields left out of the dump)
+REMOTE_LOOKUPS = {
+    'guild': (Guild, ('members', 'voice_states')),
+    'channel': (Channel, ()),
+    'member': (GuildMember, ()),
+}
+
+
+def lookup_state(state, kind, key):
+    """
+    Looks up an object within a local `State`, returning None if it is unknown.
+    """
+    if kind == 'guild':
+        return state.guilds.get(key)
+
+    guild_id, obj_id = key
+    guild = state.guilds.get(guild_id)
+    if not guild:
+        return None
+
+    if kind == 'channel':
+        return guild.channels.get(obj_id)
+    elif kind == 'member':
+        return guild.members.get(obj_id)
+
+    raise Exception('Unsupported remote lookup: {}'.format(kind))
+
+
+def dump_state_lookups(state, lookups):
+    """
+    Looks up a list of (kind, key) pairs within a local `State`, returning the
+    dumped object (or None) for each.
+    """
+    results = []
+    for kind, key in lookups:
+        obj = lookup_state(state, kind, key)
+        results.append(dump_model(obj, REMOTE_LOOKUPS[kind][1]) if obj else None)
+    return results
+
+
+class ShardStateProxy(LoggingClass):
+    """
+    Looks up guilds, channels and members within the `State` of whichever shard
+    they belong to. Objects on a local shard are returned directly from its state,
+    while objects on remote shards are fetched over IPC as compact copies (guilds
+    are fetched without their members or voice states). Copies are cached for
+    `ttl` seconds, and concurrent lookups for the same shard are sent together
+    as a single request.
+
+    Parameters
+    ----------
+    shards : `disco.gateway.sharder.ShardHelper`
+        The shard helper used to route lookups.
+    ttl : float
+        How long (in seconds) remote objects are cached for.
+    timeout : float
+        How long to wait for a remote shard to respond.
+    """
+    def __init__(self, shards, ttl=5, timeout=10):
+        super(ShardStateProxy, self).__init__()
+        self.shards = shards
+        self.ttl = ttl
+        self.timeout = timeout
+
+        self._cache = {}
+        self._pending = {}
+
+    def guild(self, guild_id):
+        """
+        Returns the `Guild` with the given ID, or None if no shard knows of it.
+        """
+        return self._lookup(guild_id, 'guild', guild_id)
+
+    def channel(self, guild_id, channel_id):
+        """
+        Returns the `Channel` with the given ID within the given guild.
+        """
+        return self._lookup(guild_id, 'channel', (guild_id, channel_id))
+
+    def member(self, guild_id, user_id):
+        """
+        Returns the `GuildMember` for the given user within the given guild.
+        """
+        return self._lookup(guild_id, 'member', (guild_id, user_id))
+
+    def invalidate(self):
+        """
+        Clears all cached remote objects.
+        """
+        self._cache.clear()
+
+    def _lookup(self, guild_id, kind, key):
+        sid = calculate_shard(self.shards.count, guild_id)
+        if self.shards.is_local(sid):
+            return lookup_state(self.shards.get_bot(sid).client.state, kind, key)
+
+        cached = self._cache.get((kind, key))
+        if cached and cached[0] > time.time():
+            return cached[1]
+
+        if sid not in self._pending:
+            self._pending[sid] = OrderedDict()
+
+            # Flush from a new greenlet once this one yields, so lookups from
+            #  other greenlets for the same shard are sent along with this one.
+            #  (Sending may block, so this can not be an event loop callback.)
+            gevent.spawn(self._flush, sid)
+
+        pending = self._pending[sid]
+        if (kind, key) not in pending:
+            pending[(kind, key)] = AsyncResult()
+
+        return pending[(kind, key)].get(timeout=self.timeout)
+
+    def _flush(self, sid):
+        pending = self._pending.pop(sid, None)
+        if not pending:
+            return
+
+        lookups = list(pending.keys())
+        try:
+            response = self.shards.call_on(sid, ('shards', 'state_lookup'), sid, lookups)
+        except Exception as e:
+            self.log.exception('Failed to request state lookups from shard %s: ', sid)
+            for waiter in six.itervalues(pending):
+                waiter.set_exception(e)
+            return
+
+        response.rawlink(lambda result: self._resolve(lookups, pending, result))
+
+    def _resolve(self, lookups, pending, result):
+        if not result.successful():
+            for waiter in six.itervalues(pending):
+                waiter.set_exception(result.exception)
+            return
+
+        client = self.shards.bot.client
+        expires_at = time.time() + self.ttl
+        for (kind, key), data in zip(lookups, result.value or [None] * len(lookups)):
+            obj = None
+            if data is not None:
+                try:
+                    obj = REMOTE_LOOKUPS[kind][0].create(client, data)
+                except Exception:
+                    self.log.exception('Failed to load remote %s %s: ', kind, key)
+
+            self._cache[(kind, key)] = (expires_at, obj)
+            pending[(kind, key)].set(obj)
+
+        # Drop anything which has expired
+        now = time.time()
+        for cache_key in [k for k, v in six.iteritems(self._cache) if v[0] <= now]:
+            del self._cache[cache_key]
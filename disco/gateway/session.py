@@ -0,0 +1,97 @@
+import os
+import json
+import time
+
+from disco.util.logging import LoggingClass
+
+try:
+    _replace = os.replace
+except AttributeError:
+    def _replace(src, dst):
+        # Python 2 has no os.replace, and renaming over an existing file fails
+        #  on Windows (but is atomic elsewhere).
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class SessionStore(LoggingClass):
+    """
+    Base class for storing gateway sessions (the session ID and last sequence
+    number) outside of the process, so a restarted client can RESUME its previous
+    session instead of sending a fresh IDENTIFY.
+
+    Sessions are keyed by the shard they belong to, and are represented as a
+    dictionary containing `session_id`, `seq` and `saved_at` (a unix timestamp).
+    """
+    def load(self, shard_id, shard_count):
+        """
+        Returns the stored session for the given shard, or None.
+        """
+        raise NotImplementedError
+
+    def save(self, shard_id, shard_count, session_id, seq):
+        """
+        Stores the session for the given shard, replacing any previous one.
+        """
+        raise NotImplementedError
+
+    def clear(self, shard_id, shard_count):
+        """
+        Removes any stored session for the given shard.
+        """
+        raise NotImplementedError
+
+
+class FileSessionStore(SessionStore):
+    """
+    A `SessionStore` which keeps a small JSON file per shard within a directory.
+    Files are written to a temporary file and then renamed over the original, so
+    a crash mid-write never leaves a corrupt session behind.
+
+    Parameters
+    ----------
+    path : str
+        The directory sessions are stored in, which is created if required.
+    """
+    def __init__(self, path):
+        super(FileSessionStore, self).__init__()
+        self.path = path
+
+    def get_path(self, shard_id, shard_count):
+        return os.path.join(self.path, 'session-{}-{}.json'.format(shard_id, shard_count))
+
+    def load(self, shard_id, shard_count):
+        path = self.get_path(shard_id, shard_count)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.log.warning('Ignoring unreadable gateway session file %s', path)
+            return None
+
+        if not isinstance(data, dict) or not data.get('session_id'):
+            return None
+        return data
+
+    def save(self, shard_id, shard_count, session_id, seq):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        path = self.get_path(shard_id, shard_count)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'session_id': session_id,
+                'seq': seq,
+                'saved_at': time.time(),
+            }, f)
+        _replace(tmp_path, path)
+
+    def clear(self, shard_id, shard_count):
+        path = self.get_path(shard_id, shard_count)
+        if os.path.exists(path):
+            os.remove(path)
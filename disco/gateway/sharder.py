@@ -1,111 +1,643 @@
 from __future__ import absolute_import
 
+import os
 import gipc
+import math
+import time
 import gevent
-import pickle
 import logging
-import marshal
+import resource
 
-from six import integer_types, string_types
+from collections import namedtuple
+from gevent.event import AsyncResult
+from gevent.queue import Queue, Empty
+from six import integer_types
 from six.moves import range
 
-from disco.client import Client
 from disco.bot import Bot, BotConfig
 from disco.api.client import APIClient
-from disco.gateway.ipc import GIPCProxy
-from disco.util.logging import setup_logging
+from disco.api.ratelimit import GlobalBudget
+from disco.gateway.ipc import GIPCProxy, IPCCodec
+from disco.gateway.cluster import ShardCluster
+from disco.gateway.identify import IdentifyScheduler
+from disco.gateway.remote import ShardStateProxy, dump_state_lookups
+from disco.util.logging import LoggingClass, setup_logging
 from disco.util.snowflake import calculate_shard
 from disco.util.serializer import dump_function, load_function
 
 
-def run_shard(config, shard_id, pipe):
+def get_memory_usage():
+    """
+    Returns the resident memory usage (in bytes) of the current process.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, ValueError, IndexError):
+        # Peak usage, in kilobytes on Linux (but bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_shard(config, shard_ids, pipe):
+    if isinstance(shard_ids, integer_types):
+        shard_ids = [shard_ids]
+
+    name = shard_ids[0] if len(shard_ids) == 1 else '{}-{}'.format(shard_ids[0], shard_ids[-1])
     setup_logging(
         level=logging.INFO,
-        format='{} [%(levelname)s] %(asctime)s - %(name)s:%(lineno)d - %(message)s'.format(shard_id),
+        format='{} [%(levelname)s] %(asctime)s - %(name)s:%(lineno)d - %(message)s'.format(name),
     )
 
-    config.shard_id = shard_id
-    client = Client(config)
-    bot = Bot(client, BotConfig(config.bot))
+    # All shards within this process share a single bot (and its plugins)
+    cluster = ShardCluster(config, shard_ids)
+    bot = Bot(cluster.client, BotConfig(config.bot))
     bot.sharder = GIPCProxy(bot, pipe)
-    bot.shards = ShardHelper(config.shard_count, bot)
-    bot.run_forever()
+    bot.shards = ShardHelper(config.shard_count, bot, cluster)
+
+    identify_scheduler = IdentifySchedulerProxy(bot.sharder)
+    for client in cluster.clients.values():
+        client.gw.identify_scheduler = identify_scheduler
+
+    # The clients of the cluster share one HTTPClient, whose requests are counted
+    #  against the global budget of the parent process (or, if it is unreachable,
+    #  this process's share of it).
+    if config.http_global_budget:
+        cluster.client.api.http.budget = GlobalBudgetProxy(
+            bot.sharder,
+            config.http_global_budget,
+            max(config.http_global_budget * len(shard_ids) // config.shard_count, 1),
+        )
+
+    cluster.run_forever()
+
+
+class IdentifySchedulerProxy(object):
+    """
+    Acquires from the `IdentifyScheduler` of the parent `AutoSharder` over IPC.
+    """
+    def __init__(self, sharder):
+        self.sharder = sharder
+
+    def acquire(self, shard_id):
+        self.sharder.call(('identify', 'acquire_async'), shard_id).wait()
+
+
+class GlobalBudgetProxy(LoggingClass):
+    """
+    Acquires from the `GlobalBudget` of the parent `AutoSharder` over IPC, so the
+    requests of every shard process are counted against one budget. If the parent
+    does not respond in time (e.g. because it or the pipe died), requests are
+    instead counted against a local fallback budget, so they are not blocked.
+
+    Parameters
+    ----------
+    sharder : `GIPCProxy`
+        The proxy of the parent `AutoSharder`.
+    rate : int
+        The number of requests per second of the shared budget.
+    fallback_rate : Optional[int]
+        The number of requests per second of the local fallback budget, which
+        should be this process's share of the shared budget. Defaults to `rate`.
+    timeout : float
+        How long (in seconds) to wait for the parent before using the fallback.
+
+    Attributes
+    ----------
+    remaining : int
+        The remaining budget, as of the last request.
+    """
+    def __init__(self, sharder, rate=50, fallback_rate=None, timeout=5):
+        super(GlobalBudgetProxy, self).__init__()
+        self.sharder = sharder
+        self.timeout = timeout
+        self.remaining = rate
+        self.fallback = GlobalBudget(fallback_rate or rate)
+
+    def acquire(self, count=1):
+        try:
+            delay, self.remaining = self.sharder.call(('budget', 'reserve'), count).get(timeout=self.timeout)
+        except (gevent.Timeout, Exception) as e:
+            self.log.warning('Failed to reserve from the shared global budget (%s), using the local budget', e)
+            delay = self.fallback.acquire(count)
+            self.remaining = self.fallback.remaining
+            return delay
+
+        if delay > 0:
+            gevent.sleep(delay)
+        return delay
+
+
+class ShardError(Exception):
+    """
+    Raised for (or reported as the error of) a function which failed on a shard.
+    """
+
+
+class ShardTimeout(ShardError):
+    """
+    Reported as the error of a shard which did not respond in time.
+    """
+
+
+class ShardCall(AsyncResult):
+    """
+    The result of `ShardHelper.on`, which can be cancelled to stop waiting for a
+    shard which has not responded.
+    """
+    request = None
+
+    def cancel(self):
+        if self.request is not None and hasattr(self.request, 'cancel'):
+            self.request.cancel()
 
 
-class ShardHelper(object):
-    def __init__(self, count, bot):
+class ShardResult(namedtuple('ShardResult', ['shard_id', 'value', 'latency', 'error'])):
+    """
+    The result of running a function on a single shard.
+
+    Attributes
+    ----------
+    shard_id : int
+        The shard the function was run on.
+    value : object
+        The value returned by the function, or None if it failed.
+    latency : Optional[float]
+        The time (in seconds) between the request and the response, or None if
+        the shard did not respond in time.
+    error : Optional[Exception]
+        Why the function failed, a `ShardTimeout` if the shard did not respond.
+    """
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class ShardView(object):
+    """
+    A view of a `Bot` shared by a `ShardCluster`, whose `client` and `state` are
+    those of a single shard. Functions run on a shard are passed one of these.
+    """
+    def __init__(self, bot, client):
+        self._bot = bot
+        self.client = client
+        self.state = client.state
+
+    def __getattr__(self, name):
+        return getattr(self._bot, name)
+
+
+class ShardHelper(LoggingClass):
+    """
+    Runs functions and looks up state on other shards.
+
+    Attributes
+    ----------
+    state : `disco.gateway.remote.ShardStateProxy`
+        Looks up guilds, channels and members on whichever shard they belong to.
+    """
+    def __init__(self, count, bot, cluster=None):
         self.count = count
         self.bot = bot
+        self.cluster = cluster
+        self.state = ShardStateProxy(self)
 
     def keys(self):
         for sid in range(self.count):
             yield sid
 
-    def on(self, sid, func):
-        if sid == self.bot.client.config.shard_id:
-            result = gevent.event.AsyncResult()
-            result.set(func(self.bot))
+    def is_local(self, sid):
+        if self.cluster:
+            return sid in self.cluster.clients
+        return sid == self.bot.client.config.shard_id
+
+    def get_bot(self, sid):
+        if self.cluster and len(self.cluster.clients) > 1:
+            return ShardView(self.bot, self.cluster.clients[sid])
+        return self.bot
+
+    def run_local(self, sid, raw, reducer=None, initial=None):
+        """
+        Runs a dumped function on a local shard, returning a tuple of whether it
+        succeeded and either its result or the error message. If a dumped reducer
+        is given, the result is `reducer(initial, result)` instead.
+        """
+        func = load_function(raw)
+        try:
+            value = func(self.get_bot(sid))
+            if reducer:
+                value = load_function(reducer)(initial, value)
+            return True, value
+        except Exception as e:
+            self.log.exception('Failed to run function on shard %s: ', sid)
+            return False, '{}: {}'.format(e.__class__.__name__, e)
+
+    def get_clients(self):
+        if self.cluster:
+            return self.cluster.clients
+        return {self.bot.client.config.shard_id: self.bot.client}
+
+    def health(self):
+        """
+        Returns health information for this process and its shards, used by the
+        `ShardSupervisor`.
+        """
+        now = time.time()
+        return {
+            'pid': os.getpid(),
+            'memory': get_memory_usage(),
+            'shards': {
+                sid: {
+                    'latency': client.gw.latency,
+                    'idle': (now - client.gw.last_message_at) if client.gw.last_message_at else None,
+                    'seq': client.gw.seq,
+                    'session_id': client.gw.session_id,
+                } for sid, client in self.get_clients().items()
+            },
+        }
+
+    def save_sessions(self):
+        """
+        Persists the gateway sessions of all local shards (if they have a session
+        store), so they can be resumed after a restart.
+        """
+        for client in self.get_clients().values():
+            client.gw.save_session()
+        return True
+
+    def state_lookup(self, sid, lookups):
+        """
+        Returns the dumped objects for (kind, key) lookups within a local shard's
+        state, see `ShardStateProxy`.
+        """
+        return dump_state_lookups(self.get_bot(sid).client.state, lookups)
+
+    def call_on(self, sid, path, *args):
+        """
+        Calls the function at the given attribute path (relative to the bot) on
+        a remote shard, returning an AsyncResult for its return value.
+        """
+        return self.bot.sharder.call(('call_on', ), sid, path, args)
+
+    def on(self, sid, func, reducer=None, initial=None):
+        """
+        Runs the function on the given shard, returning a `ShardCall` for its
+        return value (or a `ShardError` if it failed). If a reducer is given, it
+        is also run on the shard, and the result is `reducer(initial, value)`.
+        """
+        result = ShardCall()
+
+        if self.is_local(sid):
+            try:
+                value = func(self.get_bot(sid))
+                result.set(reducer(initial, value) if reducer else value)
+            except Exception as e:
+                result.set_exception(ShardError('{}: {}'.format(e.__class__.__name__, e)))
             return result
 
-        return self.bot.sharder.call(('run_on', ), sid, dump_function(func))
+        def unwrap(response):
+            if not response.successful():
+                result.set_exception(ShardError('{}: {}'.format(
+                    response.exception.__class__.__name__, response.exception)))
+                return
+
+            success, value = response.value or (False, 'No response from shard')
+            if success:
+                result.set(value)
+            else:
+                result.set_exception(ShardError(value))
+
+        result.request = self.bot.sharder.call(
+            ('run_on', ), sid, dump_function(func), dump_function(reducer) if reducer else None, initial,
+        )
+        result.request.rawlink(unwrap)
+        return result
+
+    def stream(self, func, timeout=None, shards=None, reducer=None, initial=None):
+        """
+        Runs the function on all (or the given) shards at once, yielding a
+        `ShardResult` for each shard as soon as it responds. Once the timeout
+        expires, a result with a `ShardTimeout` error is yielded for every shard
+        which has not yet responded. The reducer (if given) is run on each shard,
+        as with `on`.
+
+        The function runs on each shard, so returning a small aggregate (e.g.
+        `len(bot.client.state.guilds)`) rather than whole objects keeps the
+        responses small.
+        """
+        shards = list(self.keys()) if shards is None else list(shards)
+        responses = Queue()
+        start = time.time()
+
+        # Send every request before waiting on any, so they are batched together
+        calls = {}
+        for sid in shards:
+            calls[sid] = self.on(sid, func, reducer, initial)
+            calls[sid].rawlink(lambda result, sid=sid: responses.put((sid, result, time.time())))
+
+        pending = set(shards)
+        deadline = start + timeout if timeout is not None else None
+        while pending:
+            try:
+                sid, result, finished = responses.get(
+                    timeout=max(deadline - time.time(), 0) if deadline is not None else None)
+            except Empty:
+                break
+
+            pending.discard(sid)
+            if result.successful():
+                yield ShardResult(sid, result.value, finished - start, None)
+            else:
+                yield ShardResult(sid, None, finished - start, result.exception)
+
+        for sid in sorted(pending):
+            # Don't keep waiting for (and holding on to) responses which will be ignored
+            calls[sid].cancel()
+            yield ShardResult(sid, None, None, ShardTimeout('Shard {} did not respond in time'.format(sid)))
+
+    def reduce(self, func, reducer, initial=None, timeout=None, combiner=None):
+        """
+        Runs the function on all shards, reducing its result on each shard (as
+        `reducer(initial, result)`) so only the partial results are sent back.
+        The partial results are then combined on the caller, starting from
+        `initial`, as they arrive. As it is used on every shard as well as on
+        the caller, `initial` should not change the result (e.g. 0 for sums).
+
+        For example, `reduce(lambda bot: bot.client.state.guilds, lambda n, guilds:
+        n + len(guilds), 0, combiner=operator.add)` counts the guilds of every
+        shard without sending any of them.
+
+        Parameters
+        ----------
+        combiner : Optional[callable]
+            Combines the value so far with a shard's partial result, defaults to
+            the reducer (for reducers whose result and input are alike, e.g. sums).
+
+        Returns
+        -------
+        tuple(object, list(`ShardResult`))
+            The combined value of all successful results, and the results of the
+            shards which failed or timed out.
+        """
+        combiner = combiner or reducer
+
+        value, failed = initial, []
+        for result in self.stream(func, timeout=timeout, reducer=reducer, initial=initial):
+            if result.ok:
+                value = combiner(value, result.value)
+            else:
+                failed.append(result)
+        return value, failed
 
     def all(self, func, timeout=None):
-        pool = gevent.pool.Pool(self.count)
-        return dict(zip(
-            range(self.count),
-            pool.imap(
-                lambda i: self.on(i, func).wait(timeout=timeout),
-                range(self.count),
-            ),
-        ))
+        """
+        Runs the function on all shards, returning a dictionary of shard IDs to
+        results. Shards which failed or did not respond within the timeout (which
+        applies to the whole call) have a result of None, use `stream` to tell
+        those apart.
+        """
+        return {result.shard_id: result.value for result in self.stream(func, timeout=timeout)}
 
     def for_id(self, sid, func):
         shard = calculate_shard(self.count, sid)
         return self.on(shard, func)
 
 
+class ShardSupervisor(LoggingClass):
+    """
+    Monitors the shard processes of an `AutoSharder`, and restarts any which are
+    unhealthy. A process is unhealthy when it has exited, does not respond to a
+    health check (e.g. its hub is stuck), uses too much memory, or one of its
+    shards has a heartbeat latency which is too high or has not received anything
+    from the gateway for too long. Processes which fail several checks in a row
+    are restarted, waiting longer between each consecutive restart.
+
+    Restarted shards still wait on the `IdentifyScheduler` before they IDENTIFY.
+    Sessions are saved before an unhealthy (but responsive) process is stopped,
+    so with a `session_store_path` configured the restarted shards will RESUME.
+
+    Parameters
+    ----------
+    sharder : `AutoSharder`
+        The sharder whose processes are supervised.
+    interval : float
+        How often (in seconds) health checks are run.
+    timeout : float
+        How long (in seconds) to wait for a process to respond to a health check.
+    max_latency : Optional[float]
+        The maximum heartbeat latency (in seconds) of a healthy shard.
+    max_idle : Optional[float]
+        The maximum time (in seconds) without any message from the gateway for a
+        healthy shard. Heartbeat ACKs count, so this should be well above the
+        gateway's heartbeat interval.
+    max_memory : Optional[int]
+        The maximum memory usage (in megabytes) of a healthy process.
+    failures : int
+        The number of consecutive failed checks before a process is restarted.
+    backoff : float
+        The delay before the first restart of a process, doubling for every
+        consecutive restart (up to `max_backoff`).
+    max_backoff : float
+        The maximum delay before restarting a process.
+    """
+    def __init__(self, sharder, interval=30, timeout=10, max_latency=15, max_idle=180, max_memory=None,
+                 failures=3, backoff=5, max_backoff=300):
+        super(ShardSupervisor, self).__init__()
+        self.sharder = sharder
+        self.interval = interval
+        self.timeout = timeout
+        self.max_latency = max_latency
+        self.max_idle = max_idle
+        self.max_memory = max_memory
+        self.failures = failures
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        # Mapping of process keys to consecutive failures/restarts
+        self._failures = {}
+        self._restarts = {}
+        self._restarted_at = {}
+        self._restarting = set()
+
+        # The most recent health of each process
+        self.health = {}
+
+    def get_problems(self, key):
+        """
+        Checks the health of the process with the given key, returning a list of
+        reasons it is unhealthy (empty if it is healthy).
+        """
+        process = self.sharder.processes[key]
+        if not process.is_alive():
+            return ['exited with code {}'.format(process.exitcode)]
+
+        try:
+            health = self.sharder.shards[key].call(('shards', 'health')).get(timeout=self.timeout)
+        except gevent.Timeout:
+            return ['health check timed out']
+
+        self.health[key] = health
+        problems = []
+
+        if self.max_memory and health['memory'] > self.max_memory * 1024 * 1024:
+            problems.append('using {}MB of memory'.format(health['memory'] // (1024 * 1024)))
+
+        for sid, shard in sorted(health['shards'].items()):
+            if self.max_latency and shard['latency'] and shard['latency'] > self.max_latency:
+                problems.append('shard {} heartbeat latency is {:.1f}s'.format(sid, shard['latency']))
+
+            if self.max_idle and shard['idle'] and shard['idle'] > self.max_idle:
+                problems.append('shard {} has received nothing for {:.0f}s'.format(sid, shard['idle']))
+
+        return problems
+
+    def check(self, key):
+        if key in self._restarting:
+            return
+
+        problems = self.get_problems(key)
+        if not problems:
+            self._failures[key] = 0
+
+            # Only forget about previous restarts once the process has stayed up
+            if time.time() - self._restarted_at.get(key, 0) > self.max_backoff:
+                self._restarts[key] = 0
+            return
+
+        self._failures[key] = self._failures.get(key, 0) + 1
+        self.log.warning('Shard process %s is unhealthy (%s/%s): %s',
+                         key, self._failures[key], self.failures, ', '.join(problems))
+
+        # Dead processes are restarted straight away
+        if self._failures[key] >= self.failures or not self.sharder.processes[key].is_alive():
+            self._restarting.add(key)
+            gevent.spawn(self.restart, key)
+
+    def restart(self, key):
+        restarts = self._restarts.get(key, 0)
+        delay = min(self.backoff * (2 ** restarts), self.max_backoff)
+        self._restarts[key] = restarts + 1
+
+        try:
+            process = self.sharder.processes[key]
+            if process.is_alive():
+                try:
+                    self.sharder.shards[key].call(('shards', 'save_sessions')).get(timeout=self.timeout)
+                except gevent.Timeout:
+                    self.log.warning('Shard process %s did not save its sessions', key)
+
+            self.log.warning('Restarting shard process %s in %ss', key, delay)
+            self.sharder.stop_shard(key)
+            gevent.sleep(delay)
+            self.sharder.start_shard(self.sharder.groups[key])
+            self._restarted_at[key] = time.time()
+        finally:
+            self._failures[key] = 0
+            self._restarting.discard(key)
+
+    def tick(self):
+        """
+        Runs a health check on every process.
+        """
+        gevent.joinall([gevent.spawn(self.check, key) for key in list(self.sharder.processes.keys())])
+
+    def run(self):
+        while True:
+            gevent.sleep(self.interval)
+            self.tick()
+
+
 class AutoSharder(object):
     def __init__(self, config):
         self.config = config
         self.client = APIClient(config.token)
         self.shards = {}
-        self.config.shard_count = self.client.gateway_bot_get()['shards']
+        self.processes = {}
+        self.pipes = {}
+        self.groups = {}
+        self.codec = IPCCodec(config.ipc_codec)
+        self.supervisor = None
+        self.manhole_enable = config.manhole_enable
 
-    def run_on(self, sid, raw):
-        func = load_function(raw)
-        return self.shards[sid].execute(func).wait(timeout=15)
+        gateway = self.client.gateway_bot_get()
+        self.config.shard_count = gateway['shards']
+
+        # Shard processes are all started at once, and wait on this (over IPC)
+        #  before they IDENTIFY.
+        self.identify = IdentifyScheduler.from_gateway_bot(gateway)
+
+        # The global request budget shared by all shard processes
+        self.budget = GlobalBudget(config.http_global_budget or 50)
+
+    def run_on(self, sid, raw, *args):
+        # Returns the AsyncResult, so the IPC read loop is not blocked waiting
+        return self.shards[sid].call(('shards', 'run_local'), sid, raw, *args)
+
+    def call_on(self, sid, path, args):
+        return self.shards[sid].call(tuple(path), *args)
 
     def run(self):
-        for shard in range(self.config.shard_count):
-            if self.config.manhole_enable and shard != 0:
-                self.config.manhole_enable = False
+        per_process = max(int(self.config.shards_per_process or 1), 1)
+        if self.config.shard_processes:
+            processes = int(self.config.shard_processes)
+            per_process = int(math.ceil(self.config.shard_count / float(processes)))
 
-            self.start_shard(shard)
-            gevent.sleep(6)
+        for start in range(0, self.config.shard_count, per_process):
+            self.start_shard(list(range(start, min(start + per_process, self.config.shard_count))))
 
         logging.basicConfig(
             level=logging.INFO,
             format='{} [%(levelname)s] %(asctime)s - %(name)s:%(lineno)d - %(message)s'.format(id),
         )
 
-    @staticmethod
-    def dumps(data):
-        if isinstance(data, (string_types, integer_types, bool, list, set, dict)):
-            return '\x01' + marshal.dumps(data)
-        elif isinstance(data, object) and data.__class__.__name__ == 'code':
-            return '\x01' + marshal.dumps(data)
+        # Keep serving IPC (e.g. identify requests) for as long as the shards run
+        if self.config.supervisor_enabled:
+            self.supervisor = ShardSupervisor(
+                self,
+                interval=self.config.supervisor_interval,
+                max_latency=self.config.supervisor_max_latency,
+                max_idle=self.config.supervisor_max_idle,
+                max_memory=self.config.supervisor_max_memory,
+                failures=self.config.supervisor_failures)
+            self.supervisor.run()
         else:
-            return '\x02' + pickle.dumps(data)
-
-    @staticmethod
-    def loads(data):
-        enc_type = data[0]
-        if enc_type == '\x01':
-            return marshal.loads(data[1:])
-        elif enc_type == '\x02':
-            return pickle.loads(data[1:])
-
-    def start_shard(self, sid):
-        cpipe, ppipe = gipc.pipe(duplex=True, encoder=self.dumps, decoder=self.loads)
-        gipc.start_process(run_shard, (self.config, sid, cpipe))
-        self.shards[sid] = GIPCProxy(self, ppipe)
+            for process in self.processes.values():
+                process.join()
+
+    def start_shard(self, shard_ids):
+        """
+        Starts a process running the given shards. Processes are keyed by their
+        first shard ID.
+        """
+        if isinstance(shard_ids, integer_types):
+            shard_ids = [shard_ids]
+
+        # Only the process running shard 0 gets a manhole
+        config = self.config.__class__(self.config.to_dict())
+        config.manhole_enable = self.manhole_enable and 0 in shard_ids
+
+        key = shard_ids[0]
+        cpipe, ppipe = gipc.pipe(duplex=True, encoder=self.codec.dumps, decoder=self.codec.loads)
+        self.processes[key] = gipc.start_process(run_shard, (config, shard_ids, cpipe))
+        self.pipes[key] = ppipe
+        self.groups[key] = shard_ids
+
+        proxy = GIPCProxy(self, ppipe)
+        for sid in shard_ids:
+            self.shards[sid] = proxy
+
+    def stop_shard(self, key):
+        """
+        Stops the process with the given key.
+        """
+        # Stop the proxy first, so it doesn't fail reading from (or keep writing
+        #  to) the closed pipe, and anything waiting on the process is failed.
+        proxy = self.shards.get(key)
+        if proxy is not None:
+            proxy.close()
+
+        process = self.processes[key]
+        if process.is_alive():
+            process.terminate()
+        process.join(timeout=10)
+
+        self.pipes.pop(key).close()
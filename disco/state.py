@@ -1,4 +1,5 @@
 import six
+import gevent
 import weakref
 
 from collections import deque, namedtuple
@@ -6,9 +7,12 @@ from gevent.event import Event
 from holster.emitter import Priority
 
 from disco.types.base import UNSET
+from disco.types.user import User
 from disco.util.config import Config
 from disco.util.string import underscore
 from disco.util.hashmap import HashMap, DefaultHashMap
+from disco.util.snowflake import calculate_shard
+from disco.util.usercache import SharedUserCache
 from disco.voice.client import VoiceState
 
 
@@ -54,12 +58,61 @@ class StateConfig(Config):
         50 guilds will notice this operation can take a while to complete and may want
         to batch requests using the underlying `GatewayClient.request_guild_members`
         interface.
+    shared_users_path : Optional[str]
+        If set, the path of a `SharedUserCache` file which every shard process on
+        this host attaches to. Users seen by this state are written to it, and user
+        lookups which miss locally fall through to it, so users known to any shard
+        can be found by all of them. Placing the file on a tmpfs (e.g. /dev/shm)
+        keeps it in memory.
+    shared_users_capacity : int
+        The number of users the shared user cache can hold, used when it is first
+        created. Each user takes 128 bytes.
     """
     track_messages = True
     track_messages_size = 100
 
     sync_guild_members = True
 
+    shared_users_path = None
+    shared_users_capacity = 1 << 20
+
+
+class SharedUserMap(HashMap):
+    """
+    A mapping of users which writes through to, and falls back on, a
+    `SharedUserCache`. Users loaded from the shared cache are not stored locally,
+    and membership checks (`in`) only consider local users.
+    """
+    __slots__ = ('client', 'cache')
+
+    def __init__(self, client, cache, *args, **kwargs):
+        super(SharedUserMap, self).__init__(*args, **kwargs)
+        self.client = client
+        self.cache = cache
+
+    def __setitem__(self, key, user):
+        super(SharedUserMap, self).__setitem__(key, user)
+        self.cache.put(user)
+
+    def __missing__(self, key):
+        user = self._load(key)
+        if user is None:
+            raise KeyError(key)
+        return user
+
+    def get(self, key, default=None):
+        if key in self:
+            return super(SharedUserMap, self).get(key)
+
+        user = self._load(key)
+        return default if user is None else user
+
+    def _load(self, key):
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        return User.create(self.client, cached.to_dict())
+
 
 class State(object):
     """
@@ -85,6 +138,8 @@ class State(object):
         Weak mapping of all known/loaded Channels
     users : dict(snowflake, `User`)
         Weak mapping of all known/loaded Users
+    shared_users : Optional[`SharedUserCache`]
+        The users shared between shard processes on this host, if enabled
     voice_clients : dict(str, 'VoiceClient')
         Weak mapping of all known voice clients
     voice_states : dict(str, `VoiceState`)
@@ -111,6 +166,15 @@ class State(object):
         self.guilds = HashMap()
         self.channels = HashMap(weakref.WeakValueDictionary())
         self.users = HashMap(weakref.WeakValueDictionary())
+
+        # Optionally share users with the other shard processes on this host
+        self.shared_users = None
+        if self.config.shared_users_path:
+            self.shared_users = SharedUserCache(
+                self.config.shared_users_path,
+                self.config.shared_users_capacity,
+            )
+            self.users = SharedUserMap(self.client, self.shared_users)
         self.voice_clients = HashMap(weakref.WeakValueDictionary())
         self.voice_states = HashMap(weakref.WeakValueDictionary())
 
@@ -138,8 +202,60 @@ class State(object):
         assert not len(self.listeners), 'Binding while already bound is dangerous'
 
         for event in self.EVENTS:
-            func = 'on_' + underscore(event)
-            self.listeners.append(self.client.events.on(event, getattr(self, func), priority=Priority.BEFORE))
+            func = getattr(self, 'on_' + underscore(event))
+
+            # When the emitter is shared by several clients (e.g. a `ShardCluster`),
+            #  only track the events belonging to our client.
+            if getattr(self.client, 'shared_events', False):
+                func = self._only_own_events(func)
+
+            self.listeners.append(self.client.events.on(event, func, priority=Priority.BEFORE))
+
+    def _only_own_events(self, func):
+        def wrapped(event):
+            if event.client is self.client:
+                return func(event)
+        return wrapped
+
+    def seed(self):
+        """
+        Seeds the state from the API, for sessions which are resumed without ever
+        receiving a READY (or GUILD_CREATEs), e.g. a session restored after the
+        process restarted. The current user is loaded before returning, and the
+        guilds (and channels) of this shard are loaded in the background.
+        """
+        self.me = self.client.api.users_me_get()
+        gevent.spawn(self._seed_guilds)
+
+    def _seed_guilds(self):
+        shard_id = int(self.client.config.shard_id)
+        shard_count = int(self.client.config.shard_count)
+
+        guild_ids, after = [], None
+        while True:
+            page = self.client.api.users_me_guilds_list(after=after)
+            guild_ids.extend(
+                guild.id for guild in page if calculate_shard(shard_count, guild.id) == shard_id)
+            if len(page) < 100:
+                break
+            after = page[-1].id
+
+        for guild_id in guild_ids:
+            # Guilds created by events in the meantime are more complete
+            if guild_id in self.guilds:
+                continue
+
+            try:
+                guild = self.client.api.guilds_get(guild_id)
+                guild.channels = self.client.api.guilds_channels_list(guild_id)
+            except Exception:
+                self.client.log.exception('Failed to seed state for guild %s: ', guild_id)
+                continue
+
+            self.guilds.setdefault(guild.id, guild)
+            self.channels.update(guild.channels)
+
+        self.ready.set()
 
     def fill_messages(self, channel):
         for message in reversed(next(channel.messages_iter(bulk=True))):
@@ -371,6 +487,9 @@ class State(object):
         #  update to update both their presence and the cached user object.
         if user.id in self.users:
             self.users[user.id].inplace_update(user)
+
+            if self.shared_users:
+                self.shared_users.put(self.users[user.id])
         else:
             # Otherwise this user does not exist in our local cache, so we can
             #  use this opportunity to add them. They will quickly fall out of
@@ -1,3 +1,4 @@
+import os
 import re
 
 from disco.types.base import SlottedModel, Field, snowflake, cached_property
@@ -58,15 +59,19 @@ class Webhook(SlottedModel):
             fobj=None,
             embeds=[],
             wait=False,
-            client=None):
-        # TODO: support file stuff properly
+            client=None,
+            attachments=None):
         client = client or self.client.api
 
+        attachments = list(attachments or [])
+        if fobj is not None:
+            attachments.append(fobj if isinstance(fobj, tuple) else (
+                os.path.basename(str(getattr(fobj, 'name', None) or 'file')), fobj))
+
         return client.webhooks_token_execute(self.id, self.token, {
             'content': content,
             'username': username,
             'avatar_url': avatar_url,
             'tts': tts,
-            'file': fobj,
             'embeds': [i.to_dict() for i in embeds],
-        }, wait)
+        }, wait, attachments)
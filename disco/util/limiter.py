@@ -1,21 +1,119 @@
+import time
+import heapq
 import gevent
+import itertools
 
+from collections import deque
+from gevent.event import Event
 
-class SimpleLimiter(object):
-    def __init__(self, total, per):
+# Priorities for `SlidingWindowLimiter.check`, lower values are sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class SlidingWindowLimiter(object):
+    """
+    A limiter which allows at most `total` calls to `check` within any `per`
+    second window. Callers which must wait are queued by priority (and then in
+    the order they arrived), and a single greenlet releases them as the window
+    slides, rather than a greenlet being spawned for every call.
+
+    Parameters
+    ----------
+    total : int
+        The number of calls allowed within the window.
+    per : float
+        The length of the window, in seconds.
+    reserved : int
+        The number of calls within the window which may only be used by callers
+        with `PRIORITY_HIGH`, guaranteeing urgent calls (e.g. heartbeats) are never
+        starved by bulk ones.
+    """
+    def __init__(self, total, per, reserved=0):
         self.total = total
         self.per = per
-        self._lock = gevent.lock.Semaphore(total)
+        self.reserved = reserved
+
+        self._calls = deque()
+        self._waiters = []
+        self._counter = itertools.count()
+        self._releaser = None
+        self._wakeup = Event()
+
+    def _limit(self, priority):
+        return self.total if priority <= PRIORITY_HIGH else self.total - self.reserved
+
+    def _delay(self, priority, now):
+        while self._calls and self._calls[0] <= now - self.per:
+            self._calls.popleft()
+
+        limit = self._limit(priority)
+        if len(self._calls) < limit:
+            return 0
+
+        return self._calls[len(self._calls) - limit] + self.per - now
+
+    def wait_time(self, priority=PRIORITY_NORMAL):
+        """
+        Returns the number of seconds a call at the given priority would currently
+        have to wait for (not including any callers already waiting).
+        """
+        return max(self._delay(priority, time.time()), 0)
+
+    @property
+    def waiting(self):
+        """
+        The number of callers currently waiting.
+        """
+        return len(self._waiters)
+
+    def check(self, priority=PRIORITY_NORMAL):
+        """
+        Blocks until a call at the given priority is allowed.
+
+        Returns
+        -------
+        float
+            The number of seconds waited.
+        """
+        now = time.time()
+
+        # Only jump straight through if nobody of equal or higher priority is queued
+        if (not self._waiters or priority < self._waiters[0][0]) and self._delay(priority, now) <= 0:
+            self._calls.append(now)
+            return 0
+
+        event = Event()
+        heapq.heappush(self._waiters, (priority, next(self._counter), event))
+
+        if not self._releaser:
+            self._releaser = gevent.spawn(self._release)
+        elif self._waiters[0][2] is event:
+            # We jumped the queue, so the releaser may be waiting for longer than needed
+            self._wakeup.set()
+
+        event.wait()
+        return time.time() - now
+
+    def _release(self):
+        try:
+            while self._waiters:
+                priority, _, event = self._waiters[0]
 
-        self.count = 0
-        self.reset_at = 0
-        self.event = None
+                now = time.time()
+                delay = self._delay(priority, now)
+                if delay > 0:
+                    self._wakeup.clear()
+                    self._wakeup.wait(delay)
+                    continue
 
-    def check(self):
-        self._lock.acquire()
+                heapq.heappop(self._waiters)
+                self._calls.append(now)
+                event.set()
+        finally:
+            self._releaser = None
 
-        def _release_lock():
-            gevent.sleep(self.per)
-            self._lock.release()
 
-        gevent.spawn(_release_lock)
+# Backwards compatibility
+SimpleLimiter = SlidingWindowLimiter
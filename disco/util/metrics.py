@@ -0,0 +1,195 @@
+import six
+
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs
+    ) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    Base class for a named metric, optionally partitioned by a set of labels.
+    """
+    TYPE = None
+
+    def __init__(self, name, description='', labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def samples(self):
+        """
+        Generator of (suffix, label values, extra label, value) tuples.
+        """
+        raise NotImplementedError
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} {}'.format(self.name, self.TYPE),
+        ]
+
+        for suffix, values, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix, _format_labels(self.labels, values, extra), _format_value(value)))
+
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super(Counter, self).__init__(*args, **kwargs)
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        self.values[self._key(labels)] += amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in sorted(six.iteritems(self.values)):
+            yield '_total' if not self.name.endswith('_total') else '', key, None, value
+
+
+class Gauge(Metric):
+    """
+    A metric which can go up and down. Gauges may be backed by a function (for
+    each set of label values), which is called whenever the value is read.
+    """
+    TYPE = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        func = kwargs.pop('func', None)
+        super(Gauge, self).__init__(*args, **kwargs)
+        self.values = {}
+        self.funcs = {}
+        if func:
+            self.set_function(func)
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def set_function(self, func, **labels):
+        """
+        Backs the value for the given labels with a function.
+        """
+        self.funcs[self._key(labels)] = func
+
+    def get(self, **labels):
+        key = self._key(labels)
+        if key in self.funcs:
+            return self.funcs[key]()
+        return self.values.get(key, 0)
+
+    def samples(self):
+        for key in sorted(set(self.values) | set(self.funcs)):
+            yield '', key, None, self.funcs[key]() if key in self.funcs else self.values[key]
+
+
+class Histogram(Metric):
+    """
+    A metric which tracks the distribution of observed values (generally durations
+    in seconds) across a fixed set of buckets.
+    """
+    TYPE = 'histogram'
+
+    def __init__(self, *args, **kwargs):
+        self.buckets = tuple(kwargs.pop('buckets', DEFAULT_BUCKETS))
+        super(Histogram, self).__init__(*args, **kwargs)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        if key not in self.values:
+            self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+
+        state = self.values[key]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = timer()
+        try:
+            yield
+        finally:
+            self.observe(timer() - start, **labels)
+
+    def count(self, **labels):
+        return self.values.get(self._key(labels), (None, 0, 0))[2]
+
+    def sum(self, **labels):
+        return self.values.get(self._key(labels), (None, 0, 0))[1]
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(six.iteritems(self.values)):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += bucket
+                yield '_bucket', key, ('le', _format_value(bound)), cumulative
+            yield '_sum', key, None, total
+            yield '_count', key, None, count
+
+
+class MetricsRegistry(object):
+    """
+    A collection of metrics, which can be rendered in the Prometheus text
+    exposition format.
+    """
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        if name not in self.metrics:
+            self.metrics[name] = cls(name, *args, **kwargs)
+
+        metric = self.metrics[name]
+        if not isinstance(metric, cls):
+            raise TypeError('Metric {} is already registered as a {}'.format(name, metric.TYPE))
+        return metric
+
+    def counter(self, name, description='', labels=()):
+        return self._get_or_create(Counter, name, description, labels)
+
+    def gauge(self, name, description='', labels=(), func=None):
+        return self._get_or_create(Gauge, name, description, labels, func=func)
+
+    def histogram(self, name, description='', labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, description, labels, buckets=buckets)
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    def render(self):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        return '\n'.join(metric.render() for metric in six.itervalues(self.metrics)) + '\n'
@@ -0,0 +1,183 @@
+import os
+import mmap
+import struct
+
+from collections import namedtuple
+
+MAGIC = b'DUSR'
+VERSION = 1
+
+# Header of the cache file, (magic, version, capacity)
+HEADER = struct.Struct('<4sII52x')
+
+# Each user record, (sequence, id, discriminator, username, avatar, flags)
+RECORD = struct.Struct('<IQH64s34sB15x')
+SEQUENCE = struct.Struct('<I')
+
+FLAG_BOT = 1 << 0
+
+# The number of slots searched for a user before giving up (or evicting)
+MAX_PROBE = 16
+
+# The number of times a record being written is re-read before giving up
+MAX_READ_ATTEMPTS = 64
+
+
+def _encode(value, size):
+    """
+    Encodes a string to fit within a record field of the given size, without
+    cutting a multi-byte character in half.
+    """
+    data = (value or u'').encode('utf-8')
+    if len(data) <= size:
+        return data
+    return data[:size].decode('utf-8', 'ignore').encode('utf-8')
+
+
+class CachedUser(namedtuple('CachedUser', ['id', 'username', 'discriminator', 'avatar', 'bot'])):
+    """
+    A user as stored within a `SharedUserCache`.
+    """
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'discriminator': self.discriminator,
+            'avatar': self.avatar,
+            'bot': self.bot,
+        }
+
+
+class SharedUserCache(object):
+    """
+    A fixed-size table of users within a memory mapped file, which can be shared
+    by every shard process on a host (e.g. by placing it within /dev/shm). Each
+    user takes a single 128 byte record holding their ID, username, discriminator,
+    avatar and bot flag, located by open addressing on their ID.
+
+    This is a best effort cache: there is no cross-process locking, so when the
+    table is too full (or two processes insert at once) a user may be evicted or
+    not stored. Records are written with a sequence number, so readers never see
+    a partially written user.
+
+    Parameters
+    ----------
+    path : str
+        The path of the cache file, which is created if it does not exist.
+    capacity : int
+        The number of user records within a newly created cache file. When
+        attaching to an existing file its capacity is used instead.
+    """
+    def __init__(self, path, capacity=1 << 20):
+        self.path = path
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            size = os.fstat(fd).st_size
+            if size < HEADER.size:
+                os.ftruncate(fd, HEADER.size + (capacity * RECORD.size))
+                os.write(fd, HEADER.pack(MAGIC, VERSION, capacity))
+                size = HEADER.size + (capacity * RECORD.size)
+
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, version, self.capacity = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception('{} is not a shared user cache'.format(path))
+
+    def close(self):
+        self._mm.close()
+
+    def _slots(self, user_id):
+        # Snowflakes are mostly made up of their timestamp, so mix the bits up
+        #  before picking a slot.
+        start = ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % self.capacity
+        for i in range(min(MAX_PROBE, self.capacity)):
+            yield (start + i) % self.capacity
+
+    def _offset(self, slot):
+        return HEADER.size + (slot * RECORD.size)
+
+    def _read(self, slot):
+        offset = self._offset(slot)
+
+        for _ in range(MAX_READ_ATTEMPTS):
+            record = RECORD.unpack_from(self._mm, offset)
+
+            # A write is in progress (or finished while we were reading), retry
+            if record[0] & 1 or SEQUENCE.unpack_from(self._mm, offset)[0] != record[0]:
+                continue
+
+            return record
+
+        # The writer likely died mid-write, treat the record as unknown
+        return None
+
+    def get(self, user_id):
+        """
+        Returns the `CachedUser` for the given user ID, or None.
+        """
+        user_id = int(user_id)
+
+        for slot in self._slots(user_id):
+            record = self._read(slot)
+            if record is None:
+                continue
+
+            _, uid, discriminator, username, avatar, flags = record
+            if uid == user_id:
+                return CachedUser(
+                    uid,
+                    username.rstrip(b'\x00').decode('utf-8', 'ignore'),
+                    '{:04d}'.format(discriminator),
+                    avatar.rstrip(b'\x00').decode('utf-8', 'ignore') or None,
+                    bool(flags & FLAG_BOT),
+                )
+            elif uid == 0:
+                return None
+
+        return None
+
+    def put(self, user):
+        """
+        Stores (or updates) a `disco.types.user.User` within the cache. Partial
+        users without a username (e.g. those within presence updates) are not
+        stored, so they never replace a complete record.
+        """
+        if not user.username:
+            return
+
+        user_id = int(user.id)
+
+        # Use the first slot holding this user or free, evicting from the first
+        #  slot if there are neither.
+        target = None
+        for slot in self._slots(user_id):
+            uid = RECORD.unpack_from(self._mm, self._offset(slot))[1]
+            if uid == user_id or uid == 0:
+                target = slot
+                break
+
+            if target is None:
+                target = slot
+
+        offset = self._offset(target)
+        sequence = SEQUENCE.unpack_from(self._mm, offset)[0]
+        if sequence & 1:
+            # Someone else is writing this record
+            return
+
+        SEQUENCE.pack_into(self._mm, offset, (sequence + 1) & 0xFFFFFFFF)
+        RECORD.pack_into(
+            self._mm,
+            offset,
+            (sequence + 1) & 0xFFFFFFFF,
+            user_id,
+            int(user.discriminator or 0),
+            _encode(user.username, 64),
+            _encode(user.avatar, 34),
+            FLAG_BOT if user.bot else 0,
+        )
+        SEQUENCE.pack_into(self._mm, offset, (sequence + 2) & 0xFFFFFFFF)
@@ -11,6 +11,7 @@ from holster.emitter import Emitter
 from disco.gateway.encoding.json import JSONEncoder
 from disco.util.websocket import Websocket
 from disco.util.logging import LoggingClass
+from disco.util.limiter import SlidingWindowLimiter, PRIORITY_HIGH, PRIORITY_NORMAL
 from disco.gateway.packets import OPCode
 from disco.types.base import cached_property
 from disco.voice.packets import VoiceOPCode
@@ -35,6 +36,13 @@ VoiceState = Enum(
     VOICE_CONNECTED=8,
 )
 
+# Voice payloads which skip ahead of others within the send limiter
+HIGH_PRIORITY_OPCODES = {
+    VoiceOPCode.HEARTBEAT,
+    VoiceOPCode.IDENTIFY,
+    VoiceOPCode.RESUME,
+}
+
 VoiceSpeaking = namedtuple('VoiceSpeaking', [
     'client',
     'user_id',
@@ -66,7 +74,7 @@ class VoiceClient(LoggingClass):
         self.server_id = server_id
         self.channel_id = None
         self.is_dm = is_dm
-        self.encoder = encoder or JSONEncoder
+        self.encoder = encoder or JSONEncoder(client.config.json_backend)
         self.max_reconnects = max_reconnects
         self.video_enabled = False
 
@@ -102,6 +110,7 @@ class VoiceClient(LoggingClass):
 
         # Websocket connection
         self.ws = None
+        self.limiter = SlidingWindowLimiter(115, 60, reserved=5)
 
         self._session_id = self.client.gw.session_id
         self._reconnects = 0
@@ -210,6 +219,7 @@ class VoiceClient(LoggingClass):
 
     def send(self, op, data):
         if self.ws and self.ws.sock and self.ws.sock.connected:
+            self.limiter.check(PRIORITY_HIGH if op in HIGH_PRIORITY_OPCODES else PRIORITY_NORMAL)
             self.log.debug('[%s] sending OP %s (data = %s)', self, op, data)
             self.ws.send(self.encoder.encode({
                 'op': op.value,
@@ -0,0 +1,119 @@
+import time
+
+from holster.emitter import Emitter
+
+from disco.api.cache import ResponseCache
+from disco.api.http import HTTPClient, Routes
+from disco.gateway.events import GuildRoleUpdate
+
+
+class MockResponse(object):
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.headers = {}
+
+
+class MockSession(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        return MockResponse()
+
+
+def get_client(**ttls):
+    http = HTTPClient(None)
+    http.session = MockSession()
+    http.cache = ResponseCache.from_names(ttls or {'GUILDS_GET': 60, 'GUILDS_ROLES_LIST': 60}, max_size=2)
+    return http
+
+
+def test_cached_responses():
+    http = get_client()
+
+    first = http(Routes.GUILDS_GET, dict(guild=1))
+    assert http(Routes.GUILDS_GET, dict(guild=1)) is first
+    assert len(http.session.requests) == 1
+    assert http.cache.hit_ratio(Routes.GUILDS_GET) == 0.5
+
+    # Uncached routes always make requests
+    http(Routes.CHANNELS_GET, dict(channel=1))
+    http(Routes.CHANNELS_GET, dict(channel=1))
+    assert len(http.session.requests) == 3
+
+
+def test_cache_ttl():
+    http = get_client(GUILDS_GET=0.01)
+
+    http(Routes.GUILDS_GET, dict(guild=1))
+    time.sleep(0.02)
+    http(Routes.GUILDS_GET, dict(guild=1))
+    assert len(http.session.requests) == 2
+
+
+def test_cache_lru():
+    http = get_client()
+
+    http(Routes.GUILDS_GET, dict(guild=1))
+    http(Routes.GUILDS_GET, dict(guild=2))
+    http(Routes.GUILDS_GET, dict(guild=1))
+    http(Routes.GUILDS_GET, dict(guild=3))
+
+    # Guild 2 was the least recently used
+    http(Routes.GUILDS_GET, dict(guild=1))
+    http(Routes.GUILDS_GET, dict(guild=2))
+    assert [r[1][-1] for r in http.session.requests] == ['1', '2', '3', '2']
+
+
+def test_mutations_invalidate():
+    http = get_client()
+
+    http(Routes.GUILDS_ROLES_LIST, dict(guild=1))
+    http(Routes.GUILDS_ROLES_MODIFY, dict(guild=1, role=2), json={'name': 'test'})
+    http(Routes.GUILDS_ROLES_LIST, dict(guild=1))
+    assert len(http.session.requests) == 3
+
+    http(Routes.GUILDS_GET, dict(guild=1))
+    http(Routes.GUILDS_DELETE, dict(guild=1))
+    http(Routes.GUILDS_ROLES_LIST, dict(guild=1))
+    assert len(http.session.requests) == 6
+
+
+def test_events_invalidate():
+    http = get_client()
+    events = Emitter()
+    http.cache.bind(events)
+
+    http(Routes.GUILDS_ROLES_LIST, dict(guild=1))
+    http(Routes.GUILDS_GET, dict(guild=1))
+
+    event = GuildRoleUpdate.create({'guild_id': '1', 'role': {'id': '2', 'name': 'test'}}, None)
+    events.emit('GuildRoleUpdate', event)
+
+    assert ('/guilds/1/roles', None) not in http.cache._entries
+    assert ('/guilds/1', None) in http.cache._entries
+
+
+def test_event_invalidation_errors_logged(caplog):
+    http = get_client()
+    events = Emitter()
+    http.cache.bind(events)
+
+    events.emit('GuildRoleUpdate', object())
+    assert any('Failed to invalidate cached responses' in record.getMessage() for record in caplog.records)
+
+
+def test_invalidated_in_flight_not_cached():
+    http = get_client()
+
+    def request(method, url, **kwargs):
+        http.cache.invalidate('/guilds/1')
+        return MockResponse()
+
+    http.session.request = request
+    http(Routes.GUILDS_GET, dict(guild=1))
+    http(Routes.GUILDS_ROLES_LIST, dict(guild=1))
+
+    assert list(http.cache._entries) == [('/guilds/1/roles', None)]
+    assert http.cache._pending == {}
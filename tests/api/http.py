@@ -0,0 +1,274 @@
+import time
+import json
+import gevent
+import socket
+import threading
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from disco.api.client import APIClient
+from disco.api.http import HTTPClient, Routes, APIException
+from disco.api.pipeline import RequestPipeline
+from disco.api.ratelimit import GlobalBudget
+from disco.types.channel import Channel
+
+
+class MockResponse(object):
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.content = json.dumps(data or {})
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class MockSession(object):
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.delay = 0
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, time.time()))
+        if self.delay:
+            gevent.sleep(self.delay)
+        return self.responses.pop(0)
+
+
+def get_client(*responses):
+    http = HTTPClient(None)
+    http.session = MockSession(*responses)
+    return http
+
+
+def test_retry_after_429():
+    http = get_client(
+        MockResponse(429, {'retry_after': 10, 'global': False}, {'X-RateLimit-Scope': 'user'}),
+        MockResponse(200),
+    )
+
+    assert http(Routes.CHANNELS_GET, dict(channel=1)).status_code == 200
+    assert len(http.session.requests) == 2
+    assert http.metrics.get('disco_http_rate_limited').get(scope='user') == 1
+    assert http.metrics.get('disco_http_retry_after_seconds').sum() == 0.01
+
+
+def test_global_429_blocks_other_routes():
+    http = get_client(
+        MockResponse(429, {'retry_after': 50, 'global': True}, {'X-RateLimit-Global': 'true'}),
+        MockResponse(200),
+    )
+
+    http(Routes.CHANNELS_GET, dict(channel=1))
+    assert http.metrics.get('disco_http_rate_limited').get(scope='global') == 1
+
+    # Every route waits on the global bucket until it has reset
+    state = http.limiter.states[None]
+    assert state.remaining == 0
+    assert http.session.requests[1][2] >= state.reset_time
+
+
+def test_max_retries():
+    http = get_client(*[MockResponse(429, {'retry_after': 1, 'global': False})] * (HTTPClient.MAX_RETRIES + 1))
+
+    try:
+        http(Routes.CHANNELS_GET, dict(channel=1))
+        assert False, 'expected an APIException'
+    except APIException as e:
+        assert e.retries == HTTPClient.MAX_RETRIES
+
+    assert len(http.session.requests) == HTTPClient.MAX_RETRIES + 1
+
+
+def test_requests_acquire_budget():
+    http = get_client(MockResponse(200), MockResponse(200))
+    http.budget = GlobalBudget(rate=1, per=0.05)
+
+    http(Routes.CHANNELS_GET, dict(channel=1))
+    response = http(Routes.CHANNELS_GET, dict(channel=2))
+
+    assert response.status_code == 200
+    assert http.session.requests[1][2] - http.session.requests[0][2] >= 0.04
+    assert http.metrics.get('disco_http_global_budget_remaining').get() == 0
+
+
+def test_identical_gets_coalesced():
+    captured = []
+    http = get_client(MockResponse(200, {'id': 1}), MockResponse(200), MockResponse(200))
+    http.after_request = captured.append
+    http.session.delay = 0.01
+    http.coalesce_routes[Routes.CHANNELS_GET] = True
+
+    greenlets = [gevent.spawn(http, Routes.CHANNELS_GET, dict(channel=1)) for _ in range(5)]
+    greenlets.append(gevent.spawn(http, Routes.CHANNELS_GET, dict(channel=2)))
+    greenlets.append(gevent.spawn(http, Routes.CHANNELS_MESSAGES_LIST, dict(channel=1), params={'limit': 5}))
+    gevent.joinall(greenlets)
+
+    assert len(http.session.requests) == 3
+    assert all(g.value is greenlets[0].value for g in greenlets[:5])
+    assert http.metrics.get('disco_http_coalesced').get(route=Routes.CHANNELS_GET[1]) == 4
+    assert http._inflight == {}
+
+    # Every request is reported, including those which shared a response
+    assert len(captured) == 7
+    assert len([r for r in captured if r.response is greenlets[0].value]) == 5
+
+
+def test_coalescing_opt_in():
+    http = get_client(MockResponse(200), MockResponse(200))
+    http.session.delay = 0.01
+
+    gevent.joinall([gevent.spawn(http, Routes.CHANNELS_GET, dict(channel=1)) for _ in range(2)])
+    assert len(http.session.requests) == 2
+
+
+def test_coalesced_errors_shared():
+    http = get_client(MockResponse(404, {'message': 'Unknown Channel', 'code': 10003}))
+    http.session.delay = 0.01
+    http.coalesce = True
+
+    greenlets = [gevent.spawn(http, Routes.CHANNELS_GET, dict(channel=1)) for _ in range(3)]
+    gevent.joinall(greenlets)
+
+    assert len(http.session.requests) == 1
+    assert all(isinstance(g.exception, APIException) for g in greenlets)
+
+
+def test_coalesced_request_killed():
+    http = get_client(MockResponse(200))
+    http.session.delay = 0.01
+    http.coalesce = True
+
+    first = gevent.spawn(http, Routes.CHANNELS_GET, dict(channel=1))
+    second = gevent.spawn(http, Routes.CHANNELS_GET, dict(channel=1))
+    gevent.sleep(0)
+    first.kill()
+
+    # The waiting request makes its own, rather than failing with GreenletExit
+    assert second.get(timeout=1).status_code == 200
+    assert len(http.session.requests) == 2
+
+
+def test_idle_connections_discarded():
+    http = get_client(MockResponse(200), MockResponse(200))
+    http.idle_timeout = 0.01
+
+    cleared = []
+    http.adapter.poolmanager.clear = lambda: cleared.append(True)
+
+    http(Routes.CHANNELS_GET, dict(channel=1))
+    assert cleared == []
+
+    time.sleep(0.02)
+    http(Routes.CHANNELS_GET, dict(channel=1))
+    assert cleared == [True]
+
+
+def test_requests_in_flight_metric():
+    http = get_client(MockResponse(200), MockResponse(200), MockResponse(200))
+    http.session.delay = 0.01
+
+    greenlets = [gevent.spawn(http, Routes.CHANNELS_GET, dict(channel=i)) for i in range(3)]
+    gevent.sleep(0.005)
+    assert http.metrics.get('disco_http_requests_in_flight').get() == 3
+
+    gevent.joinall(greenlets)
+    assert http.metrics.get('disco_http_requests_in_flight').get() == 0
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    pass
+
+
+def test_warm_up():
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_HEAD(self):
+            requests.append(self.command)
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    # Run in a thread, as the sockets of requests are only cooperative when gevent
+    #  has monkey patched them
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    http = HTTPClient(None, pool_size=3)
+    http.BASE_URL = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    http.session.mount('http://', http.adapter)
+    http.warm_up(2)
+    assert http.get_connections_opened() == 2
+    assert requests == ['HEAD', 'HEAD']
+
+    # Connections opened are counted across discarded pools
+    http.adapter.poolmanager.clear()
+    http.warm_up(1)
+    assert http.metrics.get('disco_http_connections_opened').get() == 3
+    server.shutdown()
+    server.server_close()
+
+
+def test_keepalive_socket_options():
+    options = HTTPClient(None).adapter.get_socket_options()
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in options
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        assert (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60) in options
+
+
+def test_request_priority():
+    http = get_client(*[MockResponse(200) for _ in range(4)])
+    http.scheduler.concurrency = 1
+    http.session.delay = 0.01
+
+    def request(channel, priority=None):
+        if priority:
+            with http.priority(priority):
+                return http(Routes.CHANNELS_MESSAGES_DELETE, dict(channel=1, message=channel))
+        return http(Routes.CHANNELS_MESSAGES_DELETE, dict(channel=1, message=channel))
+
+    greenlets = [gevent.spawn(request, 1, 'bulk'), gevent.spawn(request, 2, 'bulk')]
+    gevent.sleep(0)
+    greenlets.append(gevent.spawn(request, 3))
+    greenlets.append(gevent.spawn(http, Routes.CHANNELS_MESSAGES_DELETE, dict(channel=1, message=4), priority='bulk'))
+    gevent.joinall(greenlets)
+
+    assert [r[1][-1] for r in http.session.requests] == ['1', '3', '2', '4']
+
+
+def test_api_submit():
+    api = APIClient(None)
+    api.http.session = MockSession(MockResponse(200, {'id': '1', 'name': 'general', 'type': 0}), MockResponse(204))
+
+    with api.priority('bulk'):
+        channel = api.submit(Routes.CHANNELS_GET, dict(channel=1), model=Channel)
+        typing = api.submit('channels_typing', 1)
+    assert api.http.session.requests == []
+
+    assert channel.get().name == 'general'
+    assert typing.get() is None
+    assert len(api.http.session.requests) == 2
+
+
+def test_api_submit_priority():
+    api = APIClient(None)
+    api.pipeline = RequestPipeline(concurrency=1)
+    api.http.session = MockSession(*[MockResponse(204) for _ in range(4)])
+
+    with api.priority('bulk'):
+        futures = [api.submit('channels_typing', i) for i in range(1, 4)]
+    futures.append(api.submit('channels_typing', 4))
+
+    gevent.joinall(futures)
+    assert [r[1].split('/')[-2] for r in api.http.session.requests] == ['4', '1', '2', '3']
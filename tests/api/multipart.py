@@ -0,0 +1,115 @@
+import io
+import json
+import pytest
+
+from disco.api.client import APIClient
+from disco.api.multipart import MultipartEncoder, FilePath
+from disco.types.webhook import Webhook
+
+
+class MockResponse(object):
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.content = json.dumps(data or {})
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class MockSession(object):
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        # Read the body like requests would, in small blocks
+        body = kwargs.get('data')
+        if isinstance(body, MultipartEncoder):
+            body = b''.join(iter(lambda: body.read(7), b''))
+
+        self.requests.append((method, url, body, kwargs['headers']))
+        return self.responses.pop(0)
+
+
+def test_multipart_sources(tmpdir):
+    path = tmpdir.join('test.txt')
+    path.write_binary(b'from a path')
+
+    body = MultipartEncoder(
+        fields=[('payload_json', '{}')],
+        files=[
+            ('file0', ('a.txt', FilePath(str(path)))),
+            ('file1', ('b.png', io.BytesIO(b'from a file'))),
+            ('file2', ('c.bin', memoryview(b'from a buffer'), 'application/x-test')),
+            ('file3', ('d.txt', u'from a string')),
+        ],
+        chunk_size=4,
+    )
+
+    data = b''.join(body)
+    assert body.len == len(data)
+    assert data.startswith(('--' + body.boundary + '\r\n').encode('utf-8'))
+    assert data.endswith(('--' + body.boundary + '--\r\n').encode('utf-8'))
+
+    for content in (b'from a path', b'from a file', b'from a buffer', b'from a string'):
+        assert b'\r\n\r\n' + content + b'\r\n' in data
+
+    assert b'name="file1"; filename="b.png"\r\nContent-Type: image/png\r\n' in data
+    assert b'Content-Type: application/x-test\r\n' in data
+
+
+def test_multipart_read_and_rewind():
+    fobj = io.BytesIO(b'skipped contents')
+    fobj.seek(8)
+    body = MultipartEncoder(files=[('file', ('test', fobj))])
+
+    first = body.read(5) + body.read()
+    assert b'\r\n\r\ncontents\r\n' in first
+    assert body.read() == b''
+
+    body.rewind()
+    assert body.read() == first
+
+
+def test_multipart_unknown_length():
+    class Unseekable(object):
+        def __init__(self):
+            self.chunks = [b'data', b'']
+
+        def read(self, size):
+            return self.chunks.pop(0)
+
+    body = MultipartEncoder(files=[('file', ('test', Unseekable()))])
+    assert body.len == 0
+    assert b'\r\n\r\ndata\r\n' in b''.join(body)
+
+    with pytest.raises(Exception):
+        body.rewind()
+
+
+def test_messages_create_attachments():
+    api = APIClient(None)
+    api.http.session = MockSession(MockResponse(200, {'id': '2', 'channel_id': '1'}))
+
+    api.channels_messages_create(1, 'test', attachments=[('test.txt', io.BytesIO(b'contents'))])
+
+    method, url, body, headers = api.http.session.requests[0]
+    assert headers['Content-Type'].startswith('multipart/form-data; boundary=')
+    assert b'name="file"; filename="test.txt"' in body
+    assert b'\r\n\r\ncontents\r\n' in body
+    assert b'"content": "test"' in body or b'"content":"test"' in body
+
+
+def test_webhook_execute_file():
+    api = APIClient(None)
+    api.http.session = MockSession(MockResponse(204))
+
+    fobj = io.BytesIO(b'contents')
+    fobj.name = '/tmp/test.txt'
+    Webhook(id=1, token='token').execute(content='test', fobj=fobj, client=api)
+
+    method, url, body, headers = api.http.session.requests[0]
+    assert url.endswith('/webhooks/1/token')
+    assert b'name="file"; filename="test.txt"' in body
+    assert b'\r\n\r\ncontents\r\n' in body
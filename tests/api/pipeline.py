@@ -0,0 +1,107 @@
+import gevent
+import pytest
+
+from gevent.event import Event
+
+from disco.api.pipeline import RequestPipeline, APIFuture
+
+
+def test_pipeline_runs_in_background():
+    pipeline = RequestPipeline(concurrency=2)
+    running = []
+
+    def call(i):
+        running.append(i)
+        gevent.sleep(0.01)
+        return i * 2
+
+    futures = [pipeline.submit(call, (i, )) for i in range(5)]
+    assert running == []
+    assert pipeline.depth == 5
+
+    gevent.sleep(0.005)
+    assert running == [0, 1]
+
+    assert [f.get() for f in futures] == [0, 2, 4, 6, 8]
+    gevent.sleep(0)
+    assert pipeline.workers == set()
+
+
+def test_pipeline_priority():
+    pipeline = RequestPipeline(concurrency=1)
+    order = []
+    blocked = Event()
+
+    def call(name):
+        order.append(name)
+        blocked.wait()
+
+    futures = [pipeline.submit(call, ('bulk{}'.format(i), ), priority='bulk') for i in range(3)]
+    gevent.sleep(0)
+    assert order == ['bulk0']
+
+    # Submitted after the bulk calls were queued, but run before them
+    futures.append(pipeline.submit(call, ('interactive', )))
+    blocked.set()
+
+    gevent.joinall(futures)
+    assert order == ['bulk0', 'interactive', 'bulk1', 'bulk2']
+
+
+def test_pipeline_errors():
+    pipeline = RequestPipeline()
+
+    def call():
+        raise ValueError('nope')
+
+    future = pipeline.submit(call)
+    future.wait()
+    assert isinstance(future.exception, ValueError)
+
+
+def test_pipeline_context():
+    pipeline = RequestPipeline()
+    entered = []
+
+    class Context(object):
+        def __enter__(self):
+            entered.append(True)
+
+        def __exit__(self, *args):
+            pass
+
+    assert pipeline.submit(lambda: len(entered), context=Context).get() == 1
+
+
+def test_future_deferred_loader():
+    loads = []
+
+    def loader(value):
+        loads.append(value)
+        return value + 1
+
+    future = APIFuture(loader)
+    future.set(1)
+    assert loads == []
+
+    assert future.get() == 2
+    assert future.get() == 2
+    assert loads == [1]
+
+
+def test_future_loader_error_cached():
+    loads = []
+
+    def loader(value):
+        loads.append(value)
+        raise ValueError('invalid')
+
+    future = APIFuture(loader)
+    future.set(1)
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            future.get()
+
+    assert loads == [1]
+    assert future.value == 1
@@ -0,0 +1,83 @@
+import time
+
+from disco.api.ratelimit import RateLimiter, GlobalBudget
+
+
+class MockResponse(object):
+    def __init__(self, **headers):
+        self.headers = {'X-RateLimit-' + k.replace('_', '-'): str(v) for k, v in headers.items()}
+
+
+MESSAGES_CREATE = ('POST', '/channels/{channel}/messages')
+MESSAGES_DELETE = ('DELETE', '/channels/{channel}/messages/{message}')
+
+
+def test_reset_after_is_relative():
+    limiter = RateLimiter()
+    limiter.update(MESSAGES_CREATE, MockResponse(Remaining=0, Reset=0, Reset_After=1.5), (1, ))
+
+    state = limiter.states[limiter.get_key(MESSAGES_CREATE, (1, ))]
+    assert time.time() + 1 < state.reset_time <= time.time() + 1.5
+    assert state.next_will_ratelimit
+
+
+def test_cooldown_waits_for_reset_after():
+    limiter = RateLimiter()
+    limiter.update(MESSAGES_CREATE, MockResponse(Remaining=0, Reset=0, Reset_After=0.05), (1, ))
+
+    start = time.time()
+    limiter.check(MESSAGES_CREATE, (1, ))
+    assert 0.04 <= time.time() - start < 0.25
+
+
+def test_routes_share_bucket_hash():
+    limiter = RateLimiter()
+    limiter.update(MESSAGES_CREATE, MockResponse(Remaining=4, Reset_After=5, Bucket='abc'), (1, ))
+    limiter.update(MESSAGES_DELETE, MockResponse(Remaining=3, Reset_After=5, Bucket='abc'), (1, ))
+
+    assert limiter.buckets[MESSAGES_CREATE] == 'abc'
+    assert limiter.get_key(MESSAGES_CREATE, (1, )) == limiter.get_key(MESSAGES_DELETE, (1, ))
+    assert len(limiter.states) == 1
+    assert limiter.states[('abc', (1, ))].remaining == 3
+
+    # Major parameters have their own limits within a bucket
+    assert limiter.get_key(MESSAGES_CREATE, (2, )) not in limiter.states
+
+
+def test_bucket_replaces_route_state():
+    limiter = RateLimiter()
+    limiter.update(MESSAGES_CREATE, MockResponse(Remaining=4, Reset_After=5), (1, ))
+    assert list(limiter.states) == [(MESSAGES_CREATE, (1, ))]
+
+    limiter.update(MESSAGES_CREATE, MockResponse(Remaining=3, Reset_After=5, Bucket='abc'), (1, ))
+    assert list(limiter.states) == [('abc', (1, ))]
+
+
+def test_global_rate_limit():
+    limiter = RateLimiter()
+    limiter.update(MESSAGES_CREATE, MockResponse(Global='true', Remaining=0, Reset_After=5), (1, ))
+    assert None in limiter.states
+
+
+def test_global_budget():
+    budget = GlobalBudget(rate=10, per=1)
+    assert budget.remaining == 10
+
+    for _ in range(10):
+        assert budget.reserve() == (0, budget.remaining)
+
+    # Once exhausted, reservations queue up behind each other
+    first, _ = budget.reserve()
+    second, remaining = budget.reserve()
+    assert 0.09 < first < 0.11
+    assert 0.19 < second < 0.21
+    assert remaining == 0
+
+
+def test_global_budget_acquire():
+    budget = GlobalBudget(rate=100, per=1)
+    budget.reserve(100)
+
+    start = time.time()
+    assert budget.acquire(2) > 0
+    assert time.time() - start >= 0.015
@@ -0,0 +1,69 @@
+import gevent
+
+from disco.api.scheduler import RequestScheduler, RequestPriority
+
+
+def run_requests(scheduler, requests):
+    """
+    Runs (priority, flow) requests against a single bucket whose first slot is
+    already taken, returning the order they were admitted in.
+    """
+    order = []
+
+    def request(i, priority, flow):
+        with scheduler.slot('bucket', priority, flow):
+            order.append(i)
+            gevent.sleep(0)
+
+    scheduler.acquire('bucket')
+    greenlets = [gevent.spawn(request, i, priority, flow) for i, (priority, flow) in enumerate(requests)]
+    gevent.sleep(0)
+
+    scheduler.release('bucket')
+    gevent.joinall(greenlets)
+    return order
+
+
+def test_priority_order():
+    scheduler = RequestScheduler(concurrency=1)
+    order = run_requests(scheduler, [
+        ('bulk', None),
+        (RequestPriority.BACKGROUND, None),
+        ('interactive', None),
+        ('bulk', None),
+    ])
+    assert order == [2, 1, 0, 3]
+    assert scheduler.buckets == {}
+
+
+def test_fair_between_flows():
+    scheduler = RequestScheduler(concurrency=1)
+    order = run_requests(scheduler, [('bulk', 'a')] * 3 + [('bulk', 'b')] * 2)
+    assert order == [0, 3, 1, 4, 2]
+
+
+def test_concurrency():
+    scheduler = RequestScheduler(concurrency=2)
+    assert scheduler.acquire('a') == 0
+    assert scheduler.acquire('a') == 0
+    assert scheduler.acquire('b') == 0
+
+    waiter = gevent.spawn(scheduler.acquire, 'a')
+    gevent.sleep(0)
+    assert scheduler.waiting == 1
+
+    scheduler.release('a')
+    assert waiter.get() > 0
+    assert scheduler.waiting == 0
+
+
+def test_interrupted_waiter():
+    scheduler = RequestScheduler(concurrency=1)
+    scheduler.acquire('a')
+
+    waiter = gevent.spawn(scheduler.acquire, 'a')
+    gevent.sleep(0)
+    waiter.kill()
+
+    scheduler.release('a')
+    assert scheduler.buckets == {}
@@ -0,0 +1,92 @@
+import gevent
+
+from holster.emitter import Emitter, Priority
+
+from disco.gateway.client import GatewayClient
+from disco.gateway.dispatch import DispatchScheduler
+from disco.gateway.packets import OPCode, RECV
+from disco.util.config import Config
+from disco.util.metrics import MetricsRegistry, timer
+from tests.utils import create_zlib_frames
+
+
+class MockClient(object):
+    def __init__(self, shard_id=0):
+        self.events = Emitter()
+        self.packets = Emitter()
+        self.config = Config()
+        self.config.shard_id = shard_id
+
+
+def get_gateway(**kwargs):
+    gw = GatewayClient(MockClient(), **kwargs)
+    received = []
+    gw.packets.on(
+        (RECV, OPCode.HEARTBEAT_ACK),
+        lambda packet: received.append(packet['s']),
+        priority=Priority.BEFORE)
+    return gw, received
+
+
+def test_gateway_on_message_zlib_stream():
+    gw, received = get_gateway()
+
+    for frame in create_zlib_frames(*[{'op': 11, 's': i, 'd': None} for i in range(1, 4)]):
+        gw.on_message(frame)
+
+    assert received == [1, 2, 3]
+    assert gw.seq == 3
+    assert gw.metrics.get('disco_gateway_frames_received').get(shard='0') == 3
+    assert gw.metrics.get('disco_gateway_decode_seconds').count(shard='0') == 3
+
+
+def test_gateway_on_message_offloaded_ordering():
+    gw, received = get_gateway(decode_offload_threshold=64)
+
+    messages = [{'op': 11, 's': i, 'd': 'x' * (i * 1000)} for i in range(1, 20)]
+    for frame in create_zlib_frames(*messages):
+        gw.on_message(frame)
+
+    assert received == list(range(1, 20))
+    assert gw.seq == 19
+
+
+def test_gateway_heartbeat_latency():
+    gw, _ = get_gateway(zlib_stream_enabled=False)
+    gw._heartbeat_sent_at = timer() - 0.05
+
+    gw.on_message('{"op": 11, "s": null, "d": null}')
+    gevent.sleep(0)
+
+    histogram = gw.metrics.get('disco_gateway_heartbeat_latency_seconds')
+    assert 0.05 <= gw.latency < 0.1
+    assert histogram.count(shard='0') == 1
+    assert histogram.sum(shard='0') == gw.latency
+
+
+def test_gateway_dispatch_errors_logged(caplog):
+    client = MockClient()
+    gw = GatewayClient(client, zlib_stream_enabled=False, dispatcher=DispatchScheduler(client.events))
+
+    gw.on_message('{"op": 0, "s": 1, "t": "NOT_AN_EVENT", "d": {}}')
+
+    assert gw.seq == 1
+    assert any('Failed to handle dispatch NOT_AN_EVENT' in record.getMessage() for record in caplog.records)
+
+
+def test_gateway_metrics_shared_registry():
+    metrics = MetricsRegistry()
+    first = GatewayClient(MockClient(0), zlib_stream_enabled=False, metrics=metrics)
+    second = GatewayClient(MockClient(1), zlib_stream_enabled=False, metrics=metrics)
+
+    first.on_message('{"op": 11, "s": 1, "d": null}')
+    second.on_message('{"op": 11, "s": 1, "d": null}')
+    second.on_message('{"op": 11, "s": 2, "d": null}')
+
+    frames = metrics.get('disco_gateway_frames_received')
+    assert frames.get(shard='0') == 1
+    assert frames.get(shard='1') == 2
+
+    rendered = metrics.render()
+    assert 'disco_gateway_send_wait_seconds{shard="0"}' in rendered
+    assert 'disco_gateway_send_wait_seconds{shard="1"}' in rendered
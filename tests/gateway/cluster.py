@@ -0,0 +1,48 @@
+import gevent
+
+from unittest import TestCase
+
+from disco.client import ClientConfig
+from disco.gateway.cluster import ShardCluster
+from disco.gateway.events import GatewayEvent
+
+
+def dispatch(client, name, data):
+    event = GatewayEvent.from_dispatch(client, {'t': name, 'd': data})
+    client.events.emit(event.__class__.__name__, event)
+    return event
+
+
+class TestShardCluster(TestCase):
+    def setUp(self):
+        self.cluster = ShardCluster(ClientConfig({'token': 'token', 'shard_count': 4}), [2, 3])
+
+    def test_clients_share_resources(self):
+        first, second = self.cluster.clients[2], self.cluster.clients[3]
+
+        self.assertEqual(first.config.shard_id, 2)
+        self.assertEqual(second.config.shard_id, 3)
+        self.assertIs(first.api.http, second.api.http)
+        self.assertIs(first.api.client, first)
+        self.assertIs(second.api.client, second)
+        self.assertIs(first.events, second.events)
+        self.assertIsNot(first.packets, second.packets)
+        self.assertIs(first.gw.identify_scheduler, second.gw.identify_scheduler)
+
+    def test_state_per_shard(self):
+        first, second = self.cluster.clients[2], self.cluster.clients[3]
+
+        dispatch(second, 'READY', {
+            'v': 6,
+            'session_id': 'abc',
+            'user': {'id': '1', 'username': 'disco', 'discriminator': '0001'},
+            'guilds': [],
+            'private_channels': [],
+            '_trace': [],
+        })
+        gevent.sleep(0)
+
+        self.assertIsNone(first.state.me)
+        self.assertEqual(second.state.me.id, 1)
+        self.assertIsNone(first.gw.session_id)
+        self.assertEqual(second.gw.session_id, 'abc')
@@ -0,0 +1,33 @@
+import json
+
+from disco.gateway.compression import ZlibStreamInflator, ZLIB_SUFFIX
+from tests.utils import create_zlib_frames
+
+
+def test_inflator_single_frame():
+    inflator = ZlibStreamInflator()
+
+    for idx, frame in enumerate(create_zlib_frames({'op': 1}, {'op': 2})):
+        assert frame.endswith(ZLIB_SUFFIX)
+        assert json.loads(inflator.feed(frame).decode('utf-8')) == {'op': idx + 1}
+
+
+def test_inflator_split_frames():
+    inflator = ZlibStreamInflator()
+    payload = {'op': 0, 'd': {'members': list(range(5000))}}
+    frame = create_zlib_frames(payload)[0]
+
+    chunks = [frame[i:i + 64] for i in range(0, len(frame), 64)]
+    for chunk in chunks[:-1]:
+        assert inflator.feed(chunk) is None
+
+    assert json.loads(inflator.feed(chunks[-1]).decode('utf-8')) == payload
+    assert not inflator._chunks
+
+
+def test_inflator_reset():
+    inflator = ZlibStreamInflator()
+    inflator.feed(create_zlib_frames({'op': 1})[0][:4])
+    inflator.reset()
+
+    assert inflator.feed(create_zlib_frames({'op': 3})[0]) == b'{"op": 3}'
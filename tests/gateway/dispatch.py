@@ -0,0 +1,117 @@
+import gevent
+import gevent.event
+
+from holster.emitter import Emitter, Priority
+
+from disco.gateway.dispatch import DispatchScheduler, DispatchOverflow
+
+
+class Event(object):
+    def __init__(self, guild_id, idx):
+        self.guild_id = guild_id
+        self.idx = idx
+
+
+def test_dispatch_scheduler_guild_ordering():
+    emitter = Emitter()
+    scheduler = DispatchScheduler(emitter, workers=4)
+
+    started = {1: [], 2: [], 3: []}
+    active = [0, 0]
+
+    def handler(event):
+        started[event.guild_id].append(event.idx)
+        active[0] += 1
+        active[1] = max(active)
+        gevent.sleep(0.001 * (3 - event.guild_id))
+        active[0] -= 1
+
+    emitter.on('Event', handler)
+
+    for idx in range(20):
+        for guild_id in started:
+            scheduler.emit('Event', Event(guild_id, idx))
+
+    gevent.sleep(0.2)
+    scheduler.stop()
+
+    for events in started.values():
+        assert events == list(range(20))
+
+    # At most one event per worker is handled at a time
+    assert active[1] <= 4
+    assert scheduler.depth == 0
+
+
+def test_dispatch_scheduler_slow_handler_does_not_stall_guild():
+    emitter = Emitter()
+    scheduler = DispatchScheduler(emitter, workers=2)
+
+    # The handler of the first event waits for the second event of its guild
+    second = gevent.event.Event()
+
+    def handler(event):
+        if event.idx == 0:
+            assert second.wait(timeout=1)
+        else:
+            second.set()
+
+    emitter.on('Event', handler)
+    scheduler.emit('Event', Event(1, 0))
+    scheduler.emit('Event', Event(1, 1))
+
+    gevent.sleep(0.05)
+    assert second.is_set()
+    assert scheduler.depth == 0
+    scheduler.stop()
+
+
+def test_dispatch_scheduler_before_listeners_inline():
+    emitter = Emitter()
+    scheduler = DispatchScheduler(emitter, workers=1)
+
+    seen = []
+    emitter.on('Event', lambda e: seen.append(e.idx), priority=Priority.BEFORE)
+    scheduler.emit('Event', Event(None, 1))
+
+    assert seen == [1]
+    scheduler.stop()
+
+
+def test_dispatch_scheduler_overflow():
+    emitter = Emitter()
+    scheduler = DispatchScheduler(
+        emitter,
+        workers=1,
+        max_queue_size=2,
+        overflow=DispatchOverflow.DROP_LOW_PRIORITY,
+        low_priority_events=['Presence'])
+
+    handled = []
+    emitter.on('Event', lambda e: handled.append(e.idx))
+    emitter.on('Presence', lambda e: handled.append(e.idx))
+
+    scheduler.emit('Event', Event(1, 1))
+    scheduler.emit('Event', Event(1, 2))
+    scheduler.emit('Presence', Event(1, 3))
+    assert scheduler.dropped == 1
+    assert scheduler.depth == 2
+
+    # Blocks until the worker has made space
+    scheduler.emit('Event', Event(1, 4))
+    gevent.sleep(0.01)
+
+    assert handled == [1, 2, 4]
+    scheduler.stop()
+
+
+def test_dispatch_scheduler_shed():
+    emitter = Emitter()
+    scheduler = DispatchScheduler(emitter, workers=1, max_queue_size=1, overflow='shed')
+    emitter.on('Event', lambda e: None)
+
+    for idx in range(5):
+        scheduler.emit('Event', Event(1, idx))
+
+    assert scheduler.dropped == 4
+    scheduler.stop()
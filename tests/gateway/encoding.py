@@ -0,0 +1,88 @@
+import os
+import pytest
+
+from disco.gateway.compression import ZlibStreamInflator
+from disco.gateway.encoding import JSON_BACKENDS, get_encoder, get_json_backend
+from disco.gateway.recorder import GatewayReplayer, FRAME_CONNECT, FRAME_TEXT
+
+
+def _available_backends():
+    for name in sorted(JSON_BACKENDS):
+        try:
+            get_json_backend(name)
+        except ImportError:
+            continue
+        yield name
+
+
+BACKENDS = list(_available_backends())
+
+
+# A recording (made with `disco.gateway.recorder.GatewayRecorder`) of a session
+#  joining a large guild. Set DISCO_GATEWAY_RECORDING to benchmark against
+#  another (gzip compressed) recording, e.g. one of a production shard.
+RECORDING = os.environ.get('DISCO_GATEWAY_RECORDING') or os.path.join(
+    os.path.dirname(__file__), 'fixtures', 'session.rec.gz')
+
+
+def load_recorded_messages(path):
+    """
+    Returns the raw (inflated) JSON messages within a gateway recording.
+    """
+    replayer = GatewayReplayer(path, compress=True)
+    inflator = ZlibStreamInflator()
+
+    messages = []
+    for _, flags, data in replayer.frames():
+        if flags & FRAME_CONNECT:
+            inflator.reset()
+        elif flags & FRAME_TEXT or not replayer.meta['zlib_stream']:
+            messages.append(data)
+        else:
+            data = inflator.feed(data)
+            if data is not None:
+                messages.append(data)
+
+    if replayer.meta['encoder'] != 'json':
+        pytest.skip('{} is not a JSON recording'.format(path))
+    return messages
+
+
+@pytest.fixture(scope='module')
+def recorded_message():
+    # The largest message of the session (generally a GUILD_CREATE or READY)
+    return max(load_recorded_messages(RECORDING), key=len)
+
+
+@pytest.fixture(scope='module')
+def recorded_payload(recorded_message):
+    return get_json_backend('json').loads(recorded_message)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_json_backend_roundtrip(backend, recorded_payload):
+    encoder = get_encoder('json', backend)
+    raw = encoder.encode(recorded_payload)
+
+    if not isinstance(raw, bytes):
+        raw = raw.encode('utf-8')
+
+    assert encoder.decode(raw) == recorded_payload
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_json_backend_invalid_data(backend):
+    with pytest.raises(ValueError):
+        get_json_backend(backend).loads(b'{"op": ')
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_json_backend_decode_performance(benchmark, backend, recorded_message):
+    encoder = get_encoder('json', backend)
+    benchmark(encoder.decode, recorded_message)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_json_backend_encode_performance(benchmark, backend, recorded_payload):
+    encoder = get_encoder('json', backend)
+    benchmark(encoder.encode, recorded_payload)
@@ -0,0 +1,119 @@
+import json
+import time
+import gevent
+import websocket
+
+from disco.gateway.fake import FakeGatewayServer, FakeGatewayConfig
+from disco.gateway.compression import ZlibStreamInflator
+from disco.util.snowflake import calculate_shard
+
+
+class GatewayConnection(object):
+    """
+    Minimal blocking gateway client, ran on the threadpool so the (gevent based)
+    fake server can keep serving from the hub.
+    """
+    def __init__(self, server):
+        self.ws = websocket.create_connection(server.url + '?v=6&encoding=json&compress=zlib-stream')
+        self.inflator = ZlibStreamInflator()
+
+    def recv(self):
+        while True:
+            data = self.inflator.feed(self.ws.recv())
+            if data is not None:
+                return json.loads(data.decode('utf-8'))
+
+    def send(self, op, data):
+        self.ws.send(json.dumps({'op': op, 'd': data}))
+
+
+def run_threaded(func):
+    return gevent.get_hub().threadpool.apply(func)
+
+
+def test_fake_gateway_identify_and_heartbeat():
+    server = FakeGatewayServer(FakeGatewayConfig({'guild_count': 3, 'members_per_guild': 10})).start()
+
+    def client():
+        conn = GatewayConnection(server)
+        packets = [conn.recv()]
+        conn.send(2, {'token': 'test', 'shard': [1, 4]})
+        packets += [conn.recv() for _ in range(4)]
+        conn.send(1, 4)
+        packets.append(conn.recv())
+        conn.ws.close()
+        return packets
+
+    packets = run_threaded(client)
+    hello, ready, guilds, ack = packets[0], packets[1], packets[2:5], packets[5]
+    server.stop()
+
+    assert hello['op'] == 10
+    assert ready['t'] == 'READY'
+    assert len(ready['d']['guilds']) == 3
+    assert [g['s'] for g in guilds] == [2, 3, 4]
+    assert all(calculate_shard(4, int(g['d']['id'])) == 1 for g in guilds)
+    assert len(guilds[0]['d']['members']) == 10
+    assert ack['op'] == 11
+    assert server.identifies == 1
+    assert server.heartbeats == 1
+
+
+def test_fake_gateway_resume():
+    server = FakeGatewayServer().start()
+
+    def client():
+        conn = GatewayConnection(server)
+        conn.recv()
+        conn.send(2, {'token': 'test'})
+        session_id = conn.recv()['d']['session_id']
+        conn.recv()
+        conn.ws.close()
+
+        conn = GatewayConnection(server)
+        conn.recv()
+        conn.send(6, {'token': 'test', 'session_id': session_id, 'seq': 2})
+        resumed = conn.recv()
+        conn.ws.close()
+
+        conn = GatewayConnection(server)
+        conn.recv()
+        conn.send(6, {'token': 'test', 'session_id': 'invalid', 'seq': 2})
+        invalid = conn.recv()
+        conn.ws.close()
+        return resumed, invalid
+
+    resumed, invalid = run_threaded(client)
+    server.stop()
+
+    assert resumed['t'] == 'RESUMED'
+    assert resumed['s'] == 3
+    assert invalid['op'] == 9
+    assert server.resumes == 1
+
+
+def test_fake_gateway_dispatch_rate():
+    server = FakeGatewayServer(FakeGatewayConfig({'dispatch_rate': 2000})).start()
+
+    def client():
+        conn = GatewayConnection(server)
+        conn.recv()
+
+        # The server only starts dispatching once it has received IDENTIFY
+        start = time.time()
+        conn.send(2, {'token': 'test'})
+        conn.recv()
+        conn.recv()
+
+        conn.ws.settimeout(10)
+        for _ in range(500):
+            assert conn.recv()['t'] == 'MESSAGE_CREATE'
+        elapsed = time.time() - start
+        conn.ws.close()
+        return elapsed
+
+    elapsed = run_threaded(client)
+    server.stop()
+
+    # The server never sends faster than its rate, however slowly we are scheduled
+    assert elapsed >= 499 / 2000.0
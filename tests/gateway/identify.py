@@ -0,0 +1,52 @@
+import time
+import gevent
+
+from unittest import TestCase
+
+from disco.gateway.identify import IdentifyScheduler
+
+
+class TestIdentifyScheduler(TestCase):
+    def run_shards(self, scheduler, shards):
+        start = time.time()
+        times = {}
+
+        def acquire(shard_id):
+            scheduler.acquire(shard_id)
+            times[shard_id] = time.time() - start
+
+        gevent.joinall([gevent.spawn(acquire, shard_id) for shard_id in shards])
+        return times
+
+    def test_buckets_identify_in_parallel(self):
+        scheduler = IdentifyScheduler.from_gateway_bot({
+            'shards': 4,
+            'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0, 'max_concurrency': 2},
+        }, interval=0.1)
+        self.assertEqual(scheduler.max_concurrency, 2)
+
+        times = self.run_shards(scheduler, range(4))
+
+        # Shards 0 and 1 are in different buckets, so neither waits
+        self.assertLess(times[0], 0.05)
+        self.assertLess(times[1], 0.05)
+
+        # Shards 2 and 3 wait for the first IDENTIFY within their bucket
+        self.assertGreaterEqual(times[2], 0.09)
+        self.assertGreaterEqual(times[3], 0.09)
+        self.assertLess(times[3], 0.15)
+        self.assertEqual(scheduler.remaining, 996)
+
+    def test_session_start_limit(self):
+        scheduler = IdentifyScheduler(1, interval=0, session_start_limit={
+            'total': 1000, 'remaining': 1, 'reset_after': 100,
+        })
+
+        times = self.run_shards(scheduler, range(2))
+        self.assertLess(times[0], 0.05)
+        self.assertGreaterEqual(times[1], 0.09)
+        self.assertEqual(scheduler.remaining, 999)
+
+    def test_acquire_async(self):
+        scheduler = IdentifyScheduler(1, interval=0)
+        self.assertTrue(scheduler.acquire_async(0).get(timeout=1))
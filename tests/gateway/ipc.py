@@ -0,0 +1,148 @@
+import gipc
+
+from gevent import Timeout
+from gevent.queue import Queue
+from unittest import TestCase
+
+from disco.gateway.ipc import GIPCProxy, IPCCodec, IPCError, IPCMessageType, CODEC_MARSHAL, CODEC_PICKLE, FRAME_HEADER
+
+
+class MockPipe(object):
+    def __init__(self, codec, inbox, outbox):
+        self.codec = codec
+        self.inbox = inbox
+        self.outbox = outbox
+        self.frames = 0
+
+    def put(self, message):
+        self.frames += 1
+        self.outbox.put(self.codec.dumps(message))
+
+    def get(self):
+        frame = self.inbox.get()
+        if frame is None:
+            raise EOFError()
+        return self.codec.loads(frame)
+
+
+class Target(object):
+    def add(self, a, b):
+        return a + b
+
+    def echo(self, value):
+        return value
+
+
+class Unmarshallable(object):
+    def __init__(self, value):
+        self.value = value
+
+
+class TestIPCCodec(TestCase):
+    def test_roundtrip(self):
+        codec = IPCCodec()
+        message = (IPCMessageType.CALL_FUNC.value, 7, (('add', ), (1, 2), {}))
+
+        frame = codec.dumps(message)
+        self.assertEqual(FRAME_HEADER.unpack_from(frame)[0], CODEC_MARSHAL)
+        self.assertEqual(codec.loads(frame), message)
+
+    def test_pickle_fallback(self):
+        codec = IPCCodec()
+        frame = codec.dumps((IPCMessageType.RESPONSE.value, 1, Unmarshallable(5)))
+
+        self.assertEqual(FRAME_HEADER.unpack_from(frame)[0], CODEC_PICKLE)
+        self.assertEqual(codec.loads(frame)[2].value, 5)
+
+    def test_batch(self):
+        codec = IPCCodec()
+        messages = [(IPCMessageType.RESPONSE.value, i, i * 2) for i in range(5)]
+        messages.append((IPCMessageType.RESPONSE.value, 5, None))
+
+        mtype, _, data = codec.loads(codec.dumps((IPCMessageType.BATCH.value, 0, messages)))
+        self.assertEqual(mtype, IPCMessageType.BATCH.value)
+        self.assertEqual(data, messages)
+
+
+class TestGIPCProxy(TestCase):
+    def test_batched_calls(self):
+        codec = IPCCodec()
+        a, b = Queue(), Queue()
+        client_pipe = MockPipe(codec, a, b)
+        server_pipe = MockPipe(codec, b, a)
+
+        client = GIPCProxy(None, client_pipe)
+        GIPCProxy(Target(), server_pipe)
+
+        results = [client.call(('add', ), i, 1) for i in range(10)]
+        self.assertEqual([result.get(timeout=1) for result in results], list(range(1, 11)))
+
+        # All requests (and all responses) were sent as a single frame each
+        self.assertEqual(client_pipe.frames, 1)
+        self.assertEqual(server_pipe.frames, 1)
+
+    def test_execute(self):
+        codec = IPCCodec()
+        a, b = Queue(), Queue()
+        client = GIPCProxy(None, MockPipe(codec, a, b))
+        GIPCProxy(Target(), MockPipe(codec, b, a))
+
+        self.assertEqual(client.execute(lambda target: target.add(2, 3)).get(timeout=1), 5)
+
+    def test_large_payloads(self):
+        # Frames larger than the pipe's buffer block while being written
+        codec = IPCCodec()
+        a, b = gipc.pipe(duplex=True, encoder=codec.dumps, decoder=codec.loads)
+        client = GIPCProxy(None, a)
+        GIPCProxy(Target(), b)
+
+        payload = b'x' * (2 * 1024 * 1024)
+        results = [client.call(('echo', ), payload) for _ in range(3)]
+        self.assertEqual([result.get(timeout=10) for result in results], [payload] * 3)
+
+    def test_timeout_drops_request(self):
+        codec = IPCCodec()
+        client = GIPCProxy(None, MockPipe(codec, Queue(), Queue()))
+
+        result = client.call(('add', ), 1, 2)
+        with self.assertRaises(Timeout):
+            result.get(timeout=0.01)
+        self.assertEqual(client.results, {})
+
+        result = client.call(('add', ), 1, 2)
+        result.wait(timeout=0.01)
+        self.assertEqual(client.results, {})
+
+    def test_closed_pipe_fails_requests(self):
+        codec = IPCCodec()
+        inbox = Queue()
+        client = GIPCProxy(None, MockPipe(codec, inbox, Queue()))
+
+        result = client.call(('add', ), 1, 2)
+        inbox.put(None)
+        with self.assertRaises(IPCError):
+            result.get(timeout=1)
+        self.assertEqual(client.results, {})
+
+    def test_undecodable_frame_skipped(self):
+        codec = IPCCodec()
+        a, b = Queue(), Queue()
+        client = GIPCProxy(None, MockPipe(codec, a, b))
+        GIPCProxy(Target(), MockPipe(codec, b, a))
+
+        a.put(b'garbage')
+        self.assertEqual(client.call(('add', ), 1, 2).get(timeout=1), 3)
+
+    def test_close(self):
+        codec = IPCCodec()
+        client = GIPCProxy(None, MockPipe(codec, Queue(), Queue()))
+
+        result = client.call(('add', ), 1, 2)
+        client.close()
+        with self.assertRaises(IPCError):
+            result.get(timeout=1)
+        with self.assertRaises(IPCError):
+            client.call(('add', ), 1, 2).get(timeout=1)
+
+        self.assertEqual(client.results, {})
+        self.assertTrue(all(loop.dead for loop in client._loops))
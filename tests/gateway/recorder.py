@@ -0,0 +1,51 @@
+from disco.client import Client, ClientConfig
+from disco.gateway.recorder import GatewayRecorder, GatewayReplayer
+from tests.utils import create_zlib_frames
+
+
+def create_resumed(seq):
+    return {'op': 0, 's': seq, 't': 'RESUMED', 'd': {'_trace': ['test']}}
+
+
+class MockWebsocket(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data, opcode):
+        self.sent.append(data)
+
+
+def record(path, compress):
+    client = Client(ClientConfig())
+    client.gw.ws = MockWebsocket()
+    recorder = GatewayRecorder(path, compress=compress).attach(client.gw)
+
+    for conn in range(2):
+        client.gw.on_open()
+        for frame in create_zlib_frames(*[create_resumed((conn * 10) + i) for i in range(1, 6)]):
+            client.gw.on_message(frame)
+
+    recorder.detach()
+    return recorder
+
+
+def test_gateway_record_and_replay(tmpdir):
+    for compress in (False, True):
+        path = str(tmpdir.join('gateway-{}.rec'.format(compress)))
+        recorder = record(path, compress)
+        assert recorder.frames == 12
+
+        client = Client(ClientConfig())
+        resumed = []
+        client.events.on('Resumed', lambda event: resumed.append(event))
+
+        replayer = GatewayReplayer(path, compress=compress)
+        stats = replayer.replay(client)
+
+        assert replayer.meta['encoder'] == 'json'
+        assert replayer.meta['zlib_stream']
+        assert stats.frames == 10
+        assert stats.events == 10
+        assert stats.summary()['RESUMED']['count'] == 10
+        assert len(resumed) == 10
+        assert client.gw.seq == 15
@@ -0,0 +1,131 @@
+import gevent
+
+from gevent.event import AsyncResult
+from unittest import TestCase
+
+from disco.gateway.remote import ShardStateProxy, dump_model, dump_state_lookups
+from disco.types.guild import Guild
+from disco.util.hashmap import HashMap
+from disco.util.snowflake import calculate_shard
+
+
+def create_guild(guild_id):
+    return Guild.create(None, {
+        'id': str(guild_id),
+        'name': 'Guild {}'.format(guild_id),
+        'channels': [{'id': '10', 'name': 'general', 'type': 0, 'guild_id': str(guild_id)}],
+        'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': 104324161}],
+        'members': [{
+            'user': {'id': '20', 'username': 'disco', 'discriminator': '0001'},
+            'roles': [],
+            'joined_at': '2017-01-01T00:00:00.000000+00:00',
+        }],
+    })
+
+
+class MockState(object):
+    def __init__(self, *guilds):
+        self.guilds = HashMap({guild.id: guild for guild in guilds})
+
+
+class MockClient(object):
+    def __init__(self, state):
+        self.state = state
+
+
+class MockBot(object):
+    def __init__(self, client):
+        self.client = client
+
+
+class MockShards(object):
+    """
+    Two shards, with shard 0 local and shard 1 remote.
+    """
+    count = 2
+
+    def __init__(self, local, remote):
+        self.bot = MockBot(MockClient(local))
+        self.remote = remote
+        self.calls = []
+
+    def is_local(self, sid):
+        return sid == 0
+
+    def get_bot(self, sid):
+        return self.bot
+
+    def call_on(self, sid, path, *args):
+        self.calls.append(args)
+        result = AsyncResult()
+        gevent.spawn(lambda: result.set(dump_state_lookups(self.remote, args[1])))
+        return result
+
+
+def guild_on_shard(shard_id, start=1):
+    return next(i << 22 for i in range(start, 100) if calculate_shard(2, i << 22) == shard_id)
+
+
+class TestShardStateProxy(TestCase):
+    def setUp(self):
+        self.local_id = guild_on_shard(0)
+        self.remote_id = guild_on_shard(1)
+        self.other_remote_id = guild_on_shard(1, (self.remote_id >> 22) + 1)
+
+        self.local = MockState(create_guild(self.local_id))
+        self.remote = MockState(create_guild(self.remote_id), create_guild(self.other_remote_id))
+        self.shards = MockShards(self.local, self.remote)
+        self.proxy = ShardStateProxy(self.shards, ttl=60)
+
+    def test_local_lookup(self):
+        self.assertIs(self.proxy.guild(self.local_id), self.local.guilds[self.local_id])
+        self.assertEqual(self.shards.calls, [])
+
+    def test_remote_lookup(self):
+        guild = self.proxy.guild(self.remote_id)
+        self.assertEqual(guild.name, 'Guild {}'.format(self.remote_id))
+        self.assertEqual(guild.channels[10].name, 'general')
+        self.assertEqual(len(guild.members), 0)
+
+        member = self.proxy.member(self.remote_id, 20)
+        self.assertEqual(member.user.username, 'disco')
+        self.assertEqual(member.joined_at.year, 2017)
+
+        self.assertIsNone(self.proxy.channel(self.remote_id, 11))
+
+    def test_remote_lookups_cached(self):
+        self.proxy.guild(self.remote_id)
+        self.proxy.guild(self.remote_id)
+        self.assertEqual(len(self.shards.calls), 1)
+
+        self.proxy.invalidate()
+        self.proxy.guild(self.remote_id)
+        self.assertEqual(len(self.shards.calls), 2)
+
+    def test_concurrent_lookups_batched(self):
+        greenlets = [
+            gevent.spawn(self.proxy.guild, self.remote_id),
+            gevent.spawn(self.proxy.guild, self.other_remote_id),
+            gevent.spawn(self.proxy.guild, self.remote_id),
+        ]
+        gevent.joinall(greenlets)
+
+        self.assertEqual(len(self.shards.calls), 1)
+        self.assertEqual(len(self.shards.calls[0][1]), 2)
+        self.assertIs(greenlets[0].value, greenlets[2].value)
+        self.assertEqual(greenlets[1].value.id, self.other_remote_id)
+
+    def test_failed_lookup_raises(self):
+        def call_on(sid, path, *args):
+            raise Exception('pipe closed')
+
+        self.shards.call_on = call_on
+        with self.assertRaises(Exception) as context:
+            self.proxy.guild(self.remote_id)
+        self.assertEqual(str(context.exception), 'pipe closed')
+
+    def test_dump_model_roundtrip(self):
+        guild = self.remote.guilds[self.remote_id]
+        data = dump_model(guild)
+        self.assertEqual(data['roles'][0]['permissions'], 104324161)
+        self.assertEqual(Guild.create(None, data).members[20].user.id, 20)
@@ -0,0 +1,101 @@
+import time
+import json
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from holster.emitter import Emitter
+
+from disco.gateway.client import GatewayClient
+from disco.gateway.packets import OPCode
+from disco.gateway.session import FileSessionStore
+from disco.util.config import Config
+
+
+class MockWebsocket(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data, opcode=None):
+        self.sent.append(json.loads(data))
+
+
+class MockClient(object):
+    def __init__(self):
+        self.events = Emitter()
+        self.packets = Emitter()
+        self.config = Config()
+        self.config.token = 'token'
+        self.config.shard_id = 1
+        self.config.shard_count = 4
+
+
+class TestFileSessionStore(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = FileSessionStore(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get_gateway(self, **kwargs):
+        gw = GatewayClient(MockClient(), zlib_stream_enabled=False, session_store=self.store, **kwargs)
+        gw.ws = MockWebsocket()
+        return gw
+
+    def test_store_roundtrip(self):
+        self.assertIsNone(self.store.load(1, 4))
+
+        self.store.save(1, 4, 'abc', 42)
+        session = self.store.load(1, 4)
+        self.assertEqual(session['session_id'], 'abc')
+        self.assertEqual(session['seq'], 42)
+        self.assertIsNone(self.store.load(0, 4))
+
+        # Saving again replaces the existing file
+        self.store.save(1, 4, 'abc', 43)
+        self.assertEqual(self.store.load(1, 4)['seq'], 43)
+
+        self.store.clear(1, 4)
+        self.assertIsNone(self.store.load(1, 4))
+
+    def test_restore_resumes(self):
+        self.store.save(1, 4, 'abc', 42)
+
+        gw = self.get_gateway()
+        self.assertTrue(gw.restore_session())
+        gw.on_open()
+
+        self.assertEqual(gw.ws.sent[0]['op'], OPCode.RESUME.value)
+        self.assertEqual(gw.ws.sent[0]['d']['session_id'], 'abc')
+        self.assertEqual(gw.ws.sent[0]['d']['seq'], 42)
+
+    def test_restore_expired_identifies(self):
+        self.store.save(1, 4, 'abc', 42)
+
+        gw = self.get_gateway(session_max_age=0)
+        time.sleep(0.01)
+        self.assertFalse(gw.restore_session())
+        gw.on_open()
+
+        self.assertEqual(gw.ws.sent[0]['op'], OPCode.IDENTIFY.value)
+
+    def test_invalid_session_clears_store(self):
+        self.store.save(1, 4, 'abc', 42)
+
+        gw = self.get_gateway()
+        gw.ws.close = lambda *args, **kwargs: None
+        gw.restore_session()
+        gw.handle_invalid_session(None)
+
+        self.assertIsNone(gw.session_id)
+        self.assertIsNone(self.store.load(1, 4))
+
+    def test_save_session(self):
+        gw = self.get_gateway()
+        gw.session_id = 'def'
+        gw.seq = 100
+        gw.save_session()
+
+        self.assertEqual(self.store.load(1, 4)['seq'], 100)
@@ -0,0 +1,261 @@
+import pytest
+import gevent
+
+from gevent.event import AsyncResult
+
+gipc = pytest.importorskip('gipc')
+
+from disco.api.http import HTTPClient  # noqa: E402
+from disco.gateway.ipc import GIPCProxy, IPCCodec  # noqa: E402
+from disco.gateway.sharder import (  # noqa: E402
+    AutoSharder, ShardHelper, ShardError, ShardTimeout, ShardSupervisor, GlobalBudgetProxy,
+)
+from disco.util.config import Config  # noqa: E402
+from disco.util.serializer import load_function  # noqa: E402
+
+
+class MockSharder(object):
+    """
+    Runs functions for remote shards after a per-shard delay.
+    """
+    def __init__(self, helper, delays):
+        self.helper = helper
+        self.delays = delays
+
+    def call(self, path, sid, raw, reducer=None, initial=None):
+        result = AsyncResult()
+
+        def respond():
+            func = load_function(raw)
+            try:
+                value = func(sid)
+                result.set((True, load_function(reducer)(initial, value) if reducer else value))
+            except Exception as e:
+                result.set((False, str(e)))
+
+        gevent.spawn_later(self.delays.get(sid, 0), respond)
+        return result
+
+
+class MockClient(object):
+    def __init__(self):
+        self.config = Config()
+        self.config.shard_id = 0
+
+
+class MockBot(object):
+    def __init__(self):
+        self.client = MockClient()
+
+
+def get_helper(delays):
+    bot = MockBot()
+    helper = ShardHelper(4, bot)
+    bot.sharder = MockSharder(helper, delays)
+    return helper
+
+
+def test_stream_yields_as_results_arrive():
+    helper = get_helper({1: 0.05, 2: 0.01, 3: 5})
+
+    results = list(helper.stream(lambda bot: 10, timeout=0.2))
+
+    assert [r.shard_id for r in results] == [0, 2, 1, 3]
+    assert [r.value for r in results] == [10, 10, 10, None]
+    assert results[1].latency < results[2].latency
+    assert isinstance(results[3].error, ShardTimeout)
+    assert results[3].latency is None
+
+
+def test_stream_reports_errors():
+    helper = get_helper({})
+
+    def func(bot):
+        if bot == 2:
+            raise ValueError('nope')
+        return 1
+
+    results = {r.shard_id: r for r in helper.stream(func, timeout=1)}
+    assert results[1].ok
+    assert isinstance(results[2].error, ShardError)
+    assert 'nope' in str(results[2].error)
+
+
+def test_reduce_and_all():
+    helper = get_helper({3: 5})
+
+    value, failed = helper.reduce(lambda bot: 5, lambda a, b: a + b, 0, timeout=0.1)
+    assert value == 15
+    assert [r.shard_id for r in failed] == [3]
+
+    # Shards reduce their own results, the caller combines the partial results
+    value, _ = helper.reduce(
+        lambda bot: [bot] * 3, lambda total, items: total + len(items), 0, timeout=0.1, combiner=lambda a, b: a + b)
+    assert value == 9
+
+    assert helper.all(lambda bot: 1, timeout=0.1) == {0: 1, 1: 1, 2: 1, 3: None}
+
+
+class MockProcess(object):
+    def __init__(self):
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.exitcode is None
+
+
+class MockProxy(object):
+    def __init__(self, health):
+        self.health = health
+        self.calls = []
+
+    def call(self, path):
+        self.calls.append(path)
+        result = AsyncResult()
+        if path[-1] == 'save_sessions':
+            result.set(True)
+        elif self.health is not None:
+            result.set(self.health)
+        return result
+
+
+class MockAutoSharder(object):
+    def __init__(self, health):
+        self.processes = {0: MockProcess()}
+        self.shards = {0: MockProxy(health)}
+        self.groups = {0: [0, 1]}
+        self.started = []
+        self.stopped = []
+
+    def stop_shard(self, key):
+        self.stopped.append(key)
+
+    def start_shard(self, shard_ids):
+        self.started.append(shard_ids)
+        self.processes[shard_ids[0]] = MockProcess()
+
+
+def get_health(latency=0.1, idle=1):
+    return {
+        'pid': 1,
+        'memory': 50 * 1024 * 1024,
+        'shards': {0: {'latency': latency, 'idle': idle, 'seq': 1, 'session_id': 'a'}},
+    }
+
+
+def test_supervisor_healthy():
+    sharder = MockAutoSharder(get_health())
+    supervisor = ShardSupervisor(sharder, timeout=0.01, max_memory=100)
+
+    for _ in range(5):
+        supervisor.tick()
+
+    assert sharder.stopped == []
+    assert supervisor.health[0]['memory'] == 50 * 1024 * 1024
+
+
+def test_supervisor_restarts_after_failures():
+    sharder = MockAutoSharder(get_health(latency=30))
+    supervisor = ShardSupervisor(sharder, timeout=0.01, failures=2, backoff=0)
+
+    supervisor.tick()
+    gevent.sleep(0)
+    assert sharder.stopped == []
+
+    supervisor.tick()
+    gevent.sleep(0.01)
+    assert sharder.stopped == [0]
+    assert sharder.started == [[0, 1]]
+
+    # Sessions are saved before the process is stopped
+    assert sharder.shards[0].calls[-1] == ('shards', 'save_sessions')
+
+
+def test_supervisor_restarts_dead_process_with_backoff():
+    sharder = MockAutoSharder(None)
+    supervisor = ShardSupervisor(sharder, timeout=0.01, backoff=0.05)
+    sharder.processes[0].exitcode = 1
+
+    supervisor.tick()
+    gevent.sleep(0.01)
+    assert sharder.stopped == [0]
+    assert sharder.started == []
+
+    gevent.sleep(0.06)
+    assert sharder.started == [[0, 1]]
+    assert supervisor._restarts[0] == 1
+
+
+def test_supervisor_health_check_timeout():
+    sharder = MockAutoSharder(None)
+    supervisor = ShardSupervisor(sharder, timeout=0.01)
+    assert supervisor.get_problems(0) == ['health check timed out']
+
+
+class UnresponsiveSharder(object):
+    def call(self, path, *args):
+        return AsyncResult()
+
+
+def test_global_budget_proxy_fallback():
+    budget = GlobalBudgetProxy(UnresponsiveSharder(), rate=50, fallback_rate=2, timeout=0.01)
+
+    # Metrics can be rendered before any request is made
+    http = HTTPClient(None, budget=budget)
+    assert 'disco_http_global_budget_remaining 50' in http.metrics.render()
+
+    # The parent does not respond, so the local budget is used instead
+    assert budget.acquire() == 0
+    assert budget.acquire() == 0
+    assert budget.remaining == 0
+    assert budget.acquire() > 0
+
+
+def test_reduce_over_ipc():
+    """
+    Runs functions on shards 1-3 of another process, through the parent's
+    `AutoSharder.run_on` and the shard's `ShardHelper.run_local`, over real pipes.
+    """
+    codec = IPCCodec()
+
+    def pipe():
+        return gipc.pipe(duplex=True, encoder=codec.dumps, decoder=codec.loads)
+
+    sharder = AutoSharder.__new__(AutoSharder)
+
+    # The process running shards 1-3, whose bot has 3 guilds on each shard
+    remote = MockBot()
+    remote.guilds = [1, 2, 3]
+    remote.shards = ShardHelper(4, remote)
+    remote.sharder, parent_end = pipe()
+    GIPCProxy(remote, remote.sharder)
+    proxy = GIPCProxy(sharder, parent_end)
+    sharder.shards = {sid: proxy for sid in (1, 2, 3)}
+
+    # The process running shard 0, which makes the call
+    local = MockBot()
+    local.guilds = [1]
+    child_end, parent_end = pipe()
+    local.sharder = GIPCProxy(local, child_end)
+    GIPCProxy(sharder, parent_end)
+    helper = ShardHelper(4, local)
+
+    sent = []
+    run_local = remote.shards.run_local
+
+    def spy(*args):
+        result = run_local(*args)
+        sent.append(result)
+        return result
+
+    remote.shards.run_local = spy
+
+    value, failed = helper.reduce(
+        lambda bot: bot.guilds, lambda total, guilds: total + len(guilds), 0, timeout=5,
+        combiner=lambda a, b: a + b)
+
+    assert failed == []
+    assert value == 10
+
+    # Only the reduced partial results were sent back from the shards
+    assert sent == [(True, 3)] * 3
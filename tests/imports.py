@@ -2,18 +2,30 @@
 This module tests that all of disco can be imported, mostly to help reduce issues
 with untested code that will not even parse/run on Py2/3
 """
+from disco.api.cache import *
 from disco.api.client import *
 from disco.api.http import *
+from disco.api.multipart import *
+from disco.api.pipeline import *
 from disco.api.ratelimit import *
+from disco.api.scheduler import *
 from disco.bot.bot import *
 from disco.bot.command import *
 from disco.bot.parser import *
 from disco.bot.plugin import *
 from disco.bot.storage import *
 from disco.gateway.client import *
+from disco.gateway.cluster import *
+from disco.gateway.dispatch import *
+from disco.gateway.compression import *
 from disco.gateway.events import *
+from disco.gateway.fake import *
+from disco.gateway.identify import *
 from disco.gateway.ipc import *
 from disco.gateway.packets import *
+from disco.gateway.recorder import *
+from disco.gateway.remote import *
+from disco.gateway.session import *
 # Not imported, GIPC is required but not provided by default
 # from disco.gateway.sharder import *
 from disco.types.base import *
@@ -31,8 +43,10 @@ from disco.util.functional import *
 from disco.util.hashmap import *
 from disco.util.limiter import *
 from disco.util.logging import *
+from disco.util.metrics import *
 from disco.util.serializer import *
 from disco.util.snowflake import *
+from disco.util.usercache import *
 from disco.util.websocket import *
 from disco.voice.client import *
 from disco.voice.opus import *
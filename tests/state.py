@@ -37,3 +37,49 @@ def test_state_remove_expired_voice_states_device_change():
     assert len(state.voice_states) == 1
     assert 'a' not in state.voice_states
     assert 'b' in state.voice_states
+
+
+class MockResponse(object):
+    status_code = 200
+    headers = {}
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class MockSession(object):
+    def __init__(self, routes):
+        self.routes = routes
+
+    def request(self, method, url, **kwargs):
+        return MockResponse(self.routes[url.split('/v7', 1)[-1]])
+
+
+def test_state_seed():
+    from disco.api.client import APIClient
+    from disco.util.config import Config
+
+    client = MockClient()
+    client.config = Config()
+    client.config.shard_id = 0
+    client.config.shard_count = 1
+    client.api = APIClient(None)
+    client.api.client = client
+    client.api.http.session = MockSession({
+        '/users/@me': {'id': '1', 'username': 'disco', 'discriminator': '0001'},
+        '/users/@me/guilds': [{'id': '2', 'name': 'test'}],
+        '/guilds/2': {'id': '2', 'name': 'test', 'roles': []},
+        '/guilds/2/channels': [{'id': '3', 'name': 'general', 'type': 0}],
+    })
+
+    state = get_state()
+    state.client = client
+    state.seed()
+    assert state.me.username == 'disco'
+
+    assert state.ready.wait(timeout=1)
+    assert state.guilds[2].name == 'test'
+    assert state.channels[3].guild_id == 2
@@ -1,8 +1,11 @@
 import time
 import gevent
+import gevent.lock
 from unittest import TestCase
 
-from disco.util.limiter import SimpleLimiter
+from disco.util.limiter import (
+    SimpleLimiter, SlidingWindowLimiter, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW,
+)
 
 
 class TestSimpleLimiter(TestCase):
@@ -43,3 +46,46 @@ class TestSimpleLimiter(TestCase):
             limit.check()
 
         self.assertEqual(int(time.time() - start), 1)
+
+
+class TestSlidingWindowLimiter(TestCase):
+    def test_no_greenlet_per_check(self):
+        limit = SlidingWindowLimiter(50, 1)
+
+        for _ in range(50):
+            limit.check()
+
+        self.assertIsNone(limit._releaser)
+        self.assertEqual(limit.waiting, 0)
+        self.assertGreater(limit.wait_time(), 0.9)
+
+    def test_priority_order(self):
+        limit = SlidingWindowLimiter(2, 0.5)
+        limit.check()
+        limit.check()
+
+        order = []
+
+        def check(name, priority):
+            limit.check(priority)
+            order.append(name)
+
+        greenlets = [
+            gevent.spawn(check, 'low', PRIORITY_LOW),
+            gevent.spawn(check, 'normal', PRIORITY_NORMAL),
+            gevent.spawn(check, 'high', PRIORITY_HIGH),
+        ]
+        gevent.joinall(greenlets)
+
+        self.assertEqual(order, ['high', 'normal', 'low'])
+
+    def test_reserved_for_high_priority(self):
+        limit = SlidingWindowLimiter(3, 10, reserved=1)
+        limit.check()
+        limit.check()
+
+        start = time.time()
+        limit.check(PRIORITY_HIGH)
+
+        self.assertLess(time.time() - start, 0.1)
+        self.assertGreater(limit.wait_time(PRIORITY_NORMAL), 9)
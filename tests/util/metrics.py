@@ -0,0 +1,46 @@
+from disco.util.metrics import MetricsRegistry
+
+
+def test_metrics_counter():
+    registry = MetricsRegistry()
+    counter = registry.counter('test_events', 'Events', labels=('event', ))
+    counter.inc(event='A')
+    counter.inc(2, event='B')
+
+    assert registry.counter('test_events') is counter
+    assert counter.get(event='B') == 2
+    assert 'test_events_total{event="A"} 1.0' in registry.render()
+
+
+def test_metrics_gauge_func():
+    registry = MetricsRegistry()
+    registry.gauge('test_depth', 'Depth', func=lambda: 5)
+
+    assert '# TYPE test_depth gauge\ntest_depth 5.0' in registry.render()
+
+
+def test_metrics_gauge_labelled_funcs():
+    registry = MetricsRegistry()
+    registry.gauge('test_depth', 'Depth', labels=('shard', )).set_function(lambda: 1, shard='0')
+    registry.gauge('test_depth', 'Depth', labels=('shard', )).set_function(lambda: 2, shard='1')
+
+    assert registry.get('test_depth').get(shard='1') == 2
+    assert 'test_depth{shard="0"} 1.0\ntest_depth{shard="1"} 2.0' in registry.render()
+
+
+def test_metrics_histogram():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('test_latency', 'Latency', buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    with histogram.time():
+        pass
+
+    rendered = registry.render()
+    assert histogram.count() == 4
+    assert 'test_latency_bucket{le="0.1"} 2' in rendered
+    assert 'test_latency_bucket{le="1.0"} 3' in rendered
+    assert 'test_latency_bucket{le="+Inf"} 4' in rendered
+    assert 'test_latency_count 4' in rendered
@@ -0,0 +1,84 @@
+import os
+
+from holster.emitter import Emitter
+
+from disco.state import State, StateConfig
+from disco.types.user import User
+from disco.util.usercache import SharedUserCache
+
+
+def create_user(user_id, username='disco', avatar=None, bot=False):
+    return User.create(None, {
+        'id': str(user_id),
+        'username': username,
+        'discriminator': '0042',
+        'avatar': avatar,
+        'bot': bot,
+    })
+
+
+def test_shared_user_cache_put_get(tmpdir):
+    cache = SharedUserCache(str(tmpdir.join('users')), capacity=64)
+
+    assert cache.get(1) is None
+
+    cache.put(create_user(1, avatar='a_abc', bot=True))
+    user = cache.get(1)
+    assert user.username == 'disco'
+    assert user.discriminator == '0042'
+    assert user.avatar == 'a_abc'
+    assert user.bot
+
+    cache.put(create_user(1, username=u'd\xefsco'))
+    user = cache.get(1)
+    assert user.username == u'd\xefsco'
+    assert user.avatar is None
+    assert not user.bot
+
+    # Usernames longer than the record are cut on a character boundary
+    cache.put(create_user(1, username=u'\u00ef' * 33))
+    assert cache.get(1).username == u'\u00ef' * 32
+
+    # Partial users don't replace the stored user
+    cache.put(User.create(None, {'id': '1'}))
+    assert cache.get(1).username == u'\u00ef' * 32
+
+
+def test_shared_user_cache_full(tmpdir):
+    cache = SharedUserCache(str(tmpdir.join('users')), capacity=8)
+
+    for user_id in range(1, 101):
+        cache.put(create_user(user_id))
+
+    # The table only holds its capacity, but the latest user is always stored
+    assert cache.get(100).id == 100
+    assert len([i for i in range(1, 101) if cache.get(i)]) <= 8
+
+
+def test_shared_user_cache_shared_between_instances(tmpdir):
+    path = str(tmpdir.join('users'))
+    first = SharedUserCache(path, capacity=64)
+    second = SharedUserCache(path, capacity=1024)
+
+    assert second.capacity == 64
+    assert os.path.getsize(path) == 64 + (64 * 128)
+
+    first.put(create_user(20))
+    assert second.get(20).username == 'disco'
+
+
+class MockClient(object):
+    def __init__(self):
+        self.events = Emitter()
+
+
+def test_state_shared_users(tmpdir):
+    config = StateConfig({'shared_users_path': str(tmpdir.join('users'))})
+    first = State(MockClient(), config)
+    second = State(MockClient(), config)
+
+    first.users[20] = create_user(20)
+    assert 20 not in second.users
+    assert second.users[20].username == 'disco'
+    assert second.users.get(20).discriminator == '0042'
+    assert second.users.get(21) is None
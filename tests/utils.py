@@ -1,3 +1,5 @@
+import zlib
+import json
 import time
 import random
 
@@ -23,3 +25,14 @@ def random_snowflake():
     return from_timestamp_ms(
         (time.time() * 1000.0) + random.randint(1, 9999)
     )
+
+
+def create_zlib_frames(*messages):
+    """
+    Encodes gateway messages as the frames of a single zlib-stream.
+    """
+    compressor = zlib.compressobj()
+    return [
+        compressor.compress(json.dumps(msg).encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        for msg in messages
+    ]